@@ -1,5 +1,5 @@
 
-from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context, redirect
 import os
 import json
 import subprocess
@@ -8,25 +8,56 @@ import uuid
 import threading
 import logging
 import glob
-import tempfile
 import re
 import base64
 import select
 import pytz
+import sys
+import atexit
+import itertools
 from logging.handlers import RotatingFileHandler
+from logging_pipeline import SUBSYSTEM_LOGGERS, parse_log_levels, start_log_pipeline
 from werkzeug.utils import secure_filename
 from routes.auth_routes import auth_bp
 from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode, urlsplit
 from routes.auth_routes import get_current_user
 #from routes.db_routes import db_routes
 # Import DB routes
-from routes.db_routes import db_routes
+from routes.db_routes import db_routes, run_sql_deployment_job
 from routes.template_routes import template_bp
+from storage.history_journal import HistoryJournal
+from storage.history_backups import HistoryBackups
+from storage.serialization import SnapshotFormatError, read_snapshot
+from storage.deployment_repository import DeploymentRepository, normalize_timestamp
+from storage.history_flusher import HistoryFlusher
+from storage.log_segments import LogSegmentStore
+from storage.log_records import (LogRecordStore, LogSearchError, RECORD_FILTERS, matches_record_filters,
+                                 parse_log_records)
+from storage.lazy_deployments import LazyDeploymentDict
+from storage.file_lock import FileLock
+from storage.deployment_registry import DeploymentRegistry, FINISHED_STATUSES
+from storage.log_buffers import LogBuffers
+from storage.job_queue import JobQueue
+from execution.job_scheduler import JobScheduler, JobQueueFullError
+from execution.host_slots import HostSlots
+from execution.ansible_executor import ANSIBLE_EXECUTION_BACKEND, PlaybookProgress, create_executor
+from execution.playbook_library import playbook_command, write_extra_vars
+from execution.inventory_cache import InventoryCache
+from streaming.log_stream_hub import LogStreamHub, StreamLimitError
+from streaming.async_log_server import AsyncLogServer, LOG_STREAM_ASYNC_PORT, LOG_STREAM_PUBLIC_URL
+from storage.history_archive import (HistoryArchive, HISTORY_ARCHIVE_INTERVAL, HISTORY_RETENTION_DAYS,
+                                     archive_cutoff, day_start, merge_newest_first, partition_day)
 # Register the blueprint
 #app.register_blueprint(db_blueprint, url_prefix='/api')
 
 #retore_save_checkpoint
 
+# When started as `python backend/app.py` this module is __main__; blueprints that do
+# `from app import deployments` must get this instance instead of re-executing the file
+# with a second, independent deployments dict and history journal.
+sys.modules.setdefault('app', sys.modules[__name__])
+
 app = Flask(__name__, static_folder='../frontend/dist')
 
 
@@ -45,6 +76,18 @@ FIX_FILES_DIR = os.environ.get('FIX_FILES_DIR', '/app/fixfiles')
 DEPLOYMENT_LOGS_DIR = os.environ.get('DEPLOYMENT_LOGS_DIR', '/app/logs')
 APP_LOG_FILE = os.environ.get('APP_LOG_FILE', os.path.join(DEPLOYMENT_LOGS_DIR, 'application.log'))
 DEPLOYMENT_HISTORY_FILE = os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history.json')
+DEPLOYMENT_HISTORY_JOURNAL = os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history.journal')
+DEPLOYMENT_DB_FILE = os.environ.get('DEPLOYMENT_DB_FILE', os.path.join(DEPLOYMENT_LOGS_DIR, 'deployments.db'))
+DEPLOYMENT_LOG_SEGMENTS_DIR = os.environ.get('DEPLOYMENT_LOG_SEGMENTS_DIR', os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_logs'))
+DEPLOYMENT_LOG_DB_FILE = os.environ.get('DEPLOYMENT_LOG_DB_FILE', os.path.join(DEPLOYMENT_LOGS_DIR, 'log_records.db'))
+DEPLOYMENT_HISTORY_ARCHIVE_DIR = os.environ.get('DEPLOYMENT_HISTORY_ARCHIVE_DIR', os.path.join(DEPLOYMENT_LOGS_DIR, 'history_archive'))
+DEPLOYMENT_HISTORY_BACKUP_DIR = os.environ.get('DEPLOYMENT_HISTORY_BACKUP_DIR', os.path.join(DEPLOYMENT_LOGS_DIR, 'history_backups'))
+DEPLOYMENT_JOB_DB_FILE = os.environ.get('DEPLOYMENT_JOB_DB_FILE', os.path.join(DEPLOYMENT_LOGS_DIR, 'jobs.db'))
+# 'local': this process is the only one using DEPLOYMENT_LOGS_DIR
+# 'shared': several orchestrator processes share DEPLOYMENT_LOGS_DIR and see each other's deployments
+DEPLOYMENT_STATE_BACKEND = os.environ.get('DEPLOYMENT_STATE_BACKEND', 'local')
+if DEPLOYMENT_STATE_BACKEND not in ('local', 'shared'):
+    raise ValueError(f"DEPLOYMENT_STATE_BACKEND must be 'local' or 'shared', not {DEPLOYMENT_STATE_BACKEND!r}")
 
 
 # Configure application logging
@@ -79,18 +122,42 @@ file_handler.setLevel(logging.DEBUG)
 file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 file_handler.setFormatter(file_format)
 
-# Add handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# Per-subsystem levels, e.g. LOG_LEVELS="output=INFO,storage=WARNING" (see logging_pipeline.SUBSYSTEM_LOGGERS)
+LOG_LEVELS = parse_log_levels(os.environ.get('LOG_LEVELS', ''))
 
-logger.info("Starting Fix Deployment Orchestrator with enhanced logging")
-logger.debug(f"Application environment: FLASK_ENV={os.environ.get('FLASK_ENV', 'production')}")
-logger.debug(f"Fix files directory: {FIX_FILES_DIR}")
-logger.debug(f"Deployment logs directory: {DEPLOYMENT_LOGS_DIR}")
-logger.debug(f"Application log file: {APP_LOG_FILE}")
+# Handlers run on a listener thread; logging calls only queue the record, so workers never wait on file I/O or rotation
+log_listener = start_log_pipeline(logger, [console_handler, file_handler], LOG_LEVELS)
+# Records are handled above; without this the root handler routes.db_routes installs would write them all again
+logger.propagate = False
 
-# Dictionary to store deployment information
-deployments = {}
+# Deployment and command output lines (DEBUG); LOG_LEVELS="output=INFO" leaves them to the deployment logs only
+output_logger = logging.getLogger(SUBSYSTEM_LOGGERS['output'])
+
+logger.info("Starting Fix Deployment Orchestrator with enhanced logging")
+logger.debug("Application environment: FLASK_ENV=%s", os.environ.get('FLASK_ENV', 'production'))
+logger.debug("Fix files directory: %s", FIX_FILES_DIR)
+logger.debug("Deployment logs directory: %s", DEPLOYMENT_LOGS_DIR)
+logger.debug("Application log file: %s", APP_LOG_FILE)
+
+# Indexed metadata store backing the history endpoints and the on-demand loading of deployments
+startup_started = time.time()
+deployment_repository = DeploymentRepository(DEPLOYMENT_DB_FILE)
+
+# Day partitions of finished deployments that have aged out of the repository
+history_archive = HistoryArchive(DEPLOYMENT_HISTORY_ARCHIVE_DIR)
+
+def load_deployment_record(deployment_id):
+    """Record of a deployment not in memory: from the repository, or from its archive partition"""
+    deployment = deployment_repository.get(deployment_id)
+    if deployment is None:
+        day = deployment_repository.archived_day(deployment_id)
+        if day is not None:
+            deployment = history_archive.get(deployment_id, day)
+    return deployment
+
+# Dictionary to store deployment information; records not used since startup are loaded from the repository on access.
+# With the shared backend only this process's own deployments stay in memory; others are re-read on every access.
+deployments = LazyDeploymentDict(load_deployment_record, cache=DEPLOYMENT_STATE_BACKEND != 'shared')
 
 # Store deployments in app config so it can be accessed via current_app
 app.config['deployments'] = deployments
@@ -98,137 +165,527 @@ app.config['deployments'] = deployments
 app.deployments = deployments
 
 # Functions to save and access deployment data
-def save_deployment_history():
+def save_deployment_history(deployment_id=None):
     """Save deployment history to file"""
-    app.config.get('save_deployment_history_func', lambda: None)()
+    app.config.get('save_deployment_history_func', lambda d=None: None)(deployment_id)
 
 def log_message(deployment_id, message):
     """Log a message to deployment logs"""
     app.config.get('log_message_func', lambda d, m: None)(deployment_id, message)
 
-# Try to load previous deployments if they exist
-try:
-    if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-        with open(DEPLOYMENT_HISTORY_FILE, 'r') as f:
+# Full snapshots plus journal deltas, hardlinked at each compaction
+history_backups = HistoryBackups(DEPLOYMENT_HISTORY_BACKUP_DIR)
+
+# Append-only journal of history changes; compacted into DEPLOYMENT_HISTORY_FILE in the background
+history_journal = HistoryJournal(DEPLOYMENT_HISTORY_FILE, DEPLOYMENT_HISTORY_JOURNAL, backups=history_backups)
+
+def restore_history_from_backups():
+    """Rebuild deployments from the latest backup; returns False if there is none"""
+    try:
+        deployments.update(history_backups.restore())
+    except FileNotFoundError:
+        return False
+    logger.info("Restored %s deployments from history backups in %s", len(deployments), DEPLOYMENT_HISTORY_BACKUP_DIR)
+    return True
+
+def load_history_snapshot():
+    """Load the whole history snapshot (or its backups) and the journal into ``deployments``"""
+    try:
+        if os.path.exists(DEPLOYMENT_HISTORY_FILE):
             try:
-                deployments = json.load(f)
-                logger.info(f"Loaded {len(deployments)} previous deployments from history file")
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing deployment history file: {str(e)}")
+                # Any snapshot format is accepted; the next compaction rewrites it in HISTORY_SNAPSHOT_FORMAT
+                deployments.update(read_snapshot(DEPLOYMENT_HISTORY_FILE))
+                logger.info("Loaded %s previous deployments from history file", len(deployments))
+            except SnapshotFormatError as e:
+                logger.error("Error parsing deployment history file: %s", e)
                 # Create a backup of the corrupted file
                 backup_file = os.path.join(DEPLOYMENT_LOGS_DIR, f'deployment_history_corrupt_{int(time.time())}.json')
                 os.rename(DEPLOYMENT_HISTORY_FILE, backup_file)
-                logger.info(f"Renamed corrupted history file to {backup_file}")
-                deployments = {}
-    else:
-        # Look for backup history files in the logs directory
-        backup_files = sorted(glob.glob(os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history_*.json')), reverse=True)
-        if backup_files:
-            logger.info(f"Found {len(backup_files)} backup deployment history files, loading most recent")
-            for backup_file in backup_files:
-                try:
-                    with open(backup_file, 'r') as f:
-                        deployments = json.load(f)
-                    logger.info(f"Loaded {len(deployments)} previous deployments from backup file {backup_file}")
-                    break
-                except (json.JSONDecodeError, Exception) as e:
-                    logger.error(f"Error loading from backup file {backup_file}: {str(e)}")
-                    continue
+                logger.info("Renamed corrupted history file to %s", backup_file)
+                deployments.clear()
+                restore_history_from_backups()
+        elif restore_history_from_backups():
+            pass
         else:
-            logger.info("No deployment history file found, creating new one")
-            # Create an empty history file
-            with open(DEPLOYMENT_HISTORY_FILE, 'w') as f:
-                json.dump({}, f)
-except Exception as e:
-    logger.error(f"Failed to load deployment history: {str(e)}")
+            # Look for backup history files written by older versions in the logs directory
+            backup_files = sorted(glob.glob(os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history_*.json')), reverse=True)
+            if backup_files:
+                logger.info("Found %s backup deployment history files, loading most recent", len(backup_files))
+                for backup_file in backup_files:
+                    try:
+                        deployments.update(read_snapshot(backup_file))
+                        logger.info("Loaded %s previous deployments from backup file %s", len(deployments), backup_file)
+                        break
+                    except (json.JSONDecodeError, Exception) as e:
+                        logger.error("Error loading from backup file %s: %s", backup_file, e)
+                        continue
+            else:
+                logger.info("No deployment history file found, creating new one")
+                # Create an empty history file
+                with open(DEPLOYMENT_HISTORY_FILE, 'w') as f:
+                    json.dump({}, f)
+    except Exception as e:
+        logger.error("Failed to load deployment history: %s", e)
 
-# Load inventory from file or create a default one
-INVENTORY_FILE = os.environ.get('INVENTORY_FILE', '/app/inventory/inventory.json')
-os.makedirs(os.path.dirname(INVENTORY_FILE), exist_ok=True)
+    # Apply changes journaled since the snapshot was last compacted
+    try:
+        history_journal.replay(deployments)
+    except Exception as e:
+        logger.error("Failed to replay deployment history journal: %s", e)
 
-try:
-    with open(INVENTORY_FILE, 'r') as f:
-        inventory = json.load(f)
-    logger.info(f"Loaded inventory with {len(inventory.get('vms', []))} VMs")
-except (FileNotFoundError, json.JSONDecodeError) as e:
-    logger.error(f"Error loading inventory: {str(e)} - Please create/fix inventory.json manually")
-    inventory = {"vms": [], "users": [], "systemd_services": []}
-    # Don't save the empty inventory - let user create it manually
 
-# Function to save deployment history with backup
+# Per-deployment log files; the history itself only keeps log_count
+log_segments = LogSegmentStore(DEPLOYMENT_LOG_SEGMENTS_DIR)
 
+# Log lines parsed into (seq, ts, host, task, level, stream, text) records, indexed for host/level/task filters
+log_records = LogRecordStore(DEPLOYMENT_LOG_DB_FILE)
 
-def save_deployment_history():
-    try:
-        logger.info(f"Starting to save deployment history. Current deployments count: {len(deployments)}")
-        
-        # Ensure the deployment logs directory exists
+def load_deployment_index():
+    """Bring the repository up to date with the journal (building it from the snapshot on first start)"""
+    migrated_logs = []
+    if deployment_repository.get_meta('history_index') == 'ready':
+        # The repository already holds the history; only apply what was journaled after its last update
         try:
-            os.makedirs(DEPLOYMENT_LOGS_DIR, exist_ok=True)
-            logger.debug(f"Ensured directory exists: {DEPLOYMENT_LOGS_DIR}")
+            # Other processes sharing the journal wait so their records are not replayed out of order
+            with history_journal.lock:
+                applied = deployment_repository.apply_journal(history_journal.records())
+            if applied:
+                logger.info("Applied %s journal records to the deployment repository", applied)
         except Exception as e:
-            logger.error(f"Failed to create DEPLOYMENT_LOGS_DIR: {e}")
-            raise
-        
-        # Create a backup of the current history file if it exists
-        if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-            # timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
-            backup_file = os.path.join(DEPLOYMENT_LOGS_DIR, f'deployment_history_{timestamp}.json')
+            logger.error("Failed to replay deployment history journal: %s", e)
+    else:
+        # First start on history written by an older version: load it once and build the index from it
+        load_history_snapshot()
+
+        # Move logs out of history written by older versions
+        for dep_id, deployment in list(deployments.items()):
+            if "logs" not in deployment:
+                continue
+            logs = deployment.pop("logs")
             try:
-                with open(DEPLOYMENT_HISTORY_FILE, 'r') as src:
-                    with open(backup_file, 'w') as dst:
-                        dst.write(src.read())
-                logger.debug(f"Created backup of deployment history: {backup_file}")
+                if not log_segments.exists(dep_id):
+                    log_segments.append(dep_id, logs)
+                deployment["log_count"] = len(logs)
+                migrated_logs.append(dep_id)
             except Exception as e:
-                logger.error(f"Error creating backup of history file: {str(e)}")
-                # Don't raise here, continue with saving
-        
-        # Ensure the directory for the main history file exists
-        history_dir = os.path.dirname(DEPLOYMENT_HISTORY_FILE)
-        if history_dir:
-            os.makedirs(history_dir, exist_ok=True)
-        
-        # Save the current deployment history
+                logger.error("Failed to migrate logs of deployment %s: %s", dep_id, e)
+                deployment["logs"] = logs
+        if migrated_logs:
+            logger.info("Moved logs of %s deployments to log segments in %s",
+                        len(migrated_logs), DEPLOYMENT_LOG_SEGMENTS_DIR)
+
         try:
-            with open(DEPLOYMENT_HISTORY_FILE, 'w') as f:
-                json.dump(deployments, f, default=str, indent=2)
-            logger.info(f"Saved {len(deployments)} deployments to history file: {DEPLOYMENT_HISTORY_FILE}")
+            deployment_repository.replace_all(deployments)
+            deployment_repository.set_meta('history_index', 'ready')
+            logger.info("Built deployment repository with %s deployments", len(deployments))
+            # From here on records are loaded back from the repository when they are used
+            deployments.clear()
         except Exception as e:
-            logger.error(f"Failed to write deployment history file: {e}")
-            raise
-        
-        # Clean up old backup files (keep only last 10)
-        try:
-            backup_files = sorted(glob.glob(os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history_*.json')))
-            if len(backup_files) > 10:
-                for old_file in backup_files[:-10]:
-                    try:
-                        os.remove(old_file)
-                        logger.debug(f"Removed old backup file: {old_file}")
-                    except Exception as e:
-                        logger.error(f"Error removing old backup file {old_file}: {str(e)}")
-        except Exception as e:
-            logger.error(f"Error during backup cleanup: {e}")
-            # Don't raise here, the main save was successful
-            
-    except Exception as e:
-        logger.error(f"Failed to save deployment history: {str(e)}")
-        raise  # Re-raise so the API returns 500
+            logger.error("Failed to build deployment repository: %s", e)
+    return migrated_logs
+
+
+# Held while starting up so processes sharing the volume do not build the index twice
+with FileLock(DEPLOYMENT_DB_FILE + '.lock'):
+    migrated_logs = load_deployment_index()
+logger.info("Deployment history ready in %.3fs (%s deployments loaded into memory)",
+            time.time() - startup_started, len(deployments))
+
+# Last lines of each deployment in memory, older ones read back from the log segments
+log_buffers = LogBuffers(log_segments)
+
+# Per-deployment locking around changes; the flusher only ever sees the registry's snapshots
+deployment_registry = DeploymentRegistry(deployments, log_buffers)
+deployments.on_load = deployment_registry.loaded
+
+# Single background writer: callers only mark deployments dirty, writes are coalesced per window
+history_flusher = HistoryFlusher(history_journal, deployment_repository, log_segments, deployment_registry.snapshot,
+                                 log_records=log_records)
+deployment_registry.persister = history_flusher
+log_buffers.flush = history_flusher.flush
+history_flusher.start()
+atexit.register(history_flusher.flush)
+if migrated_logs:
+    # Record log_count and rewrite the snapshot without the migrated logs
+    for dep_id in migrated_logs:
+        history_flusher.mark_dirty(dep_id)
+    history_flusher.request_compaction()
+
+# Load inventory from file or create a default one
+INVENTORY_FILE = os.environ.get('INVENTORY_FILE', '/app/inventory/inventory.json')
+os.makedirs(os.path.dirname(INVENTORY_FILE), exist_ok=True)
+
+# Connection settings shared by every VM of the ansible inventories rendered from inventory.json
+ANSIBLE_CONNECTION_VARS = {
+    "ansible_user": "infadm",
+    "ansible_ssh_private_key_file": "/home/users/infadm/.ssh/id_rsa",
+    "ansible_ssh_common_args": "'-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto "
+                               "-o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'",
+}
+
+# inventory.json is reloaded when it changes (an empty inventory is used until it can be read - it is
+# never written here, let the user create it manually). Ansible inventories are rendered once per set
+# of target VMs and shared by all deployments.
+inventory_cache = InventoryCache(INVENTORY_FILE, connection_vars=ANSIBLE_CONNECTION_VARS)
+
+# Function to save deployment history in the background
+
+
+def save_deployment_history(deployment_id=None):
+    """Queue the current metadata of a deployment (or of all deployments if no ID is given) for saving"""
+    if deployment_id is not None:
+        deployment_registry.save(deployment_id)
+    else:
+        for dep_id in list(deployments.keys()):
+            deployment_registry.save(dep_id)
 
 
 
 # Helper function to log message to deployment log
 def log_message(deployment_id, message):
     """Log a message to the deployment logs and the application log"""
-    if deployment_id in deployments:
-        # Add to deployment logs
-        if "logs" not in deployments[deployment_id]:
-            deployments[deployment_id]["logs"] = []
-        deployments[deployment_id]["logs"].append(message)
-        
-        # Also log to application log
-        logger.debug(f"[{deployment_id}] {message}")
+    if deployment_registry.append_log(deployment_id, message):
+        # Also log to application log; formatted on the log listener thread, and only if the output level allows
+        output_logger.debug("[%s] %s", deployment_id, message)
+
+
+def record_job_state(deployment_id, state, error=None, **fields):
+    """Show a job's way through the scheduler (queued, running, finished) in its deployment record"""
+    if error:
+        fields["job_error"] = error
+    if state == "running":
+        # A job taken over from another process: its record is changed from this one now
+        deployment_registry.adopt(deployment_id)
+    elif state == "finished":
+        # Its playbooks are over, so the inventories they read may be deleted
+        inventory_cache.release(deployment_id)
+    deployment = deployment_registry.update(deployment_id, job_state=state, **fields)
+    if error and deployment is not None and deployment.get("status") == "running":
+        # The job ended without its handler setting a final status
+        log_message(deployment_id, f"ERROR: {error}")
+        deployment_registry.update_status(deployment_id, "failed")
+
+
+def ansible_environment():
+    """Environment of ansible-playbook runs: the process environment with the orchestrator's ANSIBLE_* settings"""
+    env_vars = os.environ.copy()
+    env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
+    env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
+    env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
+    env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+    return env_vars
+
+
+# Runs playbooks as new ansible-playbook processes, or as forks of a worker that has Ansible loaded
+ansible_executor = create_executor(ANSIBLE_EXECUTION_BACKEND, ansible_environment())
+
+
+def run_ansible_playbook(deployment_id, cmd, env_vars, timeout=None):
+    """Run an ansible-playbook command line for a deployment; returns its exit code.
+
+    Output lines go to the deployment log. After ``timeout`` seconds the run
+    is killed and ``subprocess.TimeoutExpired`` raised. Per-host and per-task events of
+    the callback plugin are folded into the record's ``ansible`` field, on
+    top of what earlier playbooks of the same deployment recorded.
+    """
+    deployment = deployments.get(deployment_id) or {}
+    progress = PlaybookProgress(deployment.get("ansible"))
+
+    def on_event(event):
+        if progress.apply(event):
+            deployment_registry.update(deployment_id, ansible=progress.snapshot())
+
+    return ansible_executor.run(cmd, env_vars, lambda line: log_message(deployment_id, line), on_event, timeout)
+
+
+def remove_extra_vars(deployment_id, vars_file):
+    """Remove the inputs file of a playbook run once the run is over (None if it was never written)"""
+    if vars_file is None:
+        return
+    try:
+        os.remove(vars_file)
+    except OSError as e:
+        logger.warning("Error cleaning up temporary files of %s: %s", deployment_id, e)
+
+
+def host_job_slots(host):
+    """Jobs allowed at once on a VM: inventory.json's host_job_slots entry for its type, or its "default" entry"""
+    limits = inventory_cache.data().get("host_job_slots") or {}
+    vm = inventory_cache.vm(host)
+    vm_type = vm.get("type") if vm else None
+    return limits.get(vm_type, limits.get("default"))
+
+
+# Background work of the endpoints runs on a fixed worker pool; jobs wait in a persistent FIFO queue,
+# and a job only starts once it holds a slot on every VM it targets (counted in jobs.db across
+# all processes with the shared backend)
+job_scheduler = JobScheduler(JobQueue(DEPLOYMENT_JOB_DB_FILE), on_state=record_job_state,
+                             host_slots=HostSlots(host_job_slots), shared_slots=DEPLOYMENT_STATE_BACKEND != 'local')
+
+
+def submit_job(kind, deployment_id, *args, hosts=()):
+    """Queue the work of a new deployment record on ``hosts``; returns an error response if the queue is full"""
+    try:
+        job_scheduler.submit(kind, deployment_id, *args, hosts=hosts)
+    except JobQueueFullError as e:
+        logger.warning("Rejected %s job %s: %s", kind, deployment_id, e)
+        log_message(deployment_id, f"ERROR: {str(e)}")
+        deployment_registry.update_status(deployment_id, "failed", job_state="finished", job_error=str(e))
+        return jsonify({"error": str(e), "deploymentId": deployment_id}), 503
+    return None
+
+
+def load_deployment_logs(deployment_id, deployment, start=0, end=None):
+    """Log lines ``start``..``end`` of a deployment, from its in-memory tail where possible, otherwise its log segment"""
+    if "logs" in deployment:
+        # Logs that could not be migrated out of an old history file
+        return deployment["logs"][start:end]
+    if deployment.get("archived_day"):
+        # Kept next to its archive partition; its log segment was removed when it was archived
+        return history_archive.read_logs(deployment_id, deployment["archived_day"])[start:end]
+    return deployment_registry.read_logs(deployment_id, start, end, deployment.get("log_count"))
+
+
+def read_log_page(deployment_id, deployment):
+    """Log lines picked by the ``offset``/``limit``/``tail``/``since_seq`` query parameters, with paging metadata.
+
+    ``tail=N`` returns the last N lines, ``since_seq=S`` the lines after line
+    number S (the SSE event id), otherwise lines start at ``offset`` (default
+    0). ``limit`` caps the number of lines; without parameters every line is
+    returned.
+    """
+    total = len(deployment["logs"]) if "logs" in deployment else deployment.get("log_count", 0)
+    tail = request.args.get('tail', type=int)
+    since_seq = request.args.get('since_seq', type=int)
+    limit = request.args.get('limit', type=int)
+    if tail is not None:
+        start = max(total - max(tail, 0), 0)
+    elif since_seq is not None:
+        start = max(since_seq + 1, 0)
+    else:
+        start = max(request.args.get('offset', 0, type=int), 0)
+    end = None if limit is None else start + max(limit, 0)
+    logs = load_deployment_logs(deployment_id, deployment, start, end)
+    return {
+        "logs": logs,
+        "offset": start,
+        "nextOffset": start + len(logs),
+        # Records of other processes may have flushed lines their log_count does not include yet
+        "totalLines": max(total, start + len(logs)),
+    }
+
+
+def log_record_filters():
+    """``host``/``level``/``task`` filters of a log request; host and level take comma-separated lists"""
+    filters = {}
+    for key in RECORD_FILTERS:
+        value = request.args.get(key)
+        if value:
+            # Task names may contain commas themselves
+            filters[key] = value if key == 'task' else value.split(',')
+    return filters
+
+
+def ensure_log_records(deployment_id, deployment, total):
+    """Make sure the log record index covers a deployment's lines before it is queried"""
+    indexed = log_records.indexed_count(deployment_id)
+    if indexed >= total:
+        return
+    if deployment_registry.is_local(deployment_id):
+        # Lines still queued in the flusher are parsed and indexed with this flush
+        history_flusher.flush()
+        indexed = log_records.indexed_count(deployment_id)
+    if indexed == 0 and deployment.get("status") in FINISHED_STATUSES:
+        # Logged before log records existed: parse its segment once
+        timestamp = normalize_timestamp(deployment.get("timestamp") or deployment.get("start_time"))
+        log_records.append(deployment_id, [(seq, timestamp, message)
+                                           for seq, message in enumerate(load_deployment_logs(deployment_id,
+                                                                                              deployment))])
+
+
+def read_log_record_page(deployment_id, deployment, filters):
+    """Structured log records matching ``filters``, picked by the ``tail``/``since_seq``/``offset``/``limit`` parameters.
+
+    Records come from the index, so only the matching lines are read.
+    ``since_seq``/``offset`` refer to line numbers of the whole log;
+    ``nextSeq`` is the line number to pass as ``since_seq`` for the next page.
+    """
+    total = len(deployment["logs"]) if "logs" in deployment else deployment.get("log_count", 0)
+    tail = request.args.get('tail', type=int)
+    since_seq = request.args.get('since_seq', type=int)
+    limit = request.args.get('limit', type=int)
+    offset = request.args.get('offset', type=int)
+    if since_seq is None and offset:
+        since_seq = offset - 1
+    if "logs" in deployment and log_records.indexed_count(deployment_id) < total:
+        # Archived (or unmigrated) deployments carry their lines; unless indexed they are parsed here
+        timestamp = normalize_timestamp(deployment.get("timestamp") or deployment.get("start_time"))
+        records = [record for record in parse_log_records(deployment["logs"], ts=timestamp)
+                   if matches_record_filters(record, filters)
+                   and (since_seq is None or record["seq"] > since_seq)]
+        if tail is not None:
+            records = records[-tail:] if tail > 0 else []
+        elif limit is not None:
+            records = records[:max(limit, 0)]
+    else:
+        ensure_log_records(deployment_id, deployment, total)
+        records = log_records.query(deployment_id, filters, after=since_seq, limit=limit, tail=tail)
+    return {
+        "logs": [record["text"] for record in records],
+        "records": records,
+        "filters": filters,
+        "nextSeq": records[-1]["seq"] if records else since_seq,
+        "totalLines": total,
+    }
+
+
+def read_logs_response(deployment_id, deployment):
+    """Body of a JSON log request: filtered structured records, or a page of plain lines"""
+    filters = log_record_filters()
+    if filters or request.args.get('records', '').lower() in ('1', 'true', 'yes'):
+        return read_log_record_page(deployment_id, deployment, filters)
+    return read_log_page(deployment_id, deployment)
+
+
+def sse_resume_offset():
+    """Line to resume an SSE log stream from: the one after the Last-Event-ID a reconnecting client sends"""
+    try:
+        return max(int(request.headers.get('Last-Event-ID', '')) + 1, 0)
+    except ValueError:
+        return 0
+
+
+def sse_batching():
+    """Whether the client asked for batched log events (``?batch=1``)"""
+    return request.args.get('batch', '').lower() in ('1', 'true', 'yes')
+
+
+# Every SSE log stream goes through the hub: subscriber caps, idle timeouts and heartbeats
+log_stream_hub = LogStreamHub(deployment_registry, deployments.get, load_deployment_logs)
+
+
+# Log streams served by coroutines on their own port instead of waitress worker threads
+async_log_server = None
+if LOG_STREAM_ASYNC_PORT:
+    async_log_server = AsyncLogServer(log_stream_hub, port=LOG_STREAM_ASYNC_PORT)
+    async_log_server.start()
+
+
+def async_log_stream_redirect():
+    """Send an event-stream request to the async log server, carrying Last-Event-ID along in the query"""
+    base = LOG_STREAM_PUBLIC_URL
+    if not base:
+        hostname = urlsplit(request.host_url).hostname
+        if ':' in hostname:
+            hostname = f'[{hostname}]'
+        base = f"{request.scheme}://{hostname}:{async_log_server.port}"
+    query = request.args.to_dict()
+    if request.headers.get('Last-Event-ID'):
+        query['last_event_id'] = request.headers['Last-Event-ID']
+    return redirect(base.rstrip('/') + request.path + ('?' + urlencode(query) if query else ''), code=307)
+
+
+def log_stream_response(deployment_id, deployment):
+    """SSE response following a deployment's log, or 429 when too many streams are open"""
+    try:
+        # A reconnecting EventSource only gets the lines it has not seen
+        stream = log_stream_hub.open(deployment_id, deployment, sse_resume_offset(), sse_batching())
+    except StreamLimitError as e:
+        logger.warning("Rejected log stream for %s: %s", deployment_id, e)
+        return jsonify({"error": str(e)}), 429
+    # The WSGI server closes the stream when the response ends or the client disconnects
+    return Response(stream, mimetype='text/event-stream')
+
+
+def archive_old_history():
+    """Move finished deployments older than HISTORY_ARCHIVE_AFTER_DAYS into day partitions"""
+    # Make sure every log line is in its segment before segments are archived
+    history_flusher.flush()
+    by_day = {}
+    for dep_id, sort_timestamp, data in deployment_repository.query(until=archive_cutoff()):
+        if data.get("status") == "running":
+            continue
+        by_day.setdefault(partition_day(sort_timestamp), []).append((dep_id, data))
+
+    for day, items in sorted(by_day.items()):
+        entries = [{"id": dep_id, "data": data, "logs": log_segments.read(dep_id)} for dep_id, data in items]
+        history_archive.write_partition(day, entries)
+        archived_ids = [dep_id for dep_id, _ in items]
+        deployment_repository.mark_archived(day, archived_ids)
+        for dep_id in archived_ids:
+            # Their log records stay, so archived logs remain searchable until retention drops them
+            deployment_registry.delete(dep_id, keep_log_records=True)
+    if by_day:
+        history_flusher.request_compaction()
+
+
+def apply_history_retention():
+    """Drop archive partitions older than HISTORY_RETENTION_DAYS"""
+    if HISTORY_RETENTION_DAYS <= 0:
+        return
+    cutoff = time.time() - HISTORY_RETENTION_DAYS * 86400
+    dropped = history_archive.drop_before(cutoff)
+    if dropped:
+        deployment_repository.forget_archived(before_day=partition_day(cutoff))
+        drop_archived_log_records(dropped)
+
+
+def drop_archived_log_records(dropped_days):
+    """Remove the log records of deployments whose archive partitions were dropped"""
+    try:
+        log_records.delete_before(day_start(dropped_days[-1]) + 86400)
+    except Exception as e:
+        logger.error("Failed to drop log records of archived deployments: %s", e)
+
+
+def run_history_archiver():
+    while True:
+        try:
+            with history_archive.lock:
+                archive_old_history()
+                apply_history_retention()
+        except Exception as e:
+            logger.error("History archiving failed: %s", e)
+        time.sleep(HISTORY_ARCHIVE_INTERVAL)
+
+
+threading.Thread(target=run_history_archiver, name='history-archiver', daemon=True).start()
+
+
+def backfill_log_records():
+    """Index the logs of deployments (live and archived) written before log records existed, once"""
+    # Held so processes sharing the volume do not backfill twice
+    with FileLock(DEPLOYMENT_LOG_DB_FILE + '.lock'):
+        if log_records.get_meta('backfill') == 'done':
+            return
+        started = time.time()
+        backfilled = 0
+        try:
+            for dep_id, sort_timestamp, data in deployment_repository.query():
+                if data.get("status") not in FINISHED_STATUSES or not data.get("log_count"):
+                    continue
+                if log_records.indexed_count(dep_id):
+                    continue
+                log_records.append(dep_id, [(seq, sort_timestamp, message)
+                                            for seq, message in enumerate(log_segments.read(dep_id))],
+                                   kind=data.get("type"), timestamp=normalize_timestamp(sort_timestamp))
+                backfilled += 1
+            for entry in history_archive.entries():
+                if not entry.get('logs') or log_records.indexed_count(entry['id']):
+                    continue
+                timestamp = normalize_timestamp(entry['data'].get("timestamp") or entry['data'].get("start_time"))
+                log_records.append(entry['id'], [(seq, timestamp, message) for seq, message in enumerate(entry['logs'])],
+                                   kind=entry['data'].get("type"), timestamp=timestamp)
+                backfilled += 1
+            log_records.set_meta('backfill', 'done')
+        except Exception as e:
+            logger.error("Failed to index logs of earlier deployments: %s", e)
+            return
+        if backfilled:
+            logger.info("Indexed the logs of %s earlier deployments in %.1fs", backfilled, time.time() - started)
+
+
+threading.Thread(target=backfill_log_records, name='log-records-backfill', daemon=True).start()
 
 
 # Check SSH key permissions and setup
@@ -249,11 +706,11 @@ def check_ssh_setup():
             control_path = "/tmp/ansible-ssh"
             if os.path.exists(control_path):
                 os.chmod(control_path, 0o777)
-                logger.info(f"Ansible SSH control path directory permissions set to 777: {control_path}")
+                logger.info("Ansible SSH control path directory permissions set to 777: %s", control_path)
             else:
                 os.makedirs(control_path, exist_ok=True)
                 os.chmod(control_path, 0o777)
-                logger.info(f"Created Ansible SSH control path directory with permissions 777: {control_path}")
+                logger.info("Created Ansible SSH control path directory with permissions 777: %s", control_path)
             
             # Test SSH key with ssh-keygen -l
             result = subprocess.run(
@@ -262,34 +719,34 @@ def check_ssh_setup():
                 text=True
             )
             if result.returncode == 0:
-                logger.info(f"SSH key validated: {result.stdout.strip()}")
+                logger.info("SSH key validated: %s", result.stdout.strip())
             else:
-                logger.warning(f"SSH key validation failed: {result.stderr.strip()}")
+                logger.warning("SSH key validation failed: %s", result.stderr.strip())
         else:
-            logger.critical(f"SSH private key not found at {ssh_key_path}")
+            logger.critical("SSH private key not found at %s", ssh_key_path)
     except Exception as e:
-        logger.error(f"Error during SSH setup check: {str(e)}")
+        logger.error("Error during SSH setup check: %s", e)
 
 # Test SSH connection to each VM
 def test_ssh_connections():
-    for vm in inventory.get("vms", []):
+    for vm in inventory_cache.data().get("vms", []):
         try:
             vm_name = vm.get("name")
             vm_ip = vm.get("ip")
             if not vm_name or not vm_ip:
                 continue
                 
-            logger.info(f"Testing SSH connection to {vm_name} ({vm_ip})")
+            logger.info("Testing SSH connection to %s (%s)", vm_name, vm_ip)
             cmd = ["ssh", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", 
                   "-i", "/home/users/infadm/.ssh/id_rsa", f"infadm@{vm_ip}", "echo 'SSH Connection Test'"]
                 
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
             if result.returncode == 0:
-                logger.info(f"SSH connection to {vm_name} ({vm_ip}) successful")
+                logger.info("SSH connection to %s (%s) successful", vm_name, vm_ip)
             else:
-                logger.warning(f"SSH connection to {vm_name} ({vm_ip}) failed: {result.stderr.strip()}")
+                logger.warning("SSH connection to %s (%s) failed: %s", vm_name, vm_ip, result.stderr.strip())
         except Exception as e:
-            logger.error(f"Error testing SSH connection to {vm_name}: {str(e)}")
+            logger.error("Error testing SSH connection to %s: %s", vm_name, e)
 
 # Run SSH setup check at startup
 check_ssh_setup()
@@ -300,7 +757,7 @@ test_ssh_connections()
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    logger.debug(f"Serving static path: {path}")
+    logger.debug("Serving static path: %s", path)
     if path and os.path.exists(app.static_folder + '/' + path):
         return send_from_directory(app.static_folder, path)
     return send_from_directory(app.static_folder, 'index.html')
@@ -309,16 +766,16 @@ def serve(path):
 @app.route('/api/fts')
 def get_fts():
     ft_type = request.args.get('type', None)
-    logger.info(f"Getting FTs with type filter: {ft_type}")
+    logger.info("Getting FTs with type filter: %s", ft_type)
     
     all_fts = []
     fts_dir = os.path.join(FIX_FILES_DIR, 'AllFts')
     
     if os.path.exists(fts_dir):
         all_fts = [d for d in os.listdir(fts_dir) if os.path.isdir(os.path.join(fts_dir, d))]
-        logger.debug(f"Found {len(all_fts)} FTs in directory")
+        logger.debug("Found %s FTs in directory", len(all_fts))
     else:
-        logger.warning(f"FTs directory does not exist: {fts_dir}")
+        logger.warning("FTs directory does not exist: %s", fts_dir)
     
     if ft_type == 'sql':
         # Filter FTs that have SQL files
@@ -327,7 +784,7 @@ def get_fts():
             ft_dir = os.path.join(fts_dir, ft)
             if any(f.endswith('.sql') for f in os.listdir(ft_dir)):
                 filtered_fts.append(ft)
-        logger.debug(f"Filtered to {len(filtered_fts)} SQL FTs")
+        logger.debug("Filtered to %s SQL FTs", len(filtered_fts))
         return jsonify(filtered_fts)
     
     return jsonify(all_fts)
@@ -336,42 +793,42 @@ def get_fts():
 @app.route('/api/fts/<ft>/files')
 def get_ft_files(ft):
     ft_type = request.args.get('type', None)
-    logger.info(f"Getting files for FT: {ft} with type filter: {ft_type}")
+    logger.info("Getting files for FT: %s with type filter: %s", ft, ft_type)
     
     ft_dir = os.path.join(FIX_FILES_DIR, 'AllFts', ft)
     
     if not os.path.exists(ft_dir):
-        logger.warning(f"FT directory does not exist: {ft_dir}")
+        logger.warning("FT directory does not exist: %s", ft_dir)
         return jsonify([])
     
     if ft_type == 'sql':
         # Return only SQL files
         sql_files = [f for f in os.listdir(ft_dir) if f.endswith('.sql')]
-        logger.debug(f"Found {len(sql_files)} SQL files in FT: {ft}")
+        logger.debug("Found %s SQL files in FT: %s", len(sql_files), ft)
         return jsonify(sql_files)
     
     # Return all files
     files = [f for f in os.listdir(ft_dir) if os.path.isfile(os.path.join(ft_dir, f))]
-    logger.debug(f"Found {len(files)} files in FT: {ft}")
+    logger.debug("Found %s files in FT: %s", len(files), ft)
     return jsonify(files)
 
 # API to get VMs
 @app.route('/api/vms')
 def get_vms():
     logger.info("Getting list of VMs")
-    return jsonify(inventory["vms"])
+    return jsonify(inventory_cache.data()["vms"])
 
 # API to get DB users
 @app.route('/api/db/users')
 def get_db_users():
     logger.info("Getting list of DB users")
-    return jsonify(inventory["db_users"])
+    return jsonify(inventory_cache.data()["db_users"])
 
 # API to get systemd services
 @app.route('/api/systemd/services')
 def get_systemd_services():
     logger.info("Getting list of systemd services")
-    return jsonify(inventory["systemd_services"])
+    return jsonify(inventory_cache.data()["systemd_services"])
 
 
 # # New APIs for template generator and Oneclick deploy using template
@@ -652,13 +1109,12 @@ def summarize_logs():
 def load_inventory():
     """Load inventory data from JSON files"""
     try:
-        with open('/app/inventory/inventory.json', 'r') as f:
-            inventory = json.load(f)
+        inventory = inventory_cache.data()
         with open('/app/inventory/db_inventory.json', 'r') as f:
             db_inventory = json.load(f)
         return inventory, db_inventory
     except Exception as e:
-        deploy_template_logger.error(f"Error loading inventory: {str(e)}")
+        deploy_template_logger.error("Error loading inventory: %s", e)
         return None, None
 
 def get_vm_ip(vm_name, inventory):
@@ -750,6 +1206,7 @@ def execute_file_deployment_step(step, inventory, deployment_id):
     """Execute file deployment step using ansible"""
     logs = []
     success = True
+    vars_file = None
 
     try:
         logs.append(f"=== Executing File Deployment Step {step['order']} ===")
@@ -776,82 +1233,30 @@ def execute_file_deployment_step(step, inventory, deployment_id):
                 if not os.path.exists(src_file):
                     logs.append(f"ERROR: File not found: {src_file}")
                     success = False
-                    save_deployment_history()
+                    save_deployment_history(deployment_id)
                     continue    
 
-        # Generate an ansible playbook for file deployment            
-        playbook_file = f"/tmp/file_deploy_{deployment_id}.yml"
-        # Generate the playbook
-        with open(playbook_file, 'w') as f:
-            f.write(f"""---
-- name: Deploy multiple files via template step
-  hosts: deployment_targets
-  gather_facts: false
-  become: true
-  become_method: sudo
-  become_user: {target_user}
-  tasks:
-    - name: Ensure target directory exists
-      ansible.builtin.file:
-        path: "{target_path}"
-        state: directory
-        mode: '0755'
-      become: "true"
-      become_user: {target_user}
-
-    # Check if file exists first to support backup
-    - name: Check if file already exists
-      ansible.builtin.stat:
-        path: "{target_path}"
-      register: file_stat
-      
-    # Create backup of existing file if requested
-    - name: Create backup of existing file if it exists
-      ansible.builtin.copy:
-        src: "{target_path}"
-        dest: "{target_path}.bak.{{ ansible_date_time.epoch }}"
-        remote_src: yes
-      when: file_stat.stat.exists and {str(create_backup).lower()}
-      register: backup_result 
-
-    # Log backup creation
-    - name: Log backup result
-      ansible.builtin.debug:
-        msg: "Created backup at {{ backup_result.dest }} "
-      when: backup_result.changed is defined and backup_result.changed
-
-    # Copy the file to the target location
-    - name: Copy file to target VMs
-      ansible.builtin.copy:
-        src: "{src_file}"
-        dest: "{target_path}"
-        mode: '0644'
-        owner: "{target_user}"
-      register: copy_result
-      
-    - name: Log copy result
-      ansible.builtin.debug:
-        msg: "File copied successfully to {vms}"
-      when: copy_result.changed
-""")
-        logger.debug(f"Created Ansible playbook: {playbook_file}")
-        
-        # Generate inventory file for ansible
-        inventory_file = f"/tmp/inventory_{deployment_id}"
-
-        with open(inventory_file, 'w') as f:
-            f.write("[deployment_targets]\n")
-            for vm_name in vms:
-                vm = get_vm_ip(vm_name, inventory)
-                if not vm:
-                    logs.append(f"Warning: VM {vm_name} not found in inventory")
-                    continue
-                f.write(f"{vm_name} ansible_host={vm} ansible_user=infadm "
-                        f"ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa "
-                        f"ansible_ssh_common_args='-o StrictHostKeyChecking=no "
-                        f"-o UserKnownHostsFile=/dev/null -o ControlMaster=auto "
-                        f"-o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
-                logs.append(f"Target VM {vm_name}: {vm}")
+        # Inputs of the static file deployment playbook
+        vars_file = write_extra_vars('file_deploy', deployment_id, {
+            "files": [{"name": file_name,
+                       "src": os.path.join(FIX_FILES_DIR, 'AllFts', ft_number, file_name),
+                       "dest": os.path.join(target_path, file_name)} for file_name in file_list],
+            "target_path": target_path,
+            "target_user": target_user,
+            "use_sudo": True,
+            "create_backup": bool(create_backup),
+            "backup_suffix": f".bak.{int(time.time())}",
+            "initiated_by": deployment.get("logged_in_user", "template"),
+        })
+        logger.debug("Wrote playbook inputs: %s", vars_file)
+        
+        # Cached ansible inventory of the target VMs
+        inventory_file, missing_vms = inventory_cache.inventory_file(vms, holder=deployment_id)
+        for vm_name in vms:
+            if vm_name in missing_vms:
+                logs.append(f"Warning: VM {vm_name} not found in inventory")
+            else:
+                logs.append(f"Target VM {vm_name}: {inventory_cache.vm(vm_name)['ip']}")
 
         if not os.path.exists('/tmp/ansible-ssh'):
             os.makedirs('/tmp/ansible-ssh', exist_ok=True)
@@ -861,12 +1266,9 @@ def execute_file_deployment_step(step, inventory, deployment_id):
             logs.append("Could not set permissions on /tmp/ansible-ssh")
 
         # Prepare environment and run
-        env_vars = os.environ.copy()
-        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+        env_vars = ansible_environment()
 
-        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-vvv"]
+        cmd = playbook_command('file_deploy', inventory_file, vars_file, "-vvv")
         # logs.append(f"Executing: {' '.join(cmd)}")
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
 
@@ -879,33 +1281,20 @@ def execute_file_deployment_step(step, inventory, deployment_id):
         #     logs.append("=== ANSIBLE STDERR ===")
         #     logs.extend(line.strip() for line in result.stderr.splitlines() if line.strip())
 
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        return_code = run_ansible_playbook(deployment_id, cmd, env_vars)
 
-        for line in process.stdout:
-            line_stripped = line.strip()
-            log_message(deployment_id, line_stripped)
-            logger.debug(f"[{deployment_id}] {line_stripped}")
-
-        process.wait()
-
-        if process.returncode == 0:
+        if return_code == 0:
             log_message(deployment_id, f"SUCCESS: All files deployed successfully")
-            deployments[deployment_id]["status"] = "success"
-            logger.info(f"File deployment {deployment_id} succeeded")
+            deployment_registry.update_status(deployment_id, "success")
+            logger.info("File deployment %s succeeded", deployment_id)
         else:
-            log_message(deployment_id, f"ERROR: Deployment failed with return code {process.returncode}")
-            deployments[deployment_id]["status"] = "failed"
-            logger.error(f"File deployment {deployment_id} failed with return code {process.returncode}")
+            log_message(deployment_id, f"ERROR: Deployment failed with return code {return_code}")
+            deployment_registry.update_status(deployment_id, "failed")
+            logger.error("File deployment %s failed with return code %s", deployment_id, return_code)
 
             success = False
 
-        # Cleanup
-        try:
-            os.remove(playbook_file)
-            os.remove(inventory_file)
-        except Exception as e:
-            logs.append(deployment_id, f"Warning: Error cleaning up temp files: {str(e)}")
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         return success, logs
 
     # except Exception as e:
@@ -915,10 +1304,12 @@ def execute_file_deployment_step(step, inventory, deployment_id):
     # return success, logs
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during File deployment: {str(e)}")
-        deployments[deployment_id]["status"] = "failed"
-        logger.exception(f"Exception in File deployment {deployment_id}: {str(e)}")
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.exception("Exception in File deployment %s: %s", deployment_id, e)
+        save_deployment_history(deployment_id)
         return success, logs
+    finally:
+        remove_extra_vars(deployment_id, vars_file)
 
 
 def execute_sql_deployment_step(step, db_inventory, deployment_id):
@@ -984,13 +1375,13 @@ def execute_sql_deployment_step(step, db_inventory, deployment_id):
                 if result.returncode == 0:
                     logs.append(f"SQL file {file_name} executed successfully")
                     log_message(deployment_id, f"SUCCESS: Template deployment completed successfully ")
-                    deployments[deployment_id]["status"] = "success"
-                    logger.info(f"SQL deployment {deployment_id} succeeded")
+                    deployment_registry.update_status(deployment_id, "success")
+                    logger.info("SQL deployment %s succeeded", deployment_id)
                 else:
                     logs.append(f"SQL file {file_name} failed with return code {result.returncode}")
                     log_message(deployment_id, f"ERROR: SQL deployment failed ")
-                    deployments[deployment_id]["status"] = "failed"
-                    logger.error(f"SQL deployment {deployment_id} failed with return code {result.returncode}")
+                    deployment_registry.update_status(deployment_id, "failed")
+                    logger.error("SQL deployment %s failed with return code %s", deployment_id, result.returncode)
                     success = False
                     
             except subprocess.TimeoutExpired:
@@ -999,7 +1390,7 @@ def execute_sql_deployment_step(step, db_inventory, deployment_id):
             except Exception as e:
                 logs.append(f"Error executing SQL file {file_name}: {str(e)}")
                 success = False
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         logs.append(f"=== SQL Deployment Step {step['order']} {'Completed Successfully' if success else 'Failed'} ===")
         
     except Exception as e:
@@ -1012,6 +1403,7 @@ def execute_service_restart_step(step, inventory, deployment_id):
     """Execute service restart step using systemctl"""
     logs = []
     success = True
+    vars_file = None
     
     try:
         logs.append(f"=== Executing Service Restart Step {step['order']} ===")
@@ -1024,232 +1416,53 @@ def execute_service_restart_step(step, inventory, deployment_id):
         logs.append(f"Operation: {operation}")
         
 
-        # Generate an ansible playbook for systemd operation
-        playbook_file = f"/tmp/systemd_{deployment_id}.yml"
-        
-        with open(playbook_file, 'w') as f:
-            f.write(f"""---
-- name: Systemd {operation} operation for {service_name} 
-  hosts: systemd_targets
-  gather_facts: true
-#   become: true
-  vars:
-    service_name: "{service_name}"
-    operation_type: "{operation}"
-  tasks:
-    - name: Test connection
-      ansible.builtin.ping:
-      
-    - name: Check if service unit file exists
-      ansible.builtin.stat:
-        path: "/etc/systemd/system/{{{{ service_name }}}}"
-      register: service_file_etc
-      
-    - name: Check if service unit file exists in lib
-      ansible.builtin.stat:
-        path: "/usr/lib/systemd/system/{{{{ service_name }}}}"
-      register: service_file_lib
-      
-    - name: Check if service unit file exists in local
-      ansible.builtin.stat:
-        path: "/usr/local/lib/systemd/system/{{{{ service_name }}}}"
-      register: service_file_local
-      
-    - name: Set service exists fact
-      ansible.builtin.set_fact:
-        service_exists: "{{{{ service_file_etc.stat.exists or service_file_lib.stat.exists or service_file_local.stat.exists }}}}"
-        
-    - name: Report if service doesn't exist
-      ansible.builtin.debug:
-        msg: "ERROR: Service '{{{{ service_name }}}}' unit file not found on {{{{ inventory_hostname }}}}"
-      when: not service_exists
-      
-    - name: Get detailed service status
-      ansible.builtin.systemd:
-        name: "{{{{ service_name }}}}"
-      register: service_status
-      when: service_exists
-      failed_when: false
-      
-    - name: Get service status with systemctl
-      ansible.builtin.shell: |
-        systemctl status {{{{ service_name }}}} --no-pager -l || true
-        echo "---SEPARATOR---"
-        systemctl show {{{{ service_name }}}} --property=ActiveState,SubState,LoadState,UnitFileState,ExecMainStartTimestamp,ExecMainPID,MainPID || true
-      register: service_details
-      when: service_exists
-      
-    - name: Parse service uptime
-      ansible.builtin.shell: |
-        if systemctl is-active {{{{ service_name }}}} >/dev/null 2>&1; then
-          start_time=$(systemctl show {{{{ service_name }}}} --property=ExecMainStartTimestamp --value)
-          if [ -n "$start_time" ] && [ "$start_time" != "n/a" ]; then
-            echo "Service started at: $start_time"
-            # Calculate uptime
-            start_epoch=$(date -d "$start_time" +%s 2>/dev/null || echo "0")
-            current_epoch=$(date +%s)
-            if [ "$start_epoch" -gt 0 ]; then
-              uptime_seconds=$((current_epoch - start_epoch))
-              uptime_days=$((uptime_seconds / 86400))
-              uptime_hours=$(((uptime_seconds % 86400) / 3600))
-              uptime_minutes=$(((uptime_seconds % 3600) / 60))
-              echo "Uptime: ${{uptime_days}}d ${{uptime_hours}}h ${{uptime_minutes}}m"
-            else
-              echo "Uptime: Unable to calculate"
-            fi
-          else
-            echo "Service start time: Not available"
-            echo "Uptime: Not available"
-          fi
-        else
-          echo "Service is not active"
-        fi
-      register: service_uptime
-      when: service_exists
-      
-    - name: Display comprehensive service status
-      ansible.builtin.debug:
-        msg: |
-          ===========================================
-          SERVICE STATUS REPORT for {{{{ inventory_hostname }}}}
-          ===========================================
-          Service Name: {{{{ service_name }}}}
-          Active State: {{{{ service_status.status.ActiveState | default('unknown') }}}}
-          Sub State: {{{{ service_status.status.SubState | default('unknown') }}}}
-          Load State: {{{{ service_status.status.LoadState | default('unknown') }}}}
-          Unit File State: {{{{ service_status.status.UnitFileState | default('unknown') }}}}
-          Main PID: {{{{ service_status.status.MainPID | default('N/A') }}}}
-          
-          {{{{ service_uptime.stdout | default('Uptime info not available') }}}}
-          
-          Status: {{{{ 'ACTIVE' if service_status.status.ActiveState == 'active' else 'INACTIVE/DEAD' }}}}
-          Enabled: {{{{ 'YES' if service_status.status.UnitFileState in ['enabled', 'enabled-runtime'] else 'NO' }}}}
-          ===========================================
-      when: service_exists and operation_type == 'status'
-
-    - name: Perform systemd START operation
-      ansible.builtin.shell: |
-        sudo systemctl start {{{{ service_name }}}}
-      register: start_result
-      when: service_exists and operation_type == 'start'
-      
-
-    - name: Perform systemd STOP operation
-      ansible.builtin.shell: |
-        sudo systemctl stop {{{{ service_name }}}}
-      register: stop_result
-      when: service_exists and operation_type == 'stop'
-      
+        # Inputs of the static systemd playbook
+        vars_file = write_extra_vars('systemd', deployment_id, {
+            "service_name": service_name,
+            "operation_type": operation,
+            "initiated_by": deployments[deployment_id].get("logged_in_user", "template"),
+        })
 
-    - name: Perform systemd RESTART operation
-      ansible.builtin.shell: |
-        sudo systemctl restart {{{{ service_name }}}}
-      register: restart_result
-      when: service_exists and operation_type == 'restart'
-      
-    - name: Verify operation result
-      ansible.builtin.systemd:
-        name: "{{{{ service_name }}}}"
-      register: post_operation_status
-      when: service_exists and operation_type in ['start', 'stop', 'restart']
-      failed_when: false
-      
-    - name: Report operation success
-      ansible.builtin.debug:
-        msg: |
-          ===========================================
-          OPERATION RESULT for {{{{ inventory_hostname }}}}
-          ===========================================
-          Service: {{{{ service_name }}}}
-          Operation: {{{{ operation_type | upper }}}}
-          Result: SUCCESS
-          New Status: {{{{ post_operation_status.status.ActiveState | default('unknown') }}}} ({{{{ post_operation_status.status.SubState | default('unknown') }}}})
-          Enabled: {{{{ 'YES' if post_operation_status.status.UnitFileState in ['enabled', 'enabled-runtime'] else 'NO' }}}}
-          ===========================================
-      when: service_exists and operation_type in ['start', 'stop', 'restart']
-      
-    - name: Get final service status for logging
-      ansible.builtin.shell: systemctl is-active {{{{ service_name }}}} || echo "inactive"
-      register: final_status
-      when: service_exists
-      
-    - name: Log final status
-      ansible.builtin.debug:
-        msg: "Final service status on {{{{ inventory_hostname }}}}: {{{{ final_status.stdout | default('unknown') }}}}"
-      when: service_exists
-""")
-
-        # Generate inventory file for ansible
-        inventory_file = f"/tmp/inventory_{deployment_id}"
-
-                # Get target VMs
-        with open(inventory_file, 'w') as f:
-            f.write("[systemd_targets]\n")
-            target_hosts = []
-            for vm_name in step.get('targetVMs', []):
-                vm = get_vm_ip(vm_name, inventory)
-                if vm:
-                    target_hosts.append(vm)
-                    logs.append(f"Target VM {vm_name}: {vm}")
-                    f.write(f"{vm_name} ansible_host={vm} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
-                     
-            if not target_hosts:
-                logs.append("Error: No valid target VMs found")
-                return False, logs
+        # Cached ansible inventory of the target VMs
+        inventory_file, missing_vms = inventory_cache.inventory_file(step.get('targetVMs', []), holder=deployment_id)
+        target_hosts = [vm_name for vm_name in step.get('targetVMs', []) if vm_name not in missing_vms]
+        for vm_name in target_hosts:
+            logs.append(f"Target VM {vm_name}: {inventory_cache.vm(vm_name)['ip']}")
+        if not target_hosts:
+            logs.append("Error: No valid target VMs found")
+            return False, logs
         
         # Run ansible playbook
-        env_vars = os.environ.copy()
-        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+        env_vars = ansible_environment()
         
-        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+        cmd = playbook_command('systemd', inventory_file, vars_file, "-v")
         
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
-        logger.info(f"Executing Ansible command: {' '.join(cmd)}")
+        logger.info("Executing Ansible command: %s", ' '.join(cmd))
         
-        # Use subprocess.run with capture_output=True instead of Popen
-        result = subprocess.run(cmd, capture_output=True, text=True, env=env_vars, timeout=300)
-        
-        # Log the output line by line
-        if result.stdout:
-            log_message(deployment_id, "=== ANSIBLE OUTPUT ===")
-            for line in result.stdout.splitlines():
-                if line.strip():  # Only log non-empty lines
-                    log_message(deployment_id, line.strip())
-        
-        if result.stderr:
-            log_message(deployment_id, "=== ANSIBLE STDERR ===")
-            for line in result.stderr.splitlines():
-                if line.strip():  # Only log non-empty lines
-                    log_message(deployment_id, line.strip())
+        # Output lines go to the deployment log as they are written
+        return_code = run_ansible_playbook(deployment_id, cmd, env_vars, timeout=300)
         
         # Check result and update status
-        if result.returncode == 0:
+        if return_code == 0:
             log_message(deployment_id, f"SUCCESS: Systemd {operation} operation completed successfully ")
-            deployments[deployment_id]["status"] = "completed"
-            logger.info(f"Systemd operation {deployment_id} completed successfully ")
+            deployment_registry.update_status(deployment_id, "completed")
+            logger.info("Systemd operation %s completed successfully ", deployment_id)
         else:
-            log_message(deployment_id, f"ERROR: Systemd {operation} operation failed with return code {result.returncode} ")
-            deployments[deployment_id]["status"] = "failed"
-            logger.error(f"Systemd operation {deployment_id} failed with return code {result.returncode} ")
-        
-        # Clean up temporary files
-        try:
-            os.remove(playbook_file)
-            os.remove(inventory_file)
-        except Exception as e:
-            logger.warning(f"Error cleaning up temporary files: {str(e)}")
+            log_message(deployment_id, f"ERROR: Systemd {operation} operation failed with return code {return_code} ")
+            deployment_registry.update_status(deployment_id, "failed")
+            logger.error("Systemd operation %s failed with return code %s ", deployment_id, return_code)
         
         # Save deployment history after completion
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         
         logs.append(f"=== Service Restart Step {step['order']} {'Completed Successfully' if success else 'Failed'} ===")
         
     except Exception as e:
         logs.append(f"Error in service restart step: {str(e)}")
         success = False
+    finally:
+        remove_extra_vars(deployment_id, vars_file)
     
     return success, logs
 
@@ -1719,8 +1932,8 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
             error_msg = f"Playbook {playbook_name} not found in inventory"
             logs.append(f"Error: {error_msg}")
             log_message(deployment_id, f"ERROR: {error_msg}")
-            deployments[deployment_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(deployment_id, "failed")
+            save_deployment_history(deployment_id)
             return False, logs
 
         logs.append(f"Playbook: {playbook_details['name']}")
@@ -1733,8 +1946,8 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
         if not batch1_ip:
             error_msg = "Could not find IP for batch1 in inventory"
             log_message(deployment_id, f"ERROR: {error_msg}")
-            deployments[deployment_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(deployment_id, "failed")
+            save_deployment_history(deployment_id)
             return False, logs
 
         run_path = playbook_details.get("run_path", "/home/users/infadm/rm-acd")
@@ -1770,8 +1983,8 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
             remote_ansible_cmd
         ]
 
-        deployments[deployment_id]["status"] = "running"
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "running")
+        save_deployment_history(deployment_id)
 
         log_message(deployment_id, f"Executing remotely on batch1: {remote_ansible_cmd}")
         logs.append(f"Executing via SSH: {' '.join(ssh_cmd)}")
@@ -1808,7 +2021,6 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
                         line_stripped = output.strip()
                         if line_stripped:  # Only log non-empty lines
                             log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
                             output_buffer.append(line_stripped)
                             last_output_time = time.time()
                             last_heartbeat = time.time()
@@ -1825,7 +2037,6 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
                         for line in remaining_output.strip().split('\n'):
                             if line.strip():
                                 log_message(deployment_id, line.strip())
-                                logger.debug(f"[{deployment_id}] {line.strip()}")
                     break
                 
                 current_time = time.time()
@@ -1834,14 +2045,14 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
                 if current_time - last_heartbeat > heartbeat_interval:
                     heartbeat_msg = f"Playbook still running... (heartbeat) - Last output: {int(current_time - last_output_time)}s ago"
                     log_message(deployment_id, heartbeat_msg)
-                    logger.info(f"[{deployment_id}] {heartbeat_msg}")
+                    logger.info("[%s] %s", deployment_id, heartbeat_msg)
                     last_heartbeat = current_time
                 
                 # Check for excessive silence (possible hang)
                 if current_time - last_output_time > max_silence_duration:
                     warning_msg = f"WARNING: No output received for {max_silence_duration} seconds. Playbook may be hanging."
                     log_message(deployment_id, warning_msg)
-                    logger.warning(f"[{deployment_id}] {warning_msg}")
+                    logger.warning("[%s] %s", deployment_id, warning_msg)
                     
                     # Optionally terminate the process if it's been silent too long
                     # Uncomment the following lines if you want to auto-terminate hanging processes
@@ -1856,14 +2067,14 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
                 time.sleep(0.1)
 
         except Exception as monitoring_error:
-            logger.error(f"Error during process monitoring: {str(monitoring_error)}")
+            logger.error("Error during process monitoring: %s", monitoring_error)
             log_message(deployment_id, f"Monitoring error: {str(monitoring_error)}")
 
         # Wait for process completion with timeout
         try:
             process.wait(timeout=30)  # Wait up to 30 seconds for clean shutdown
         except subprocess.TimeoutExpired:
-            logger.warning(f"Process didn't terminate cleanly, killing it")
+            logger.warning("Process didn't terminate cleanly, killing it")
             process.kill()
             process.wait()
 
@@ -1873,14 +2084,14 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
         if return_code == 0:
             success_msg = "SUCCESS: Playbook completed successfully"
             log_message(deployment_id, success_msg)
-            logger.info(f"[{deployment_id}] {success_msg}")
-            deployments[deployment_id]["status"] = "success"
+            logger.info("[%s] %s", deployment_id, success_msg)
+            deployment_registry.update_status(deployment_id, "success")
             success = True
         else:
             error_msg = f"ERROR: Playbook failed with return code {return_code}"
             log_message(deployment_id, error_msg)
-            logger.error(f"[{deployment_id}] {error_msg}")
-            deployments[deployment_id]["status"] = "failed"
+            logger.error("[%s] %s", deployment_id, error_msg)
+            deployment_registry.update_status(deployment_id, "failed")
             success = False
 
         # Log final summary
@@ -1888,15 +2099,15 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
         logs.append(final_msg)
         log_message(deployment_id, final_msg)
         
-        save_deployment_history()
+        save_deployment_history(deployment_id)
 
     except Exception as e:
         error_msg = f"Exception during playbook execution: {str(e)}"
         log_message(deployment_id, error_msg)
-        deployments[deployment_id]["status"] = "failed"
-        logger.exception(f"Exception in deployment {deployment_id}: {str(e)}")
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.exception("Exception in deployment %s: %s", deployment_id, e)
         logs.append(f"Error: {str(e)}")
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         success = False
 
     return success, logs
@@ -1906,6 +2117,7 @@ def execute_helm_upgrade_step(step, inventory, deployment_id):
     """Execute helm upgrade step"""
     logs = []
     success = True
+    vars_file = None
     
     try:
         logs.append(f"=== Executing Helm Upgrade Step {step['order']} ===")
@@ -1924,95 +2136,19 @@ def execute_helm_upgrade_step(step, inventory, deployment_id):
         logs.append(f"Command: {helm_command}")
 
         ssh_user = "admin"
-        batch1_ip = next((vm["ip"] for vm in inventory["vms"] if vm["name"] == "batch1"), None)
-        if not batch1_ip:
+        batch1 = inventory_cache.vm("batch1")
+        if not batch1:
             error_msg = "Could not find IP for batch1 in inventory"
             log_message(deployment_id, f"ERROR: {error_msg}")
-            deployments[deployment_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(deployment_id, "failed")
+            save_deployment_history(deployment_id)
             return False, logs
 
-        playbook_file = f"/tmp/helm_deploy_{deployment_id}.yml"
-        inventory_file = f"/tmp/inventory_{deployment_id}"
-        
-        with open(playbook_file, 'w') as f:
-            f.write(f"""---
-- name: Helm chart deployment from Template 
-  hosts: deployment_targets
-  gather_facts: false
-  become: true
-  become_user: infadm
-  tasks:
-    - name: Test connection
-      ansible.builtin.ping:
-
-    - name: Run Helm upgrade
-      ansible.builtin.shell: "sudo su - admin -c 'cd ~ && {helm_command}'"
-      register: helm_result
-      failed_when: helm_result.rc != 0
-
-    - name: Log Helm output
-      ansible.builtin.debug:
-        msg: "{{{{ helm_result.stdout_lines }}}}"
-# - name: Helm chart deployment from Template 
-#   hosts: deployment_targets
-#   gather_facts: false
-#   become: true
-#   become_user: admin
-#   tasks:
-#     - name: Test connection
-#       ansible.builtin.ping:
+        # Inputs of the static helm playbook
+        vars_file = write_extra_vars('helm_upgrade', deployment_id, {"helm_command": helm_command})
+        logger.debug("Wrote playbook inputs: %s", vars_file)
 
-#     - name: List files in scripts directory
-#       ansible.builtin.shell: "ls -la /opt/amdocs/abp/core/k8s/scripts/"
-#       register: scripts_list
-
-#     - name: Show scripts directory contents
-#       ansible.builtin.debug:
-#         msg: "{{{{ scripts_list.stdout_lines }}}}"
-
-#     - name: Find k8s_Logger.ksh file
-#       ansible.builtin.shell: "find /opt/amdocs -name 'k8s_Logger.ksh' -type f 2>/dev/null"
-#       register: logger_find
-#       ignore_errors: true
-
-#     - name: Show logger file location
-#       ansible.builtin.debug:
-#         msg: "Found k8s_Logger.ksh at: {{{{ logger_find.stdout_lines }}}}"
-
-#     - name: Check helmFU.Sh content (first 10 lines)
-#       ansible.builtin.shell: "head -10 /opt/amdocs/abp/core/k8s/scripts/helmFU.Sh"
-#       register: helm_content
-
-#     - name: Show helmFU.Sh header
-#       ansible.builtin.debug:
-#         msg: "{{{{ helm_content.stdout_lines }}}}"
-
-#     - name: Run Helm upgrade with debug
-#       ansible.builtin.shell: "bash -x {helm_command}"
-#       args:
-#         chdir: "/opt/amdocs/abp/core/k8s/scripts/"
-#       register: helm_result
-#       failed_when: false
-
-#     - name: Log Helm output
-#       ansible.builtin.debug:
-#         msg: 
-#           - "Return code: {{{{ helm_result.rc }}}}"
-#           - "Stdout: {{{{ helm_result.stdout_lines }}}}"
-#           - "Stderr: {{{{ helm_result.stderr_lines }}}}"
-
-""")
-
-        logger.debug(f"Created Ansible playbook: {playbook_file}")
-
-        with open(inventory_file, 'w') as f:
-            f.write("[deployment_targets]\n")
-            for vm_name in vms:
-                f.write(f"{vm_name} ansible_host={batch1_ip} ansible_user=infadm "
-                            f"ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa "
-                            f"ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null "
-                            f"-o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")   
+        inventory_file, _ = inventory_cache.inventory_file(vms, holder=deployment_id)
 
         # with open(inventory_file, 'w') as f:
         #     f.write("[deployment_targets]\n")
@@ -2032,48 +2168,33 @@ def execute_helm_upgrade_step(step, inventory, deployment_id):
         except PermissionError:
             logger.info("Could not set permissions on /tmp/ansible-ssh")
 
-        env_vars = os.environ.copy()
-        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+        env_vars = ansible_environment()
 
-        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+        cmd = playbook_command('helm_upgrade', inventory_file, vars_file, "-v")
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
 
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        return_code = run_ansible_playbook(deployment_id, cmd, env_vars)
 
-        for line in process.stdout:
-            line_stripped = line.strip()
-            log_message(deployment_id, line_stripped)
-            logger.debug(f"[{deployment_id}] {line_stripped}")
-
-        process.wait()
-
-        if process.returncode == 0:
+        if return_code == 0:
             log_message(deployment_id, f"SUCCESS: Helm deployment completed successfully ")
-            deployments[deployment_id]["status"] = "success"
-            logger.info(f"Helm deployment {deployment_id} succeeded")
+            deployment_registry.update_status(deployment_id, "success")
+            logger.info("Helm deployment %s succeeded", deployment_id)
         else:
             log_message(deployment_id, f"ERROR: Helm deployment failed ")
-            deployments[deployment_id]["status"] = "failed"
-            logger.error(f"Helm deployment {deployment_id} failed with return code {process.returncode}")
+            deployment_registry.update_status(deployment_id, "failed")
+            logger.error("Helm deployment %s failed with return code %s", deployment_id, return_code)
 
-        try:
-            os.remove(playbook_file)
-            os.remove(inventory_file)
-        except Exception as e:
-            logger.warning(f"Cleanup failed: {str(e)}")
-
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         return success, logs
 
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during Helm deployment: {str(e)}")
-        deployments[deployment_id]["status"] = "failed"
-        logger.exception(f"Exception in Helm deployment {deployment_id}: {str(e)}")
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.exception("Exception in Helm deployment %s: %s", deployment_id, e)
+        save_deployment_history(deployment_id)
         return success, logs
+    finally:
+        remove_extra_vars(deployment_id, vars_file)
 
 def execute_template_step(step, inventory, db_inventory, deployment_id):
     """Execute a single template step based on its type"""
@@ -2102,7 +2223,7 @@ def get_templates():
     try:
         template_dir = '/app/deployment_templates'
         if not os.path.exists(template_dir):
-            deploy_template_logger.warning(f"Template directory {template_dir} does not exist")
+            deploy_template_logger.warning("Template directory %s does not exist", template_dir)
             return jsonify({'templates': []})
         
         templates = []
@@ -2110,11 +2231,11 @@ def get_templates():
             if filename.endswith('_template.json'):
                 templates.append(filename)
         
-        deploy_template_logger.debug(f"Found templates: {templates}")
+        deploy_template_logger.debug("Found templates: %s", templates)
         return jsonify({'templates': templates})
         
     except Exception as e:
-        deploy_template_logger.error(f"Error listing templates: {str(e)}")
+        deploy_template_logger.error("Error listing templates: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/deploy/templates/<template_name>', methods=['GET'])
@@ -2129,13 +2250,91 @@ def get_template(template_name):
         with open(template_path, 'r') as f:
             template_data = json.load(f)
         
-        deploy_template_logger.debug(f"Loaded template {template_name}: {template_data}")
+        deploy_template_logger.debug("Loaded template %s: %s", template_name, template_data)
         return jsonify({'template': template_data})
         
     except Exception as e:
-        deploy_template_logger.error(f"Error loading template {template_name}: {str(e)}")
+        deploy_template_logger.error("Error loading template %s: %s", template_name, e)
         return jsonify({'error': str(e)}), 500
 
+def template_hosts(template_data):
+    """VMs a template's steps run on: their targetVMs, and batch1 for the playbook and helm steps run from it"""
+    hosts = set()
+    for step in template_data.get('steps', []):
+        hosts.update(step.get('targetVMs') or [])
+        if step.get('type') in ('ansible_playbook', 'helm_upgrade'):
+            hosts.add('batch1')
+    return sorted(hosts)
+
+
+def process_template_deployment(deployment_id, template_data, ft_number):
+    """Run the steps of a template deployment in order, stopping at the first failed step"""
+    try:
+        logger.info("Starting template deployment %s for %s", deployment_id, ft_number)
+
+        
+        
+        if deployment_id not in deployments:
+            logger.error("Deployment %s not found in deployments", deployment_id)
+            return
+        inventory, db_inventory = load_inventory()
+        steps = template_data.get('steps', [])
+        dependencies = template_data.get('dependencies', [])
+        
+        # Sort steps by order
+        steps.sort(key=lambda x: x.get('order', 0))
+        
+        overall_success = True
+        
+        for step in steps:
+            step_order = step.get('order')
+            step_type = step.get('type')
+            
+            log_message(deployment_id, f"\n=== Starting Step {step_order}: {step_type} ===")
+            log_message(deployment_id, f"Description: {step.get('description', 'N/A')}")
+            
+            # Execute the step
+            success, step_logs = execute_template_step(step, inventory, db_inventory, deployment_id)
+            
+            # Add step logs to deployment logs
+            for step_log in step_logs:
+                log_message(deployment_id, step_log)
+            
+            # Update progress
+            deployment_registry.increment(deployment_id, 'steps_completed')
+            
+            if not success:
+                overall_success = False
+                log_message(deployment_id, f"Step {step_order} failed - stopping template execution")
+                break
+            
+            log_message(deployment_id, f"Step {step_order} completed successfully")
+        
+        # Update final status
+        final_status = 'success' if overall_success else 'failed'
+        deployment_registry.update_status(deployment_id, final_status, end_time=datetime.now(timezone.utc).isoformat())
+        
+        log_message(deployment_id, f"\n=== Template Deployment {final_status.upper()} ===")
+        
+        deploy_template_logger.info("Template deployment %s completed with status: %s", deployment_id, final_status)
+        
+        # Save deployment history after completion
+        try:
+            save_deployment_history(deployment_id)
+        except Exception as save_error:
+            deploy_template_logger.error("Failed to save deployment history: %s", save_error)
+        
+    except Exception as e:
+        deploy_template_logger.error("Error in template execution job: %s", e)
+        deployment_registry.update_status(deployment_id, 'failed', end_time=datetime.now(timezone.utc).isoformat())
+        log_message(deployment_id, f"Template execution failed: {str(e)}")
+        # Save deployment history even on failure
+        try:
+            save_deployment_history(deployment_id)
+        except Exception as save_error:
+            deploy_template_logger.error("Failed to save deployment history: %s", save_error)
+
+
 @app.route('/api/deploy/templates/execute', methods=['POST'])
 def execute_template():
     """Execute a deployment template"""
@@ -2163,7 +2362,7 @@ def execute_template():
         deployment_id = str(uuid.uuid4())
         
         
-        deployments[deployment_id] = {
+        deployment_registry.create(deployment_id, {
             'type': 'template_deployment',
             'status': 'running',
             'type': 'template',
@@ -2174,90 +2373,22 @@ def execute_template():
             'start_time': datetime.now(timezone.utc).isoformat(),
             'steps_total': len(template_data.get('steps', [])),
             'steps_completed': 0
-        }
-        save_deployment_history()
-        deploy_template_logger.info(f"Starting template deployment {deployment_id} for {template_name}")
-        
-        # Execute template in background thread
-        def execute_template_background(deployment_id, template_data, ft_number, deployments):
-            try:
-                logger.info(f"Starting template deployment {deployment_id} for {ft_number}")
+        })
+        save_deployment_history(deployment_id)
+        deploy_template_logger.info("Starting template deployment %s for %s", deployment_id, template_name)
         
-                
-                
-                if deployment_id not in deployments:
-                    logger.error(f"Deployment {deployment_id} not found in deployments")
-                    return
-                steps = template_data.get('steps', [])
-                dependencies = template_data.get('dependencies', [])
-                
-                # Sort steps by order
-                steps.sort(key=lambda x: x.get('order', 0))
-                
-                overall_success = True
-                
-                for step in steps:
-                    step_order = step.get('order')
-                    step_type = step.get('type')
-                    
-                    deployments[deployment_id]['logs'].append(f"\n=== Starting Step {step_order}: {step_type} ===")
-                    deployments[deployment_id]['logs'].append(f"Description: {step.get('description', 'N/A')}")
-                    
-                    # Execute the step
-                    success, step_logs = execute_template_step(step, inventory, db_inventory, deployment_id)
-                    
-                    # Add step logs to deployment logs
-                    deployments[deployment_id]['logs'].extend(step_logs)
-                    
-                    # Update progress
-                    deployments[deployment_id]['steps_completed'] += 1
-                    
-                    if not success:
-                        overall_success = False
-                        deployments[deployment_id]['logs'].append(f"Step {step_order} failed - stopping template execution")
-                        break
-                    
-                    deployments[deployment_id]['logs'].append(f"Step {step_order} completed successfully")
-                
-                # Update final status
-                final_status = 'success' if overall_success else 'failed'
-                deployments[deployment_id]['status'] = final_status
-                deployments[deployment_id]['end_time'] = datetime.now(timezone.utc).isoformat()
-                
-                deployments[deployment_id]['logs'].append(f"\n=== Template Deployment {final_status.upper()} ===")
-                
-                deploy_template_logger.info(f"Template deployment {deployment_id} completed with status: {final_status}")
-                
-                # Save deployment history after completion
-                try:
-                    save_deployment_history()
-                except Exception as save_error:
-                    deploy_template_logger.error(f"Failed to save deployment history: {save_error}")
-                
-            except Exception as e:
-                deploy_template_logger.error(f"Error in template execution background thread: {str(e)}")
-                deployments[deployment_id]['status'] = 'failed'
-                deployments[deployment_id]['logs'].append(f"Template execution failed: {str(e)}")
-                deployments[deployment_id]['end_time'] = datetime.now(timezone.utc).isoformat()
-                # Save deployment history even on failure
-                try:
-                    save_deployment_history()
-                except Exception as save_error:
-                    deploy_template_logger.error(f"Failed to save deployment history: {save_error}")
-
         ft_number = template_data.get('metadata', {}).get('ft_number', 'unknown')
-        # Start background execution
-        import threading
-        thread = threading.Thread(target=execute_template_background, args=(deployment_id, template_data, ft_number, deployments))
-        thread.daemon = True
-        thread.start()
+        # Queue the steps on the job scheduler
+        rejected = submit_job('template', deployment_id, template_data, ft_number, hosts=template_hosts(template_data))
+        if rejected:
+            return rejected
         
         return jsonify({
             'deployment_id': deployment_id,
             'status': 'started',
             'template_name': template_name
         })
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         if deployments[deployment_id]['status'] == 'success':
             try:
                 # Create deployment history entry for template
@@ -2267,7 +2398,7 @@ def execute_template():
                     'status': 'success',
                     'timestamp': datetime.now().isoformat(),
                     'ft': ft_number,
-                    'logs': deployments[deployment_id]['logs'],
+                    'logs': load_deployment_logs(deployment_id, deployments[deployment_id]),
                     'logged_in_user': logged_in_user
                 }
                 
@@ -2275,10 +2406,10 @@ def execute_template():
                 save_deployment_history_func = current_app.config.get('save_deployment_history')
                 if save_deployment_history_func:
                     save_deployment_history_func(deployment_entry)
-                    logger.info(f"Saved template deployment {deployment_id} to history")
+                    logger.info("Saved template deployment %s to history", deployment_id)
                 
             except Exception as e:
-                logger.error(f"Failed to save template deployment to history: {e}")
+                logger.error("Failed to save template deployment to history: %s", e)
         
         # Also save if failed
         elif deployments[deployment_id]['status'] == 'failed':
@@ -2289,20 +2420,20 @@ def execute_template():
                     'status': 'failed',
                     'timestamp': datetime.now().isoformat(),
                     'ft': ft_number,
-                    'logs': deployments[deployment_id]['logs'],
+                    'logs': load_deployment_logs(deployment_id, deployments[deployment_id]),
                     'logged_in_user': logged_in_user
                 }
                 
                 save_deployment_history_func = current_app.config.get('save_deployment_history')
                 if save_deployment_history_func:
                     save_deployment_history_func(deployment_entry)
-                    logger.info(f"Saved failed template deployment {deployment_id} to history")
+                    logger.info("Saved failed template deployment %s to history", deployment_id)
                 
             except Exception as e:
-                logger.error(f"Failed to save failed template deployment to history: {e}")
+                logger.error("Failed to save failed template deployment to history: %s", e)
 
     except Exception as e:
-        deploy_template_logger.error(f"Error executing template: {str(e)}")
+        deploy_template_logger.error("Error executing template: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # =============================================================================
@@ -2326,7 +2457,8 @@ def deploy_file():
     sudo = data.get('sudo', False)
     create_backup = data.get('createBackup', True)  # Default to true for safety
     
-    logger.info(f"File deployment request received from {current_user['username']}: {len(files)} file(s) from FT {ft} to {len(vms)} VMs")
+    logger.info("File deployment request received from %s: %s file(s) from FT %s to %s VMs",
+                current_user['username'], len(files), ft, len(vms))
     
     # Updated validation to check for files array
     if not all([ft, files, user, target_path, vms]) or len(files) == 0:
@@ -2337,7 +2469,7 @@ def deploy_file():
     deployment_id = str(uuid.uuid4())
     
     # Store deployment information with logged-in user
-    deployments[deployment_id] = {
+    deployment_registry.create(deployment_id, {
         "id": deployment_id,
         "type": "file",
         "ft": ft,
@@ -2352,15 +2484,18 @@ def deploy_file():
         "status": "running",
         "timestamp": time.time(),
         "logs": []
-    }
+    })
     
     # Save deployment history
-    save_deployment_history()
+    save_deployment_history(deployment_id)
     
-    # Start deployment in a separate thread
-    threading.Thread(target=process_file_deployment, args=(deployment_id,)).start()
+    # Queue the deployment on the job scheduler
+    rejected = submit_job('file', deployment_id, hosts=vms)
+    if rejected:
+        return rejected
     
-    logger.info(f"File deployment initiated by {current_user['username']} with ID: {deployment_id} for {len(files)} file(s)")
+    logger.info("File deployment initiated by %s with ID: %s for %s file(s)",
+                current_user['username'], deployment_id, len(files))
     return jsonify({
         "deploymentId": deployment_id,
         "initiatedBy": current_user['username'],
@@ -2369,6 +2504,7 @@ def deploy_file():
 
 def process_file_deployment(deployment_id):
     deployment = deployments[deployment_id]
+    vars_file = None
     
     try:
         ft = deployment["ft"]
@@ -2380,7 +2516,7 @@ def process_file_deployment(deployment_id):
         sudo = deployment["sudo"]
         create_backup = deployment.get("create_backup", True)
         
-        logger.info(f"Processing file deployment for {len(files)} file(s) initiated by {logged_in_user}")
+        logger.info("Processing file deployment for %s file(s) initiated by %s", len(files), logged_in_user)
 
         # Add debug logging to see actual values
         log_message(deployment_id, f"DEBUG: Deployment initiated by user: {logged_in_user}")
@@ -2399,142 +2535,37 @@ def process_file_deployment(deployment_id):
         if missing_files:
             error_msg = f"Source files not found: {', '.join(missing_files)}"
             log_message(deployment_id, f"ERROR: {error_msg}")
-            deployments[deployment_id]["status"] = "failed"
+            deployment_registry.update_status(deployment_id, "failed")
             logger.error(error_msg)
-            save_deployment_history()
+            save_deployment_history(deployment_id)
             return
         
         log_message(deployment_id, f"Starting file deployment for {len(files)} file(s) to {len(vms)} VMs (initiated by {logged_in_user})")
         log_message(deployment_id, f"Files to deploy: {', '.join(files)}")
         
-        # Generate an ansible playbook for multi-file deployment
-        playbook_file = f"/tmp/file_deploy_{deployment_id}.yml"
-        
-        with open(playbook_file, 'w') as f:
-            f.write(f"""---
-- name: Deploy multiple files to VMs (initiated by {logged_in_user})
-  hosts: deployment_targets
-  gather_facts: false
-  become: {"true" if sudo else "false"}
-  become_method: sudo
-  become_user: {user}
-  tasks:
-    # First test SSH connection to ensure it works
-    - name: Test connection
-      ansible.builtin.ping:
-      register: ping_result
-      
-    # Create the target directory if it does not exist
-    - name: Create target directory structure if it does not exist
-      ansible.builtin.file:
-        path: "{target_path}"
-        state: directory
-        mode: '0755'
-      become: {"true" if sudo else "false"}
-      become_user: {user}
-""")
-            
-            # Add tasks for each file
-            for file_name in files:
-                source_file = os.path.join(FIX_FILES_DIR, 'AllFts', ft, file_name)
-                final_target_path = os.path.join(target_path, file_name)
-                
-                f.write(f"""
-    # # Tasks for file: {file_name}
-    # - name: Check if {file_name} already exists
-    #   ansible.builtin.stat:
-    #     path: "{final_target_path}"
-    #   register: file_stat_{file_name.replace('.', '_').replace('-', '_')}
-
-    # - name: Generate timestamp for backup
-    #   ansible.builtin.command: date +%s
-    #   register: backup_timestamp_{file_name}
-    #   when: file_stat_{file_name.replace('.', '_').replace('-', '_')}.stat.exists and {str(create_backup).lower()}
-    # #   when: file_stat_{file_name}.stat.exists and {str(create_backup).lower()}
-    #   changed_when: false
-      
-    # - name: Create backup of existing {file_name} if it exists
-    #   ansible.builtin.copy:
-    #     src: "{final_target_path}"
-    #     dest: "{final_target_path}.bak.{{{{ backup_timestamp_{file_name}.stdout }}}}"
-    #     remote_src: yes
-    #   when: file_stat_{file_name.replace('.', '_').replace('-', '_')}.stat.exists and {str(create_backup).lower()}
-    #   register: backup_result_{file_name.replace('.', '_').replace('-', '_')}
-      
-    # - name: Log backup result for {file_name}
-    #   ansible.builtin.debug:
-    #     msg: "Created backup for {file_name} at {{{{ backup_result_{file_name.replace('.', '_').replace('-', '_')}.dest }}}} (deployment by {logged_in_user})"
-    #   when: backup_result_{file_name.replace('.', '_').replace('-', '_')}.changed is defined and backup_result_{file_name.replace('.', '_').replace('-', '_')}.changed
-      
-    # - name: Copy {file_name} to target VMs
-    #   ansible.builtin.copy:
-    #     src: "{source_file}"
-    #     dest: "{final_target_path}"
-    #     mode: '0644'
-    #     owner: "{user}"
-    #   register: copy_result_{file_name.replace('.', '_').replace('-', '_')}
-                  
-    # Tasks for file: {file_name}
-    - name: Check if {file_name} already exists
-      ansible.builtin.stat:
-        path: "{final_target_path}"
-      register: file_stat_{file_name.replace('.', '_').replace('-', '_')}
-      
-    - name: Create backup of existing {file_name} if it exists
-      ansible.builtin.copy:
-        src: "{final_target_path}"
-        # dest: "{final_target_path}.bak.{{{{ ansible_date_time.epoch }}}}"
-        dest: "{final_target_path}.b4.{ft}"
-        remote_src: yes
-      when: file_stat_{file_name.replace('.', '_').replace('-', '_')}.stat.exists and {str(create_backup).lower()}
-      register: backup_result_{file_name.replace('.', '_').replace('-', '_')}
-      
-    - name: Log backup result for {file_name}
-      ansible.builtin.debug:
-        msg: "Created backup for {file_name} at {{{{ backup_result_{file_name.replace('.', '_').replace('-', '_')}.dest }}}} (deployment by {logged_in_user})"
-      when: backup_result_{file_name.replace('.', '_').replace('-', '_')}.changed is defined and backup_result_{file_name.replace('.', '_').replace('-', '_')}.changed
-      
-    - name: Copy {file_name} to target VMs
-      ansible.builtin.copy:
-        src: "{source_file}"
-        dest: "{final_target_path}"
-        mode: '0644'
-        owner: "{user}"
-      register: copy_result_{file_name.replace('.', '_').replace('-', '_')}
-      
-    - name: Log copy result for {file_name}
-      ansible.builtin.debug:
-        msg: "File {file_name} copied successfully (deployment by {logged_in_user})"
-      when: copy_result_{file_name.replace('.', '_').replace('-', '_')}.changed
-""")
-            
-            # Add final summary task
-            f.write(f"""
-    - name: Deployment summary
-      ansible.builtin.debug:
-        msg: "Deployment completed for {len(files)} file(s): {', '.join(files)} (initiated by {logged_in_user})"
-""")
-        
-        logger.debug(f"Created Ansible playbook: {playbook_file}")
-        
-        # Generate inventory file for ansible
-        inventory_file = f"/tmp/inventory_{deployment_id}"
-        
-        with open(inventory_file, 'w') as f:
-            f.write("[deployment_targets]\n")
-            for vm_name in vms:
-                # Find VM IP from inventory
-                vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
-                if vm:
-                    # Add ansible_ssh_common_args to disable StrictHostKeyChecking for this connection
-                    f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
-        
-        logger.debug(f"Created Ansible inventory: {inventory_file}")
-        log_message(deployment_id, f"Created inventory file with targets: {', '.join(vms)}")
+        # Inputs of the static file deployment playbook; it loops over the files
+        vars_file = write_extra_vars('file_deploy', deployment_id, {
+            "files": [{"name": file_name,
+                       "src": os.path.join(FIX_FILES_DIR, 'AllFts', ft, file_name),
+                       "dest": os.path.join(target_path, file_name)} for file_name in files],
+            "target_path": target_path,
+            "target_user": user,
+            "use_sudo": bool(sudo),
+            "create_backup": bool(create_backup),
+            "backup_suffix": f".b4.{ft}",
+            "initiated_by": logged_in_user,
+        })
+        logger.debug("Wrote playbook inputs: %s", vars_file)
+        
+        # Cached ansible inventory of the target VMs
+        inventory_file, _ = inventory_cache.inventory_file(vms, holder=deployment_id)
+        
+        logger.debug("Using Ansible inventory: %s", inventory_file)
+        log_message(deployment_id, f"Using inventory file with targets: {', '.join(vms)}")
         
         # Test SSH connection to each target VM
         for vm_name in vms:
-            vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
+            vm = inventory_cache.vm(vm_name)
             if vm:
                 log_message(deployment_id, f"Testing SSH connection to {vm_name} ({vm['ip']})")
                 cmd = ["ssh", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", 
@@ -2558,52 +2589,36 @@ def process_file_deployment(deployment_id):
         log_message(deployment_id, "Ensured ansible control path directory exists with permissions 777")
         
         # Run ansible playbook
-        env_vars = os.environ.copy()
-        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+        env_vars = ansible_environment()
         
-        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-vvv"]
+        cmd = playbook_command('file_deploy', inventory_file, vars_file, "-vvv")
         
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
-        logger.info(f"Executing Ansible command: {' '.join(cmd)}")
+        logger.info("Executing Ansible command: %s", ' '.join(cmd))
         
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        return_code = run_ansible_playbook(deployment_id, cmd, env_vars)
         
-        for line in process.stdout:
-            line_stripped = line.strip()
-            log_message(deployment_id, line_stripped)
-            # Also log to main application log
-            logger.debug(f"[{deployment_id}] {line_stripped}")
-        
-        process.wait()
-        
-        if process.returncode == 0:
+        if return_code == 0:
             log_message(deployment_id, f"SUCCESS: Multi-file deployment completed successfully for {len(files)} file(s) (initiated by {logged_in_user})")
-            deployments[deployment_id]["status"] = "success"
-            logger.info(f"Multi-file deployment {deployment_id} completed successfully for {len(files)} file(s) (initiated by {logged_in_user})")
+            deployment_registry.update_status(deployment_id, "success")
+            logger.info("Multi-file deployment %s completed successfully for %s file(s) (initiated by %s)",
+                        deployment_id, len(files), logged_in_user)
         else:
             log_message(deployment_id, f"ERROR: Multi-file deployment failed (initiated by {logged_in_user})")
-            deployments[deployment_id]["status"] = "failed"
-            logger.error(f"Multi-file deployment {deployment_id} failed with return code {process.returncode} (initiated by {logged_in_user})")
-        
-        # Clean up temporary files
-        try:
-            os.remove(playbook_file)
-            os.remove(inventory_file)
-            logger.debug(f"Cleaned up temporary files for deployment {deployment_id}")
-        except Exception as e:
-            logger.warning(f"Error cleaning up temporary files: {str(e)}")
+            deployment_registry.update_status(deployment_id, "failed")
+            logger.error("Multi-file deployment %s failed with return code %s (initiated by %s)",
+                         deployment_id, return_code, logged_in_user)
         
         # Save deployment history after completion
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during multi-file deployment: {str(e)}")
-        deployments[deployment_id]["status"] = "failed"
-        logger.exception(f"Exception in multi-file deployment {deployment_id}: {str(e)}")
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.exception("Exception in multi-file deployment %s: %s", deployment_id, e)
+        save_deployment_history(deployment_id)
+    finally:
+        remove_extra_vars(deployment_id, vars_file)
 
 # @app.route('/api/deploy/file', methods=['POST'])
 # def deploy_file():
@@ -3162,21 +3177,24 @@ def process_file_deployment(deployment_id):
 #     return jsonify({"results": results})
 
 
+# Lines of the validate playbook's report: VALIDATION|<file>|<checksum size>|<mode owner group>
+VALIDATION_RESULT_PATTERN = re.compile(r'VALIDATION\|([^|"\n]*)\|([^|"\n]*)\|([^|"\n]*)')
+
 @app.route('/api/deploy/<deployment_id>/validate', methods=['POST'])
 def validate_deployment(deployment_id):
-    logger.info(f"Validating deployment with ID: {deployment_id}")
+    logger.info("Validating deployment with ID: %s", deployment_id)
     
     data = request.json or {}
     use_sudo = data.get('sudo', False)
 
     if deployment_id not in deployments:
-        logger.error(f"Deployment not found with ID: {deployment_id}")
+        logger.error("Deployment not found with ID: %s", deployment_id)
         return jsonify({"error": "Deployment not found"}), 404
     
     deployment = deployments[deployment_id]
 
     if deployment["type"] != "file":
-        logger.error(f"Cannot validate non-file deployment type: {deployment['type']}")
+        logger.error("Cannot validate non-file deployment type: %s", deployment['type'])
         return jsonify({"error": "Only file deployments can be validated"}), 400
     
     vms = deployment["vms"]
@@ -3185,220 +3203,92 @@ def validate_deployment(deployment_id):
     target_path = deployment["target_path"]
 
     if not files:
-        logger.error(f"No files found in deployment {deployment_id}")
+        logger.error("No files found in deployment %s", deployment_id)
         return jsonify({"error": "No files to validate"}), 400
 
     log_message(deployment_id, f"Starting validation for {len(files)} file(s) on {len(vms)} VMs")
     
     results = []
+    # Inputs of the static validation playbook, the same for every VM
+    validate_vars = write_extra_vars('validate', deployment_id, {
+        "files": [{"name": file_name, "path": os.path.join(target_path, file_name)} for file_name in files],
+        "use_sudo": bool(use_sudo),
+    })
 
-    for vm_name in vms:
-        vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
-        if not vm:
-            log_message(deployment_id, f"ERROR: VM {vm_name} not found in inventory")
-            results.append({
-                "vm": vm_name,
-                "status": "ERROR",
-                "message": "VM not found",
-                "files": []
-            })
-            continue
+    # One cached inventory holds all the VMs; each run is limited to one of them
+    validation_id = f"validate-{uuid.uuid4()}"
+    validate_inventory, _ = inventory_cache.inventory_file(vms, holder=validation_id)
 
-        try:
-            # Use tempfile to create unique playbook and inventory files
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.yml') as tmp_playbook, \
-                 tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp_inventory:
-                
-                validate_playbook = tmp_playbook.name
-                validate_inventory = tmp_inventory.name
-
-                # Write Ansible playbook for multiple files
-                tmp_playbook.write(f"""---
-- name: Validate files
-  hosts: {vm_name}
-  gather_facts: false
-  become: {"true" if use_sudo else "false"}
-  tasks:
-""")
-                
-                # Add tasks for each file
-                for i, file_name in enumerate(files):
-                    target_file_path = os.path.join(target_path, file_name)
-                    tmp_playbook.write(f"""
-    - name: Check if file {file_name} exists
-      stat:
-        path: "{target_file_path}"
-      register: file_check_{i}
-      failed_when: not file_check_{i}.stat.exists
-
-    - name: Get file checksum for {file_name}
-      shell: cksum "{target_file_path}" | awk '{{print $1, $2}}'
-      register: cksum_result_{i}
-      when: file_check_{i}.stat.exists
-
-    - name: Get file permissions for {file_name}
-      shell: ls -la "{target_file_path}" | awk '{{print $1, $3, $4}}'
-      register: perm_result_{i}
-      when: file_check_{i}.stat.exists
-""")
-
-            # Create inventory file
-            validate_inventory = f"/tmp/validate_inventory_{deployment_id}_{vm_name}"
-            with open(validate_inventory, 'w') as f:
-                f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'")
-
-            log_message(deployment_id, f"Running validation on {vm_name} for {len(files)} file(s)")
-            cmd = ["ansible-playbook", "-i", validate_inventory, validate_playbook, "--limit", vm_name, "-v"]
-            output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode().strip()
-            logger.debug(f"Validation output for {vm_name}: {output}")
-            log_message(deployment_id, f"Raw validation output on {vm_name}: {output}")
-
-            # Process results for each file
-
-            file_results = []
-            for i, file_name in enumerate(files):
-                # Initialize defaults
-                cksum_info = "File not found"
-                perm_info = "N/A"
-
-                logger.debug(f"Processing file {file_name} (index {i}) for VM {vm_name}")
-
-                # Try multiple patterns to extract checksum
-                checksum_patterns = [
-                    # Pattern 1: Look for the specific task output
-                    rf'TASK \[Get file checksum for {re.escape(file_name)}\].*?"stdout": "([^"]*)"',
-                    # Pattern 2: Look for cksum_result_{i} variable
-                    rf'"var": "cksum_result_{i}".*?"stdout": "([^"]*)"',
-                    # Pattern 3: Look for any cksum_result_{i} pattern
-                    rf'cksum_result_{i}.*?"stdout": "([^"]*)"',
-                    # Pattern 4: Look for checksum pattern in debug output
-                    rf'DEBUG:.*{re.escape(file_name)}.*?(\d+\s+\d+)',
-                    # Pattern 5: Generic checksum pattern near file name
-                    rf'{re.escape(file_name)}.*?(\d+\s+\d+)'
-                ]
-
-                for pattern in checksum_patterns:
-                    cksum_match = re.search(pattern, output, re.DOTALL | re.IGNORECASE)
-                    if cksum_match:
-                        cksum_info = cksum_match.group(1).strip()
-                        logger.debug(f"Extracted checksum for {vm_name}:{file_name} using pattern: {cksum_info}")
-                        break
+    try:
+        for vm_name in vms:
+            vm = inventory_cache.vm(vm_name)
+            if not vm:
+                log_message(deployment_id, f"ERROR: VM {vm_name} not found in inventory")
+                results.append({
+                    "vm": vm_name,
+                    "status": "ERROR",
+                    "message": "VM not found",
+                    "files": []
+                })
+                continue
 
-                # Try multiple patterns to extract permissions
-                permission_patterns = [
-                    # Pattern 1: Look for the specific task output
-                    rf'TASK \[Get file permissions for {re.escape(file_name)}\].*?"stdout": "([^"]*)"',
-                    # Pattern 2: Look for perm_result_{i} variable
-                    rf'"var": "perm_result_{i}".*?"stdout": "([^"]*)"',
-                    # Pattern 3: Look for any perm_result_{i} pattern
-                    rf'perm_result_{i}.*?"stdout": "([^"]*)"',
-                    # Pattern 4: Look for permission pattern in debug output
-                    rf'DEBUG:.*{re.escape(file_name)}.*?(-[rwx-]+\.?\s+\w+\s+\w+)',
-                    # Pattern 5: Generic permission pattern near file name
-                    rf'{re.escape(file_name)}.*?(-[rwx-]+\.?\s+\w+\s+\w+)'
-                ]
-
-                for pattern in permission_patterns:
-                    perm_match = re.search(pattern, output, re.DOTALL | re.IGNORECASE)
-                    if perm_match:
-                        perm_info = perm_match.group(1).strip()
-                        logger.debug(f"Extracted permissions for {vm_name}:{file_name} using pattern: {perm_info}")
-                        break
+            try:
+                log_message(deployment_id, f"Running validation on {vm_name} for {len(files)} file(s)")
+                cmd = playbook_command('validate', validate_inventory, validate_vars, "--limit", vm_name, "-v")
+                output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode().strip()
+                logger.debug("Validation output for %s: %s", vm_name, output)
+                log_message(deployment_id, f"Raw validation output on {vm_name}: {output}")
+
+                # The playbook reports every file it found; the others do not exist
+                reported = {name: (cksum, perm) for name, cksum, perm in VALIDATION_RESULT_PATTERN.findall(output)}
+                file_results = []
+                for file_name in files:
+                    cksum_info, perm_info = reported.get(file_name, ("File not found", "N/A"))
+                    cksum_info = cksum_info.strip() or "File not found"
+                    perm_info = perm_info.strip() or "N/A"
 
-                # If we still don't have checksum, try looking in the debug logs from your backend
-                if cksum_info == "File not found":
-                    # Look for the debug pattern from your logs
-                    debug_pattern = rf'DEBUG:fix_deployment_orchestrator:.*{re.escape(file_name)}.*?(\d+\s+\d+)'
-                    debug_match = re.search(debug_pattern, output, re.IGNORECASE)
-                    if debug_match:
-                        cksum_info = debug_match.group(1).strip()
-                        logger.debug(f"Extracted checksum from debug log for {vm_name}:{file_name}: {cksum_info}")
-
-                # Log what we found for debugging
-                logger.info(f"Final extraction for {vm_name}:{file_name} - Checksum: '{cksum_info}', Permissions: '{perm_info}'")
-
-                file_results.append({
-                    "file": file_name,
-                    "cksum": cksum_info,
-                    "permissions": perm_info,
-                    "status": "SUCCESS" if cksum_info != "File not found" else "ERROR"
-                })
+                    logger.info("Final extraction for %s:%s - Checksum: '%s', Permissions: '%s'",
+                                vm_name, file_name, cksum_info, perm_info)
 
-                result_message = f"{file_name}: Checksum={cksum_info}, Permissions={perm_info}"
-                log_message(deployment_id, f"Validation on {vm_name}: {result_message}")
-            # file_results = []
-            # for i, file_name in enumerate(files):
-            #     # Initialize defaults
-            #     cksum_info = "File not found"
-            #     perm_info = "N/A"
-
-            #     # Extract checksum for this specific file
-            #     cksum_pattern = rf'TASK \[Get file checksum for {re.escape(file_name)}\].*?"stdout": "([^"]*)"'
-            #     cksum_match = re.search(cksum_pattern, output, re.DOTALL)
-            #     if cksum_match:
-            #         cksum_info = cksum_match.group(1).strip()
-            #         logger.debug(f"Extracted checksum for {vm_name}:{file_name}: {cksum_info}")
-            #     else:
-            #         # Fallback: try to find cksum_result_{i} pattern
-            #         fallback_cksum = re.search(rf'"var": "cksum_result_{i}".*?"stdout": "(\d+\s+\d+)"', output, re.DOTALL)
-            #         if fallback_cksum:
-            #             cksum_info = fallback_cksum.group(1).strip()
-            #             logger.debug(f"Extracted checksum (fallback) for {vm_name}:{file_name}: {cksum_info}")
-
-            #     # Extract permissions for this specific file
-            #     perm_pattern = rf'TASK \[Get file permissions for {re.escape(file_name)}\].*?"stdout": "([^"]*)"'
-            #     perm_match = re.search(perm_pattern, output, re.DOTALL)
-            #     if perm_match:
-            #         perm_info = perm_match.group(1).strip()
-            #         logger.debug(f"Extracted permissions for {vm_name}:{file_name}: {perm_info}")
-            #     else:
-            #         # Fallback: try to find perm_result_{i} pattern
-            #         fallback_perm = re.search(rf'"var": "perm_result_{i}".*?"stdout": "(-[rwx-]+\.?\s+\w+\s+\w+)"', output, re.DOTALL)
-            #         if fallback_perm:
-            #             perm_info = fallback_perm.group(1).strip()
-            #             logger.debug(f"Extracted permissions (fallback) for {vm_name}:{file_name}: {perm_info}")
-
-            #     file_results.append({
-            #         "file": file_name,
-            #         "cksum": cksum_info,
-            #         "permissions": perm_info,
-            #         "status": "SUCCESS" if cksum_info != "File not found" else "ERROR"
-            #     })
-
-            #     result_message = f"{file_name}: Checksum={cksum_info}, Permissions={perm_info}"
-            #     log_message(deployment_id, f"Validation on {vm_name}: {result_message}")
-
-            # Overall result for the VM
-            overall_status = "SUCCESS" if all(f["status"] == "SUCCESS" for f in file_results) else "PARTIAL" if any(f["status"] == "SUCCESS" for f in file_results) else "ERROR"
-            
-            results.append({
-                "vm": vm_name,
-                "status": overall_status,
-                "message": f"Validated {len(file_results)} file(s)",
-                "files": file_results
-            })
+                    file_results.append({
+                        "file": file_name,
+                        "cksum": cksum_info,
+                        "permissions": perm_info,
+                        "status": "SUCCESS" if cksum_info != "File not found" else "ERROR"
+                    })
 
-        except subprocess.CalledProcessError as e:
-            error = e.output.decode().strip()
-            log_message(deployment_id, f"Validation failed on {vm_name}: {error}")
-            results.append({
-                "vm": vm_name,
-                "status": "ERROR",
-                "message": "Validation failed",
-                "output": error,
-                "files": []
-            })
+                    result_message = f"{file_name}: Checksum={cksum_info}, Permissions={perm_info}"
+                    log_message(deployment_id, f"Validation on {vm_name}: {result_message}")
 
-        finally:
-            # Ensure cleanup even on error
-            try:
-                os.remove(validate_playbook)
-                os.remove(validate_inventory)
-            except Exception as cleanup_err:
-                logger.warning(f"Failed to clean up temp files for {vm_name}: {cleanup_err}")
+                # Overall result for the VM
+                overall_status = "SUCCESS" if all(f["status"] == "SUCCESS" for f in file_results) else "PARTIAL" if any(f["status"] == "SUCCESS" for f in file_results) else "ERROR"
+            
+                results.append({
+                    "vm": vm_name,
+                    "status": overall_status,
+                    "message": f"Validated {len(file_results)} file(s)",
+                    "files": file_results
+                })
 
-    logger.info(f"Validation completed for deployment {deployment_id} with {len(results)} results")
-    save_deployment_history()
+            except subprocess.CalledProcessError as e:
+                error = e.output.decode().strip()
+                log_message(deployment_id, f"Validation failed on {vm_name}: {error}")
+                results.append({
+                    "vm": vm_name,
+                    "status": "ERROR",
+                    "message": "Validation failed",
+                    "output": error,
+                    "files": []
+                })
+    finally:
+        inventory_cache.release(validation_id)
+        try:
+            os.remove(validate_vars)
+        except OSError as cleanup_err:
+            logger.warning("Failed to clean up validation inputs: %s", cleanup_err)
+
+    logger.info("Validation completed for deployment %s with %s results", deployment_id, len(results))
+    save_deployment_history(deployment_id)
     return jsonify({"results": results})
 
 # API to run shell command
@@ -3416,7 +3306,7 @@ def run_shell_command():
     user = data.get('user', 'infadm')
     working_dir = data.get('workingDir', '')
     
-    logger.info(f"Shell command request received: '{command}' on {len(vms)} VMs as user {user}")
+    logger.info("Shell command request received: '%s' on %s VMs as user %s", command, len(vms), user)
     
     if not all([command, vms]):
         logger.error("Missing required parameters for shell command")
@@ -3426,7 +3316,7 @@ def run_shell_command():
     deployment_id = str(uuid.uuid4())
     
     # Store deployment information
-    deployments[deployment_id] = {
+    deployment_registry.create(deployment_id, {
         "id": deployment_id,
         "type": "command",
         "command": command,
@@ -3439,15 +3329,17 @@ def run_shell_command():
         "status": "running",
         "timestamp": time.time(),
         "logs": []
-    }
+    })
     
     # Save deployment history
-    save_deployment_history()
+    save_deployment_history(deployment_id)
     
-    # Start command execution in a separate thread
-    threading.Thread(target=process_shell_command, args=(deployment_id,)).start()
+    # Queue the command on the job scheduler
+    rejected = submit_job('command', deployment_id, hosts=vms)
+    if rejected:
+        return rejected
     
-    logger.info(f"Shell command initiated by {current_user['username']} with ID: {deployment_id}")
+    logger.info("Shell command initiated by %s with ID: %s", current_user['username'], deployment_id)
     return jsonify({
         "deploymentId": deployment_id,
         "initiatedBy": current_user['username'],
@@ -3457,6 +3349,7 @@ def run_shell_command():
 
 def process_shell_command(deployment_id):
     deployment = deployments[deployment_id]
+    vars_file = None
     
     try:
         command = deployment["command"]
@@ -3468,75 +3361,20 @@ def process_shell_command(deployment_id):
         
         log_message(deployment_id, f"Running command on {len(vms)} VMs: {command} initiated by {logged_in_user}")
         
-        # Generate an ansible playbook for shell command
-        playbook_file = f"/tmp/shell_command_{deployment_id}.yml"
-        
-        # Enhanced playbook with proper variable handling
-        with open(playbook_file, 'w') as f:
-            f.write(f"""---
-- name: Run shell command on VMs (initiated by {logged_in_user})
-  hosts: command_targets
-  gather_facts: true
-  become: {"true" if sudo else "false"}
-  become_method: sudo
-  become_user: {user}
-  vars:
-    working_dir: "{working_dir}"
-    target_user: "{user}"
-    use_sudo: {"true" if sudo else "false"}
-  tasks:
-    # Test connection
-    - name: Test connection
-      ansible.builtin.ping:
-      
-    # Debug working directory value
-    - name: Debug working_dir value
-      ansible.builtin.debug:
-        msg: "working_dir is '{{{{ working_dir | default('UNDEFINED') }}}}'"
-
-    # Create working directory if specified and doesn't exist
-    - name: Ensure working directory exists
-      ansible.builtin.file:
-        path: "{{{{ working_dir }}}}"
-        state: directory
-        mode: '0755'
-      when: working_dir is defined and working_dir | trim | length > 0
-      become: "{{{{ use_sudo }}}}"
-      become_user: "{{{{ target_user if use_sudo else omit }}}}"
-      
-    # Execute the shell command
-    - name: Execute shell command
-      ansible.builtin.shell: "{command}"
-      args:
-        executable: /bin/bash
-        chdir: "{{{{ working_dir if (working_dir is defined and working_dir | trim | length > 0) else '~' }}}}"
-      register: command_result 
-
-    # Log command result
-    - name: Log command result
-      ansible.builtin.debug:
-        var: command_result.stdout_lines
-        
-    # Also log stderr if there are errors
-    - name: Log command errors (if any)
-      ansible.builtin.debug:
-        var: command_result.stderr_lines
-      when: command_result.stderr_lines is defined and command_result.stderr_lines | length > 0
-""")
-        logger.debug(f"Created Ansible playbook for shell command: {playbook_file}")
-        
-        # Generate inventory file for ansible
-        inventory_file = f"/tmp/inventory_{deployment_id}"
-        
-        with open(inventory_file, 'w') as f:
-            f.write("[command_targets]\n")
-            for vm_name in vms:
-                # Find VM IP from inventory
-                vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
-                if vm:
-                    f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
-        
-        logger.debug(f"Created Ansible inventory: {inventory_file}")
+        # Inputs of the static shell command playbook
+        vars_file = write_extra_vars('shell_command', deployment_id, {
+            "shell_command": command,
+            "working_dir": working_dir,
+            "target_user": user,
+            "use_sudo": bool(sudo),
+            "initiated_by": logged_in_user,
+        })
+        logger.debug("Wrote playbook inputs for shell command: %s", vars_file)
+        
+        # Cached ansible inventory of the target VMs
+        inventory_file, _ = inventory_cache.inventory_file(vms, holder=deployment_id)
+        
+        logger.debug("Using Ansible inventory: %s", inventory_file)
         
         # Ensure control path directory exists
         os.makedirs('/tmp/ansible-ssh', exist_ok=True)
@@ -3547,51 +3385,35 @@ def process_shell_command(deployment_id):
             logger.info("Could not set permissions on /tmp/ansible-ssh - continuing with existing permissions")
         
         # Run ansible playbook
-        env_vars = os.environ.copy()
-        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+        env_vars = ansible_environment()
         
-        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+        cmd = playbook_command('shell_command', inventory_file, vars_file, "-v")
         
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
-        logger.info(f"Executing Ansible command: {' '.join(cmd)}")
-        
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        logger.info("Executing Ansible command: %s", ' '.join(cmd))
         
-        for line in process.stdout:
-            line_stripped = line.strip()
-            log_message(deployment_id, line_stripped)
-            # Also log to main application log
-            logger.debug(f"[{deployment_id}] {line_stripped}")
+        return_code = run_ansible_playbook(deployment_id, cmd, env_vars)
         
-        process.wait()
-        
-        if process.returncode == 0:
+        if return_code == 0:
             log_message(deployment_id, f"SUCCESS: Shell command executed successfully (initiated by {logged_in_user})")
-            deployments[deployment_id]["status"] = "success"
-            logger.info(f"Shell command {deployment_id} completed successfully (initiated by {logged_in_user})")
+            deployment_registry.update_status(deployment_id, "success")
+            logger.info("Shell command %s completed successfully (initiated by %s)", deployment_id, logged_in_user)
         else:
             log_message(deployment_id, f"ERROR: Shell command execution failed (initiated by {logged_in_user})")
-            deployments[deployment_id]["status"] = "failed"
-            logger.error(f"Shell command {deployment_id} failed with return code {process.returncode} (initiated by {logged_in_user})")
-        
-        # Clean up temporary files
-        try:
-            os.remove(playbook_file)
-            os.remove(inventory_file)
-        except Exception as e:
-            logger.warning(f"Error cleaning up temporary files: {str(e)}")
+            deployment_registry.update_status(deployment_id, "failed")
+            logger.error("Shell command %s failed with return code %s (initiated by %s)",
+                         deployment_id, return_code, logged_in_user)
         
         # Save deployment history after completion
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during shell command execution: {str(e)}")
-        deployments[deployment_id]["status"] = "failed"
-        logger.exception(f"Exception in shell command {deployment_id}: {str(e)}")
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.exception("Exception in shell command %s: %s", deployment_id, e)
+        save_deployment_history(deployment_id)
+    finally:
+        remove_extra_vars(deployment_id, vars_file)
 
 # API to get deployment history
 
@@ -3599,153 +3421,53 @@ def process_shell_command(deployment_id):
 def get_deployment_history():
     try:
         logger.info("=== START: Getting deployment history ===")
-        logger.debug(f"Request method: {request.method}")
-        logger.debug(f"Request headers: {dict(request.headers)}")
-        logger.debug(f"Request args: {request.args}")
-        
-        # Log deployments variable state
-        logger.debug(f"Deployments variable exists: {deployments is not None}")
-        logger.debug(f"Deployments type: {type(deployments)}")
-        logger.debug(f"Deployments length: {len(deployments) if deployments else 0}")
-        logger.debug(f"Deployments keys: {list(deployments.keys()) if deployments else []}")
-        
-        # Check if deployments is empty, try to reload from file
-        if not deployments:
-            logger.info("Deployments dictionary is empty, attempting to reload from file")
-            try:
-                logger.debug(f"Checking if history file exists: {DEPLOYMENT_HISTORY_FILE}")
-                logger.debug(f"File exists: {os.path.exists(DEPLOYMENT_HISTORY_FILE)}")
-                
-                if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-                    with open(DEPLOYMENT_HISTORY_FILE, 'r') as f:
-                        loaded_deployments = json.load(f)
-                        logger.debug(f"Loaded deployments type: {type(loaded_deployments)}")
-                        logger.debug(f"Loaded deployments length: {len(loaded_deployments) if loaded_deployments else 0}")
-                        
-                        if loaded_deployments:
-                            # Update global deployments dictionary
-                            deployments.clear()
-                            deployments.update(loaded_deployments)
-                            logger.info(f"Successfully reloaded {len(deployments)} deployments from history file")
-                        else:
-                            logger.warning("Loaded deployments is empty or None")
-                else:
-                    logger.warning(f"Deployment history file does not exist: {DEPLOYMENT_HISTORY_FILE}")
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error when loading deployment history: {str(e)}")
-                logger.error(f"Error line: {e.lineno}, column: {e.colno}")
-            except Exception as e:
-                logger.error(f"Failed to reload deployment history: {str(e)}")
-                import traceback
-                logger.error(f"Full traceback: {traceback.format_exc()}")
-        
-        # Log current deployments state before processing
-        logger.debug(f"Final deployments count before processing: {len(deployments)}")
-        
-        # Get deployment values and normalize timestamps
-        logger.debug("Starting deployment processing...")
-        deployment_values = list(deployments.values())
-        logger.debug(f"Deployment values count: {len(deployment_values)}")
-        
-        # Normalize timestamps to consistent format (float/unix timestamp)
-        for i, d in enumerate(deployment_values):
-            original_timestamp = d.get("timestamp", 0)
-            logger.debug(f"Processing deployment {i}: original timestamp={original_timestamp} (type: {type(original_timestamp)})")
-            
-            try:
-                # Convert timestamp to float (unix timestamp) for consistent sorting
-                if isinstance(original_timestamp, str):
-                    # Try to parse string timestamp
-                    try:
-                        # Try ISO format first
-                        from datetime import datetime
-                        dt = datetime.fromisoformat(original_timestamp.replace('Z', '+00:00'))
-                        normalized_timestamp = dt.timestamp()
-                        logger.debug(f"Converted ISO string timestamp to float: {normalized_timestamp}")
-                    except ValueError:
-                        try:
-                            # Try other common formats
-                            dt = datetime.strptime(original_timestamp, '%Y-%m-%dT%H:%M:%S')
-                            normalized_timestamp = dt.timestamp()
-                            logger.debug(f"Converted string timestamp to float: {normalized_timestamp}")
-                        except ValueError:
-                            # If parsing fails, try to convert directly to float
-                            try:
-                                normalized_timestamp = float(original_timestamp)
-                                logger.debug(f"Converted string to float directly: {normalized_timestamp}")
-                            except ValueError:
-                                logger.warning(f"Could not parse timestamp '{original_timestamp}', using current time")
-                                normalized_timestamp = time.time()
-                elif isinstance(original_timestamp, (int, float)):
-                    normalized_timestamp = float(original_timestamp)
-                    logger.debug(f"Timestamp already numeric: {normalized_timestamp}")
-                else:
-                    logger.warning(f"Unknown timestamp type: {type(original_timestamp)}, using current time")
-                    normalized_timestamp = time.time()
-                
-                # Store normalized timestamp for sorting
-
-                d["_sort_timestamp"] = normalized_timestamp
-                
-            except Exception as e:
-                logger.error(f"Error processing timestamp for deployment {i}: {str(e)}")
-                d["_sort_timestamp"] = time.time()  # Default fallback
-        
-        # Sort deployments by normalized timestamp, newest first
-        logger.debug("Starting deployment sorting...")
-        for dep_id, dep in deployments.items():
-            dep['id'] = dep_id
-
-        sorted_deployments = sorted(
-            deployment_values,
-            key=lambda x: x.get("_sort_timestamp", 0),
-            reverse=True
-        )
-        logger.debug(f"Sorted deployments count: {len(sorted_deployments)}")
-        
-        # Convert timestamps to ISO format for API response and clean up sort field
-        logger.debug("Converting timestamps for API response...")
-        for i, d in enumerate(sorted_deployments):
-            sort_timestamp = d.get("_sort_timestamp", 0)
-            
+        logger.debug("Request args: %s", request.args)
+        
+        # Optional filters, evaluated by the repository indexes
+        filters = {key: request.args.get(key) for key in ('type', 'status', 'ft', 'user')}
+        limit = request.args.get('limit', type=int)
+        offset = request.args.get('offset', 0, type=int)
+        # Optional time range (ISO or unix timestamps); only overlapping archive partitions are read
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = normalize_timestamp(since) if since else None
+        until = normalize_timestamp(until) if until else None
+        
+        live = deployment_repository.query(filters, since=since, until=until,
+                                           limit=None if limit is None else offset + limit)
+        # Archived rows come from the partition indexes; only the ones on the page are read
+        archived = history_archive.query(filters, since=since, until=until, with_data=False)
+        rows = itertools.islice(merge_newest_first(live, archived), offset,
+                                None if limit is None else offset + limit)
+        
+        id_to_deployment = {}
+        for dep_id, sort_timestamp, d in rows:
+            if d is None:
+                d = history_archive.get(dep_id, partition_day(sort_timestamp))
+                if d is None:
+                    # Dropped by retention meanwhile
+                    continue
+            d['id'] = dep_id
             try:
-                # Convert to ISO format for API response
-                # d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sort_timestamp))
-                # d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(sort_timestamp))
                 d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(sort_timestamp))
-                logger.debug(f"Final timestamp for deployment {i}: {d['timestamp']}")
             except Exception as e:
-                logger.error(f"Error converting timestamp for deployment {i}: {str(e)}")
+                logger.error("Error converting timestamp for deployment %s: %s", dep_id, e)
                 d["timestamp"] = "1970-01-01T00:00:00"  # Default fallback
             
-            # Remove the temporary sort field
-            if "_sort_timestamp" in d:
-                del d["_sort_timestamp"]
-            
-            # Ensure logs field is present
-            if "logs" not in d:
-                d["logs"] = []
-                logger.debug(f"Added empty logs array to deployment {i}")
-            else:
-                logger.debug(f"Deployment {i} already has {len(d.get('logs', []))} log entries")
+            # Logs are served by /api/deploy/<id>/logs; history only carries log_count
+            id_to_deployment[dep_id] = d
         
-        logger.info(f"Successfully processed {len(sorted_deployments)} deployments")
+        logger.info("Successfully processed %s deployments", len(id_to_deployment))
         logger.debug("=== END: Getting deployment history ===")
         
-        id_to_deployment = {
-            d.get('id', f"unknown-{i}"): d
-            for i, d in enumerate(sorted_deployments)
-        }
-
         return jsonify(id_to_deployment)
-        # return jsonify(sorted_deployments)
         
     except Exception as e:
         import traceback
         logger.error("=== CRITICAL ERROR in get_deployment_history ===")
-        logger.error(f"Error type: {type(e).__name__}")
-        logger.error(f"Error message: {str(e)}")
-        logger.error(f"Full traceback:\n{traceback.format_exc()}")
+        logger.error("Error type: %s", type(e).__name__)
+        logger.error("Error message: %s", e)
+        logger.error("Full traceback:\n%s", traceback.format_exc())
         logger.error("=== END CRITICAL ERROR ===")
         
         # Return JSON error response
@@ -3828,92 +3550,64 @@ def get_recent_file_deployments():
     try:
         logger.info("Fetching recent file deployments")
         
-        # Filter and sort deployments
-        file_deployments = []
-        
-        for deployment_id, deployment in deployments.items():
-            # Only include successful file deployments
-            if (deployment.get("type") == "file" and 
-                deployment.get("status") == "success"):
-                
-                # Ensure timestamp is properly formatted
-                timestamp = deployment.get("timestamp")
-                if isinstance(timestamp, (int, float)):
-                    # Convert to ISO format for consistent frontend handling
-                    deployment_copy = deployment.copy()
-                    deployment_copy["timestamp"] = datetime.fromtimestamp(timestamp).isoformat()
-                elif isinstance(timestamp, str):
-                    # Keep string timestamps as-is (should already be ISO format)
-                    deployment_copy = deployment.copy()
-                else:
-                    # Fallback for missing/invalid timestamps
-                    deployment_copy = deployment.copy()
-                    deployment_copy["timestamp"] = datetime.now(timezone.utc).isoformat()
-                
-                # Handle both single file (legacy) and multiple files display
-                files = deployment_copy.get("files", [deployment_copy.get("file")] if deployment_copy.get("file") else [])
-                
-                if files:
-                    # Add file count and file list for frontend display
-                    deployment_copy["fileCount"] = len(files)
-                    deployment_copy["filesList"] = files
-                    
-                    # Create a display name that shows file count and names
-                    if len(files) == 1:
-                        deployment_copy["displayName"] = f"File: {files[0]}"
-                    else:
-                        # For multiple files, show count and first few file names
-                        if len(files) <= 3:
-                            deployment_copy["displayName"] = f"Files ({len(files)}): {', '.join(files)}"
-                        else:
-                            # Show first 2 files and indicate there are more
-                            first_files = ', '.join(files[:2])
-                            deployment_copy["displayName"] = f"Files ({len(files)}): {first_files} and {len(files)-2} more..."
-                    
-                    # Add summary for logs/UI
-                    deployment_copy["summary"] = f"Deployed {len(files)} file(s) to {len(deployment_copy.get('vms', []))} VM(s)"
-                    
-                    file_deployments.append(deployment_copy)
-                else:
-                    # Skip deployments with no files
-                    logger.warning(f"Skipping deployment {deployment_id} - no files found")
-        
-        # Sort by timestamp (most recent first)
-        # Convert timestamps to floats for sorting
-        for deployment in file_deployments:
-            timestamp_str = deployment["timestamp"]
-            try:
-                if 'T' in timestamp_str:
-                    # ISO format
-                    dt = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                    deployment["_sort_timestamp"] = dt.timestamp()
-                else:
-                    # Assume it's already a timestamp string
-                    deployment["_sort_timestamp"] = float(timestamp_str)
-            except (ValueError, TypeError):
-                # Fallback to current time for invalid timestamps
-                deployment["_sort_timestamp"] = time.time()
-        
-        # Sort by the normalized timestamp
-        file_deployments.sort(key=lambda x: x["_sort_timestamp"], reverse=True)
-        
-        # Remove the temporary sorting field and limit to 10 most recent
+        # Indexed on (type, status, timestamp), already newest first
         recent_deployments = []
-        for deployment in file_deployments[:10]:
-            deployment.pop("_sort_timestamp", None)
-            recent_deployments.append(deployment)
+        rows = deployment_repository.query({'type': 'file', 'status': 'success'})
+        for deployment_id, sort_timestamp, deployment_copy in rows:
+            deployment_copy.setdefault("id", deployment_id)
+            
+            # Ensure timestamp is properly formatted
+            timestamp = deployment_copy.get("timestamp")
+            if isinstance(timestamp, (int, float)):
+                # Convert to ISO format for consistent frontend handling
+                deployment_copy["timestamp"] = datetime.fromtimestamp(timestamp).isoformat()
+            elif not isinstance(timestamp, str):
+                # Fallback for missing/invalid timestamps
+                deployment_copy["timestamp"] = datetime.now(timezone.utc).isoformat()
+            
+            # Handle both single file (legacy) and multiple files display
+            files = deployment_copy.get("files", [deployment_copy.get("file")] if deployment_copy.get("file") else [])
+            
+            if not files:
+                # Skip deployments with no files
+                logger.warning("Skipping deployment %s - no files found", deployment_id)
+                continue
+            
+            # Add file count and file list for frontend display
+            deployment_copy["fileCount"] = len(files)
+            deployment_copy["filesList"] = files
+            
+            # Create a display name that shows file count and names
+            if len(files) == 1:
+                deployment_copy["displayName"] = f"File: {files[0]}"
+            else:
+                # For multiple files, show count and first few file names
+                if len(files) <= 3:
+                    deployment_copy["displayName"] = f"Files ({len(files)}): {', '.join(files)}"
+                else:
+                    # Show first 2 files and indicate there are more
+                    first_files = ', '.join(files[:2])
+                    deployment_copy["displayName"] = f"Files ({len(files)}): {first_files} and {len(files)-2} more..."
+            
+            # Add summary for logs/UI
+            deployment_copy["summary"] = f"Deployed {len(files)} file(s) to {len(deployment_copy.get('vms', []))} VM(s)"
+            
+            recent_deployments.append(deployment_copy)
+            # Limit to 10 most recent
+            if len(recent_deployments) >= 10:
+                break
         
-        logger.info(f"Found {len(recent_deployments)} recent file deployments")
+        logger.info("Found %s recent file deployments", len(recent_deployments))
         
         # Log summary for debugging
         for deployment in recent_deployments[:3]:  # Log first 3 for debugging
             files_info = f"{deployment.get('fileCount', 0)} file(s)"
-            logger.debug(f"Recent deployment: {deployment['id'][:8]}... - {files_info} - {deployment.get('displayName', 'No display name')}")
+            logger.debug("Recent deployment: %s... - %s - %s", deployment['id'][:8], files_info, deployment.get('displayName', 'No display name'))
         
         return jsonify(recent_deployments)
         
     except Exception as e:
-        logger.error(f"Error fetching recent file deployments: {str(e)}")
+        logger.error("Error fetching recent file deployments: %s", e)
         return jsonify({"error": "Failed to fetch recent deployments"}), 500
 
 # API to get logs for a specific deployment
@@ -3921,56 +3615,38 @@ def get_recent_file_deployments():
 
 @app.route('/api/deploy/<deployment_id>/logs')
 def get_deployment_logs(deployment_id):
-    logger.info(f"Getting logs for deployment: {deployment_id}")
+    logger.info("Getting logs for deployment: %s", deployment_id)
     
     def find_deployment_with_retry(deployment_id, max_retries=3):
         """Find deployment with retry logic for race conditions"""
         
         for attempt in range(max_retries):
-            logger.debug(f"Attempt {attempt + 1} to find deployment {deployment_id}")
+            logger.debug("Attempt %s to find deployment %s", attempt + 1, deployment_id)
             
             # First check in-memory deployments
             if deployment_id in deployments:
-                logger.info(f"Found deployment {deployment_id} in memory on attempt {attempt + 1}")
+                logger.info("Found deployment %s in memory on attempt %s", deployment_id, attempt + 1)
                 return deployments[deployment_id]
             
-            # If not found in memory, try to load from history file
-            logger.debug(f"Deployment {deployment_id} not in memory, checking history file (attempt {attempt + 1})")
+            # If not found in memory, try the deployment repository
+            logger.debug("Deployment %s not in memory, checking deployment repository (attempt %s)", deployment_id, attempt + 1)
             
             try:
-                if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-                    # Add increasing delay for each retry to handle race conditions
-                    if attempt > 0:
-                        delay = 0.5 * attempt
-                        logger.debug(f"Waiting {delay}s before reading file (attempt {attempt + 1})")
-                        time.sleep(delay)
+                deployment = deployment_repository.get(deployment_id)
+                if deployment is not None:
+                    logger.info("Found deployment %s in deployment repository on attempt %s",
+                                deployment_id, attempt + 1)
                     
-                    with open(DEPLOYMENT_HISTORY_FILE, 'r') as f:
-                        saved_deployments = json.load(f)
-                        
-                        if deployment_id in saved_deployments:
-                            logger.info(f"Found deployment {deployment_id} in history file on attempt {attempt + 1}")
-                            deployment = saved_deployments[deployment_id]
-                            
-                            # Add it back to memory for future requests
-                            deployments[deployment_id] = deployment
-                            logger.debug(f"Added deployment {deployment_id} back to memory")
-                            
-                            return deployment
-                        else:
-                            logger.debug(f"Deployment {deployment_id} not found in history file (attempt {attempt + 1})")
-                            
+                    # Add it back to memory for future requests
+                    deployment = deployments.setdefault(deployment_id, deployment)
+                    logger.debug("Added deployment %s back to memory", deployment_id)
+                    
+                    return deployment
                 else:
-                    logger.warning(f"History file {DEPLOYMENT_HISTORY_FILE} does not exist (attempt {attempt + 1})")
+                    logger.debug("Deployment %s not found in deployment repository (attempt %s)", deployment_id, attempt + 1)
                     
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error on attempt {attempt + 1}: {str(e)}")
-                if attempt == max_retries - 1:  # Last attempt
-                    return None
-                # Continue to next attempt
-                
             except Exception as e:
-                logger.error(f"Error reading deployment history on attempt {attempt + 1}: {str(e)}")
+                logger.error("Error reading deployment repository on attempt %s: %s", attempt + 1, e)
                 if attempt == max_retries - 1:  # Last attempt
                     return None
                 # Continue to next attempt
@@ -3979,134 +3655,122 @@ def get_deployment_logs(deployment_id):
             if attempt < max_retries - 1:
                 time.sleep(0.2 * (attempt + 1))
         
-        logger.error(f"Could not find deployment {deployment_id} after {max_retries} attempts")
+        logger.error("Could not find deployment %s after %s attempts", deployment_id, max_retries)
         return None
     
     # Check if client expects server-sent events
     accept_header = request.headers.get('Accept', '')
     if 'text/event-stream' in accept_header:
         # Return SSE stream for real-time logs
-        def generate():
-            deployment = find_deployment_with_retry(deployment_id)
-            if deployment:
-                # First send all existing logs
-                for log in deployment.get("logs", []):
-                    yield f"data: {json.dumps({'message': log})}\n\n"
-
-                # Send current status
-                current_status = deployment.get('status', 'running')
-                yield f"data: {json.dumps({'status': current_status})}\n\n"
-
-                # Return if deployment is already completed
-                if current_status in ["success", "failed"]:
-                    logger.info(f"Deployment {deployment_id} is already completed with status: {current_status}")
-                    return
-                
-                # Otherwise, keep the connection open for new logs (only if still in memory)
-                last_log_count = len(deployment.get("logs", []))
-                timeout_count = 0
-                max_timeout = 300  # 5 minutes
-                
-                while deployment_id in deployments and timeout_count < max_timeout:
-                    current_deployment = deployments[deployment_id]
-                    current_logs = current_deployment.get("logs", [])
-                    current_count = len(current_logs)
-                    
-                    # Send new logs
-                    if current_count > last_log_count:
-                        for i in range(last_log_count, current_count):
-                            yield f"data: {json.dumps({'message': current_logs[i]})}\n\n"
-                        last_log_count = current_count
-                    
-                    # Check if deployment status has changed
-                    status = current_deployment.get("status", "running")
-                    if status in ["success", "failed"]:
-                        yield f"data: {json.dumps({'status': status})}\n\n"
-                        break
-                    
-                    time.sleep(1)
-                    timeout_count += 1
-                
-                if timeout_count >= max_timeout:
-                    logger.warning(f"SSE stream timeout for deployment {deployment_id}")
-                    yield f"data: {json.dumps({'error': 'Stream timeout'})}\n\n"
-                    
-            else:
-                yield f"data: {json.dumps({'error': 'Deployment not found'})}\n\n"
-
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        if async_log_server is not None:
+            return async_log_stream_redirect()
+        deployment = find_deployment_with_retry(deployment_id)
+        if deployment:
+            return log_stream_response(deployment_id, deployment)
+        return Response(f"data: {json.dumps({'error': 'Deployment not found'})}\n\n", mimetype='text/event-stream')
     else:
         # Return regular JSON response for non-streaming requests
         deployment = find_deployment_with_retry(deployment_id)
         if deployment:
             return jsonify({
                 "deploymentId": deployment_id,
-                "logs": deployment.get("logs", []),
+                **read_logs_response(deployment_id, deployment),
                 "status": deployment.get("status", "unknown"),
                 "timestamp": deployment.get("timestamp", 0),
                 "type": deployment.get("type", "unknown")
             })
         else:
-            logger.warning(f"Deployment {deployment_id} not found after all retry attempts")
+            logger.warning("Deployment %s not found after all retry attempts", deployment_id)
             return jsonify({"error": "Deployment not found"}), 404
 
 
 # API to get logs for a specific command
 @app.route('/api/command/<command_id>/logs')
 def get_command_logs(command_id):
-    logger.info(f"Getting logs for command: {command_id}")
+    logger.info("Getting logs for command: %s", command_id)
     
     # Check if client expects server-sent events
     accept_header = request.headers.get('Accept', '')
     if 'text/event-stream' in accept_header:
         # Return SSE stream for real-time logs
-        def generate():
-            if command_id in deployments:
-                command = deployments[command_id]
-                # First send all existing logs
-                for log in command.get("logs", []):
-                    yield f"data: {json.dumps({'message': log})}\n\n"
-
-                # Send current status
-                yield f"data: {json.dumps({'status': command.get('status', 'running')})}\n\n"
-
-                # Return if command is already completed
-                if command.get("status") in ["success", "failed"]:
-                    return
-                
-                # Otherwise, keep the connection open for new logs
-                last_log_count = len(command.get("logs", []))
-                while command_id in deployments:
-                    current_logs = deployments[command_id].get("logs", [])
-                    current_count = len(current_logs)
-                    
-                    # Send new logs
-                    if current_count > last_log_count:
-                        for i in range(last_log_count, current_count):
-                            yield f"data: {json.dumps({'message': current_logs[i]})}\n\n"
-                        last_log_count = current_count
-                    
-                    # Check if command status has changed
-                    status = deployments[command_id].get("status")
-                    if status in ["success", "failed"]:
-                        yield f"data: {json.dumps({'status': status})}\n\n"
-                        break
-                    
-                    time.sleep(1)
-            else:
-                yield f"data: {json.dumps({'error': 'Command not found'})}\n\n"
-
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        if async_log_server is not None:
+            return async_log_stream_redirect()
+        command = deployments.get(command_id)
+        if command is not None:
+            return log_stream_response(command_id, command)
+        return Response(f"data: {json.dumps({'error': 'Command not found'})}\n\n", mimetype='text/event-stream')
     else:
         # Return regular JSON response for non-streaming requests
         if command_id in deployments:
             return jsonify({
-                "logs": deployments[command_id].get("logs", []),
+                **read_logs_response(command_id, deployments[command_id]),
                 "status": deployments[command_id].get("status", "unknown")
             })
         else:
             return jsonify({"error": "Command not found"}), 404
 
+# Full-text search over the logs of every deployment and command
+@app.route('/api/logs/search')
+def search_logs():
+    """Ranked log lines matching ``q`` (FTS5 syntax: "phrase", AND/OR/NOT, prefix*).
+
+    Optional ``since``/``until`` (ISO or unix timestamps) bound the line
+    times, ``type`` (comma-separated) the deployment types, ``host``/
+    ``level``/``task`` the records. ``sort=recent`` returns newest first
+    instead of best matches; ``limit`` (default 50, at most 500) and
+    ``offset`` page through the hits.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing search query (q)"}), 400
+    since = request.args.get('since')
+    until = request.args.get('until')
+    since = normalize_timestamp(since) if since else None
+    until = normalize_timestamp(until) if until else None
+    kinds = [kind for kind in request.args.get('type', '').split(',') if kind]
+    limit = request.args.get('limit', 50, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    sort = 'recent' if request.args.get('sort') == 'recent' else 'rank'
+
+    started = time.perf_counter()
+    try:
+        hits = log_records.search(query, since=since, until=until, kinds=kinds, filters=log_record_filters(),
+                                  sort=sort, limit=limit, offset=offset)
+    except LogSearchError as e:
+        return jsonify({"error": f"Invalid search query: {str(e)}"}), 400
+    return jsonify({
+        "query": query,
+        "hits": [{
+            "deploymentId": hit["deployment_id"],
+            "type": hit["type"],
+            "line": hit["seq"],
+            "timestamp": hit["ts"],
+            "host": hit["host"],
+            "task": hit["task"],
+            "level": hit["level"],
+            "stream": hit["stream"],
+            "text": hit["text"],
+            "snippet": hit["snippet"],
+            "score": hit["score"],
+        } for hit in hits],
+        "offset": offset,
+        "sort": sort,
+        "tookMs": round((time.perf_counter() - started) * 1000, 1),
+    })
+
+# Job queue depth, running jobs and queue wait times, for monitoring
+@app.route('/api/jobs/stats')
+def get_job_stats():
+    return jsonify({**job_scheduler.stats(), "ansible": ansible_executor.stats(), "inventory": inventory_cache.stats()})
+
+# Open log streams and log memory, for monitoring
+@app.route('/api/logs/streams')
+def get_log_stream_stats():
+    return jsonify({
+        "streams": log_stream_hub.stats(),
+        "logBuffers": log_buffers.stats()
+    })
+
 # Add a rollback endpoint
 # @app.route('/api/deploy/<deployment_id>/rollback', methods=['POST'])
 # def rollback_deployment(deployment_id):
@@ -4294,7 +3958,7 @@ def get_command_logs(command_id):
 
 @app.route('/api/deploy/<deployment_id>/rollback', methods=['POST'])
 def rollback_deployment(deployment_id):
-    logger.info(f"Rolling back deployment with ID: {deployment_id}")
+    logger.info("Rolling back deployment with ID: %s", deployment_id)
 
     # Get current authenticated user
     current_user = get_current_user()
@@ -4302,13 +3966,13 @@ def rollback_deployment(deployment_id):
         return jsonify({"error": "Authentication required"}), 401 
     
     if deployment_id not in deployments:
-        logger.error(f"Deployment not found with ID: {deployment_id}")
+        logger.error("Deployment not found with ID: %s", deployment_id)
         return jsonify({"error": "Deployment not found"}), 404
     
     deployment = deployments[deployment_id]
     
     if deployment["type"] != "file":
-        logger.error(f"Cannot rollback non-file deployment type: {deployment['type']}")
+        logger.error("Cannot rollback non-file deployment type: %s", deployment['type'])
         return jsonify({"error": "Only file deployments can be rolled back"}), 400
     
     # Generate a new deployment ID for the rollback operation
@@ -4318,11 +3982,11 @@ def rollback_deployment(deployment_id):
     files = deployment.get("files", [deployment.get("file")] if deployment.get("file") else [])
     
     if not files:
-        logger.error(f"No files found in deployment {deployment_id} for rollback")
+        logger.error("No files found in deployment %s for rollback", deployment_id)
         return jsonify({"error": "No files to rollback"}), 400
     
     # Create a rollback deployment record
-    deployments[rollback_id] = {
+    deployment_registry.create(rollback_id, {
         "id": rollback_id,
         "type": "rollback",
         "original_deployment": deployment_id,
@@ -4338,15 +4002,17 @@ def rollback_deployment(deployment_id):
         "status": "running",
         "timestamp": time.time(),
         "logs": []
-    }
+    })
     
     # Save deployment history
-    save_deployment_history()
+    save_deployment_history(rollback_id)
     
-    # Start rollback in a separate thread
-    threading.Thread(target=process_rollback, args=(rollback_id,)).start()
+    # Queue the rollback on the job scheduler
+    rejected = submit_job('rollback', rollback_id, hosts=deployment.get("vms") or [])
+    if rejected:
+        return rejected
     
-    logger.info(f"Rollback initiated with ID: {rollback_id} for {len(files)} file(s)")
+    logger.info("Rollback initiated with ID: %s for %s file(s)", rollback_id, len(files))
     return jsonify({
         "deploymentId": rollback_id,
         "fileCount": len(files)
@@ -4355,6 +4021,7 @@ def rollback_deployment(deployment_id):
     
 def process_rollback(rollback_id):
     rollback = deployments[rollback_id]
+    vars_file = None
     try:
         original_id = rollback["original_deployment"]
         vms = rollback["vms"]
@@ -4368,8 +4035,8 @@ def process_rollback(rollback_id):
         
         if not files:
             log_message(rollback_id, f"ERROR: No files found for rollback")
-            deployments[rollback_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(rollback_id, "failed")
+            save_deployment_history(rollback_id)
             return
         
         log_message(rollback_id, f"Starting rollback for deployment {original_id} - {len(files)} file(s)")
@@ -4381,94 +4048,36 @@ def process_rollback(rollback_id):
         # Track overall rollback success
         overall_success = True
         failed_vms = []
+
+        # Inputs of the static rollback playbook, the same for every VM
+        vars_file = write_extra_vars('rollback', rollback_id, {
+            "files": [{"name": file_name, "path": os.path.join(target_path, file_name)} for file_name in files],
+            "target_user": user,
+            "use_sudo": bool(sudo),
+            "backup_suffix": f"_{timestamp}",
+        })
         
+        # One cached inventory holds all the VMs; each run is limited to one of them
+        inventory_file, _ = inventory_cache.inventory_file(vms, holder=rollback_id)
+
         # Process rollback for each VM
         for vm_name in vms:
-            vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
+            vm = inventory_cache.vm(vm_name)
             if not vm:
                 log_message(rollback_id, f"ERROR: VM {vm_name} not found in inventory")
                 failed_vms.append(vm_name)
                 overall_success = False
                 continue
             
-            # Generate rollback playbook for multiple files
-            playbook_file = f"/tmp/rollback_{rollback_id}_{vm_name}.yml"
-            with open(playbook_file, 'w') as f:
-                f.write(f"""---
-- name: Rollback multiple file deployment (backup and remove)
-  hosts: {vm_name}
-  gather_facts: false
-  become: {"true" if sudo else "false"}
-  become_user: {user}
-  tasks:
-    - name: Test connection
-      ping:
-""")
-                
-                # Add tasks for each file
-                for i, file_name in enumerate(files):
-                    target_file_path = os.path.join(target_path, file_name)
-                    f.write(f"""
-    - name: Check if {file_name} exists
-      ansible.builtin.stat:
-        path: "{target_file_path}"
-      register: target_file_stat_{i}
-    
-    - name: Create backup of {file_name}
-      ansible.builtin.copy:
-        src: "{target_file_path}"
-        dest: "{target_file_path}_{timestamp}"
-        remote_src: yes
-        backup: no
-      when: target_file_stat_{i}.stat.exists
-      register: backup_result_{i}
-    
-    - name: Log backup creation for {file_name}
-      ansible.builtin.debug:
-        msg: "Created backup: {target_file_path}_{timestamp}"
-      when: target_file_stat_{i}.stat.exists and backup_result_{i}.changed
-    
-    - name: Remove {file_name} (rollback)
-      ansible.builtin.file:
-        path: "{target_file_path}"
-        state: absent
-      when: target_file_stat_{i}.stat.exists
-      register: remove_result_{i}
-    
-    - name: Log file removal for {file_name}
-      ansible.builtin.debug:
-        msg: "Removed original file: {target_file_path}"
-      when: target_file_stat_{i}.stat.exists and remove_result_{i}.changed
-    
-    - name: File {file_name} not found
-      ansible.builtin.debug:
-        msg: "Target file {target_file_path} does not exist - nothing to rollback"
-      when: not target_file_stat_{i}.stat.exists
-""")
-            
-            # Generate inventory file
-            inventory_file = f"/tmp/rollback_inventory_{rollback_id}_{vm_name}"
-            with open(inventory_file, 'w') as f:
-                f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'")
-            
             # Run ansible playbook
-            cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+            cmd = playbook_command('rollback', inventory_file, vars_file, "--limit", vm_name, "-v")
             log_message(rollback_id, f"Running rollback on {vm_name}: backup and remove {len(files)} file(s)")
             
-            env_vars = os.environ.copy()
-            env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-            env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-            env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-            env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+            env_vars = ansible_environment()
             
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
-            
-            for line in process.stdout:
-                log_message(rollback_id, line.strip())
-            
-            process.wait()
+            return_code = run_ansible_playbook(rollback_id, cmd, env_vars)
             
-            if process.returncode == 0:
+            if return_code == 0:
                 log_message(rollback_id, f"Rollback completed successfully on {vm_name}")
                 log_message(rollback_id, f"Files backed up with timestamp: {timestamp}")
                 # Log each file that was backed up
@@ -4476,42 +4085,37 @@ def process_rollback(rollback_id):
                     target_file_path = os.path.join(target_path, file_name)
                     log_message(rollback_id, f"  - {file_name} backed up as: {target_file_path}_{timestamp}")
             else:
-                log_message(rollback_id, f"FAILED: Rollback failed on {vm_name} (exit code: {process.returncode})")
+                log_message(rollback_id, f"FAILED: Rollback failed on {vm_name} (exit code: {return_code})")
                 failed_vms.append(vm_name)
                 overall_success = False
-            
-            # Cleanup temporary files
-            try:
-                os.remove(playbook_file)
-                os.remove(inventory_file)
-            except Exception as cleanup_error:
-                log_message(rollback_id, f"Warning: Could not cleanup temp files: {str(cleanup_error)}")
-        
+
         # Update rollback status based on overall success
         if overall_success:
-            deployments[rollback_id]["status"] = "success"
-            deployments[rollback_id]["backup_timestamp"] = timestamp
+            deployment_registry.update_status(rollback_id, "success")
+            deployment_registry.update(rollback_id, backup_timestamp=timestamp)
             log_message(rollback_id, f"Rollback operation completed successfully on all VMs (initiated by {logged_in_user}). {len(files)} file(s) backed up with timestamp: {timestamp}")
         else:
-            deployments[rollback_id]["status"] = "failed"
+            deployment_registry.update_status(rollback_id, "failed")
             if failed_vms:
                 log_message(rollback_id, f"Rollback FAILED on VMs: {', '.join(failed_vms)} (initiated by {logged_in_user})")
             log_message(rollback_id, "Rollback operation completed with failures")
         
-        save_deployment_history()
+        save_deployment_history(rollback_id)
         
     except Exception as e:
         log_message(rollback_id, f"ERROR: Exception during rollback: {str(e)} (initiated by {logged_in_user})")
-        deployments[rollback_id]["status"] = "failed"
-        logger.exception(f"Exception in rollback {rollback_id}: {str(e)}")
-        save_deployment_history()
+        deployment_registry.update_status(rollback_id, "failed")
+        logger.exception("Exception in rollback %s: %s", rollback_id, e)
+        save_deployment_history(rollback_id)
+    finally:
+        remove_extra_vars(rollback_id, vars_file)
 
 
 # API to clear deployment history
 @app.route('/api/deployments/clear', methods=['POST'])
 def clear_deployment_history():
     days = request.json.get('days', 30)
-    logger.info(f"Clearing deployment logs older than {days} days")
+    logger.info("Clearing deployment logs older than %s days", days)
     
     if days < 0:
         return jsonify({"error": "Days must be a positive number"}), 400
@@ -4519,58 +4123,37 @@ def clear_deployment_history():
     # Calculate cutoff timestamp
     cutoff_time = time.time() - (days * 86400)  # 86400 seconds in a day
     
-    # Count deployments before deletion
-    initial_count = len(deployments)
-    
     # Filter deployments to keep only those newer than the cutoff
-    if days == 0:  # If days is 0, clear all logs
-        deployments.clear()
-    else:
-        to_delete = []
-        for deployment_id, deployment in deployments.items():
-            try:
-                # Get timestamp and convert to float if it's a string
-                timestamp = deployment.get('timestamp', 0)
-                if isinstance(timestamp, str):
-                    # Try to convert string timestamp to float
-                    try:
-                        timestamp = float(timestamp)
-                    except ValueError:
-                        # If conversion fails, treat as very old (0)
-                        timestamp = 0
-                elif timestamp is None:
-                    timestamp = 0
-                
-                # Compare with cutoff time
-                if timestamp < cutoff_time:
-                    to_delete.append(deployment_id)
-                    
-            except Exception as e:
-                logger.warning(f"Error processing timestamp for deployment {deployment_id}: {e}")
-                # If there's any error, consider it for deletion (treat as old)
-                to_delete.append(deployment_id)
-        
-        # Delete the identified deployments
-        for deployment_id in to_delete:
-            try:
-                del deployments[deployment_id]
-            except KeyError:
-                logger.warning(f"Deployment {deployment_id} was already deleted")
-    
-    # Count how many were deleted
-    deleted_count = initial_count - len(deployments)
-    
-    # Save updated deployment history
     try:
-        save_deployment_history()
+        if days == 0:  # If days is 0, clear all logs
+            deleted_count = deployment_repository.count()
+            deployment_repository.clear()
+            deployment_registry.clear()
+            history_archive.drop_before(float('inf'))
+            deleted_count += deployment_repository.forget_archived()
+        else:
+            # Indexed range query instead of re-parsing every timestamp
+            to_delete = deployment_repository.ids_older_than(cutoff_time)
+            deployment_repository.delete_many(to_delete)
+            for deployment_id in to_delete:
+                deployment_registry.delete(deployment_id)
+            deleted_count = len(to_delete)
+            # Archived days are dropped as whole partitions
+            dropped = history_archive.drop_before(cutoff_time)
+            if dropped:
+                deleted_count += deployment_repository.forget_archived(before_day=partition_day(cutoff_time))
+                drop_archived_log_records(dropped)
     except Exception as e:
-        logger.error(f"Error saving deployment history: {e}")
+        logger.error("Error saving deployment history: %s", e)
         return jsonify({"error": "Failed to save deployment history"}), 500
     
+    # Fold the deletions into the snapshot so the purged logs are released from disk
+    history_flusher.request_compaction()
+    
     return jsonify({
         "message": f"Successfully cleared {deleted_count} deployment logs",
         "deleted_count": deleted_count,
-        "remaining_count": len(deployments)
+        "remaining_count": deployment_repository.count()
     })
 
 
@@ -4596,14 +4179,14 @@ def systemd_operation(operation):
         return jsonify({"error": "Missing required parameters"}), 400
     
     if operation not in ['start', 'stop', 'restart', 'status']:
-        logger.error(f"Invalid systemd operation: {operation}")
+        logger.error("Invalid systemd operation: %s", operation)
         return jsonify({"error": "Invalid operation. Must be one of: start, stop, restart, status"}), 400
     
     # Generate a unique deployment ID
     deployment_id = str(uuid.uuid4())
     
     # Store deployment information
-    deployments[deployment_id] = {
+    deployment_registry.create(deployment_id, {
         "id": deployment_id,
         "type": "systemd",
         "service": service,
@@ -4614,274 +4197,87 @@ def systemd_operation(operation):
         "status": "running",
         "timestamp": get_current_timestamp(),
         "logs": []
-    }
+    })
     
     # Save deployment history
-    save_deployment_history()
+    save_deployment_history(deployment_id)
     
-    # Start systemd operation in a separate thread
-    threading.Thread(target=process_systemd_operation, args=(deployment_id, operation, service, vms)).start()
+    # Queue the systemd operation on the job scheduler
+    rejected = submit_job('systemd', deployment_id, operation, service, vms, hosts=vms)
+    if rejected:
+        return rejected
     
-    logger.info(f"Systemd {operation} initiated with ID: {deployment_id} initiated by {current_user['username']}")
+    logger.info("Systemd %s initiated with ID: %s initiated by %s", operation, deployment_id, current_user['username'])
     return jsonify({"deploymentId": deployment_id, "initiatedBy": current_user['username']})
 
 
 def process_systemd_operation(deployment_id, operation, service, vms):
     deployment = deployments[deployment_id]
+    vars_file = None
     try:
         logged_in_user = deployment["logged_in_user"]  # User who initiated
         user = deployment.get("user", "infadm")
         log_message(deployment_id, f"Starting systemd {operation} for service '{service}' on {len(vms)} VMs (initiated by {logged_in_user})")
         
-        # Generate an ansible playbook for systemd operation
-        playbook_file = f"/tmp/systemd_{deployment_id}.yml"
-        
-        with open(playbook_file, 'w') as f:
-            f.write(f"""---
-- name: Systemd {operation} operation for {service} (initiated by {logged_in_user})
-  hosts: systemd_targets
-  gather_facts: true
-#   become: true
-  vars:
-    service_name: "{service}"
-    operation_type: "{operation}"
-  tasks:
-    - name: Test connection
-      ansible.builtin.ping:
-      
-    - name: Check if service unit file exists
-      ansible.builtin.stat:
-        path: "/etc/systemd/system/{{{{ service_name }}}}"
-      register: service_file_etc
-      
-    - name: Check if service unit file exists in lib
-      ansible.builtin.stat:
-        path: "/usr/lib/systemd/system/{{{{ service_name }}}}"
-      register: service_file_lib
-      
-    - name: Check if service unit file exists in local
-      ansible.builtin.stat:
-        path: "/usr/local/lib/systemd/system/{{{{ service_name }}}}"
-      register: service_file_local
-      
-    - name: Set service exists fact
-      ansible.builtin.set_fact:
-        service_exists: "{{{{ service_file_etc.stat.exists or service_file_lib.stat.exists or service_file_local.stat.exists }}}}"
-        
-    - name: Report if service doesn't exist
-      ansible.builtin.debug:
-        msg: "ERROR: Service '{{{{ service_name }}}}' unit file not found on {{{{ inventory_hostname }}}}"
-      when: not service_exists
-      
-    - name: Get detailed service status
-      ansible.builtin.systemd:
-        name: "{{{{ service_name }}}}"
-      register: service_status
-      when: service_exists
-      failed_when: false
-      
-    - name: Get service status with systemctl
-      ansible.builtin.shell: |
-        systemctl status {{{{ service_name }}}} --no-pager -l || true
-        echo "---SEPARATOR---"
-        systemctl show {{{{ service_name }}}} --property=ActiveState,SubState,LoadState,UnitFileState,ExecMainStartTimestamp,ExecMainPID,MainPID || true
-      register: service_details
-      when: service_exists
-      
-    - name: Parse service uptime
-      ansible.builtin.shell: |
-        if systemctl is-active {{{{ service_name }}}} >/dev/null 2>&1; then
-          start_time=$(systemctl show {{{{ service_name }}}} --property=ExecMainStartTimestamp --value)
-          if [ -n "$start_time" ] && [ "$start_time" != "n/a" ]; then
-            echo "Service started at: $start_time"
-            # Calculate uptime
-            start_epoch=$(date -d "$start_time" +%s 2>/dev/null || echo "0")
-            current_epoch=$(date +%s)
-            if [ "$start_epoch" -gt 0 ]; then
-              uptime_seconds=$((current_epoch - start_epoch))
-              uptime_days=$((uptime_seconds / 86400))
-              uptime_hours=$(((uptime_seconds % 86400) / 3600))
-              uptime_minutes=$(((uptime_seconds % 3600) / 60))
-              echo "Uptime: ${{uptime_days}}d ${{uptime_hours}}h ${{uptime_minutes}}m"
-            else
-              echo "Uptime: Unable to calculate"
-            fi
-          else
-            echo "Service start time: Not available"
-            echo "Uptime: Not available"
-          fi
-        else
-          echo "Service is not active"
-        fi
-      register: service_uptime
-      when: service_exists
-      
-    - name: Display comprehensive service status
-      ansible.builtin.debug:
-        msg: |
-          ===========================================
-          SERVICE STATUS REPORT for {{{{ inventory_hostname }}}}
-          ===========================================
-          Service Name: {{{{ service_name }}}}
-          Active State: {{{{ service_status.status.ActiveState | default('unknown') }}}}
-          Sub State: {{{{ service_status.status.SubState | default('unknown') }}}}
-          Load State: {{{{ service_status.status.LoadState | default('unknown') }}}}
-          Unit File State: {{{{ service_status.status.UnitFileState | default('unknown') }}}}
-          Main PID: {{{{ service_status.status.MainPID | default('N/A') }}}}
-          
-          {{{{ service_uptime.stdout | default('Uptime info not available') }}}}
-          
-          Status: {{{{ 'ACTIVE' if service_status.status.ActiveState == 'active' else 'INACTIVE/DEAD' }}}}
-          Enabled: {{{{ 'YES' if service_status.status.UnitFileState in ['enabled', 'enabled-runtime'] else 'NO' }}}}
-          ===========================================
-      when: service_exists and operation_type == 'status'
-      
-    # - name: Perform systemd START operation
-    #   ansible.builtin.systemd:
-    #     name: "{{{{ service_name }}}}"
-    #     state: started
-    #     enabled: yes
-    #   become: yes  
-    #   register: start_result
-    #   when: service_exists and operation_type == 'start'
-
-    - name: Perform systemd START operation
-      ansible.builtin.shell: |
-        sudo systemctl start {{{{ service_name }}}}
-      register: start_result
-      when: service_exists and operation_type == 'start'
-      
-    # - name: Perform systemd STOP operation
-    #   ansible.builtin.systemd:
-    #     name: "{{{{ service_name }}}}"
-    #     state: stopped
-    #   become: yes  
-    #   register: stop_result
-    #   when: service_exists and operation_type == 'stop'
-
-    - name: Perform systemd STOP operation
-      ansible.builtin.shell: |
-        sudo systemctl stop {{{{ service_name }}}}
-      register: stop_result
-      when: service_exists and operation_type == 'stop'
-      
-    # - name: Perform systemd RESTART operation
-    #   ansible.builtin.systemd:
-    #     name: "{{{{ service_name }}}}"
-    #     state: restarted
-    #     enabled: yes
-    #   become: yes
-    #   register: restart_result
-    #   when: service_exists and operation_type == 'restart'
-
-    - name: Perform systemd RESTART operation
-      ansible.builtin.shell: |
-        sudo systemctl restart {{{{ service_name }}}}
-      register: restart_result
-      when: service_exists and operation_type == 'restart'
-      
-    - name: Verify operation result
-      ansible.builtin.systemd:
-        name: "{{{{ service_name }}}}"
-      register: post_operation_status
-      when: service_exists and operation_type in ['start', 'stop', 'restart']
-      failed_when: false
-      
-    - name: Report operation success
-      ansible.builtin.debug:
-        msg: |
-          ===========================================
-          OPERATION RESULT for {{{{ inventory_hostname }}}}
-          ===========================================
-          Service: {{{{ service_name }}}}
-          Operation: {{{{ operation_type | upper }}}}
-          Result: SUCCESS
-          New Status: {{{{ post_operation_status.status.ActiveState | default('unknown') }}}} ({{{{ post_operation_status.status.SubState | default('unknown') }}}})
-          Enabled: {{{{ 'YES' if post_operation_status.status.UnitFileState in ['enabled', 'enabled-runtime'] else 'NO' }}}}
-          ===========================================
-      when: service_exists and operation_type in ['start', 'stop', 'restart']
-      
-    - name: Get final service status for logging
-      ansible.builtin.shell: systemctl is-active {{{{ service_name }}}} || echo "inactive"
-      register: final_status
-      when: service_exists
-      
-    - name: Log final status
-      ansible.builtin.debug:
-        msg: "Final service status on {{{{ inventory_hostname }}}}: {{{{ final_status.stdout | default('unknown') }}}}"
-      when: service_exists
-""")
-
-        # Generate inventory file for ansible
-        inventory_file = f"/tmp/inventory_{deployment_id}"
-        
-        with open(inventory_file, 'w') as f:
-            f.write("[systemd_targets]\n")
-            for vm_name in vms:
-                # Find VM IP from inventory
-                vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
-                if vm:
-                    f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
+        # Inputs of the static systemd playbook
+        vars_file = write_extra_vars('systemd', deployment_id, {
+            "service_name": service,
+            "operation_type": operation,
+            "initiated_by": logged_in_user,
+        })
+
+        # Cached ansible inventory of the target VMs
+        inventory_file, _ = inventory_cache.inventory_file(vms, holder=deployment_id)
         
         # Run ansible playbook
-        env_vars = os.environ.copy()
-        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
-        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
-        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+        env_vars = ansible_environment()
         
-        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+        cmd = playbook_command('systemd', inventory_file, vars_file, "-v")
         
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
-        logger.info(f"Executing Ansible command: {' '.join(cmd)}")
+        logger.info("Executing Ansible command: %s", ' '.join(cmd))
         
-        # Use subprocess.run with capture_output=True instead of Popen
-        result = subprocess.run(cmd, capture_output=True, text=True, env=env_vars, timeout=300)
-        
-        # Log the output line by line
-        if result.stdout:
-            log_message(deployment_id, "=== ANSIBLE OUTPUT ===")
-            for line in result.stdout.splitlines():
-                if line.strip():  # Only log non-empty lines
-                    log_message(deployment_id, line.strip())
-        
-        if result.stderr:
-            log_message(deployment_id, "=== ANSIBLE STDERR ===")
-            for line in result.stderr.splitlines():
-                if line.strip():  # Only log non-empty lines
-                    log_message(deployment_id, line.strip())
+        # Output lines go to the deployment log as they are written
+        return_code = run_ansible_playbook(deployment_id, cmd, env_vars, timeout=300)
         
         # Check result and update status
-        if result.returncode == 0:
+        if return_code == 0:
             log_message(deployment_id, f"SUCCESS: Systemd {operation} operation completed successfully (initiated by {logged_in_user})")
-            deployments[deployment_id]["status"] = "completed"
-            logger.info(f"Systemd operation {deployment_id} completed successfully (initiated by {logged_in_user})")
+            deployment_registry.update_status(deployment_id, "completed")
+            logger.info("Systemd operation %s completed successfully (initiated by %s)", deployment_id, logged_in_user)
         else:
-            log_message(deployment_id, f"ERROR: Systemd {operation} operation failed with return code {result.returncode} (initiated by {logged_in_user})")
-            deployments[deployment_id]["status"] = "failed"
-            logger.error(f"Systemd operation {deployment_id} failed with return code {result.returncode} (initiated by {logged_in_user})")
-        
-        # Clean up temporary files
-        try:
-            os.remove(playbook_file)
-            os.remove(inventory_file)
-        except Exception as e:
-            logger.warning(f"Error cleaning up temporary files: {str(e)}")
+            log_message(deployment_id, f"ERROR: Systemd {operation} operation failed with return code {return_code} (initiated by {logged_in_user})")
+            deployment_registry.update_status(deployment_id, "failed")
+            logger.error("Systemd operation %s failed with return code %s (initiated by %s)",
+                         deployment_id, return_code, logged_in_user)
         
         # Save deployment history after completion
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         
     except subprocess.TimeoutExpired:
         log_message(deployment_id, f"ERROR: Systemd {operation} operation timed out after 5 minutes")
-        deployments[deployment_id]["status"] = "failed"
-        logger.error(f"Systemd operation {deployment_id} timed out")
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.error("Systemd operation %s timed out", deployment_id)
+        save_deployment_history(deployment_id)
         
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during systemd operation: {str(e)}")
-        deployments[deployment_id]["status"] = "failed"
-        logger.exception(f"Exception in systemd operation {deployment_id}: {str(e)}")
-        save_deployment_history()
+        deployment_registry.update_status(deployment_id, "failed")
+        logger.exception("Exception in systemd operation %s: %s", deployment_id, e)
+        save_deployment_history(deployment_id)
+    finally:
+        remove_extra_vars(deployment_id, vars_file)
+
+# Handlers of the jobs the endpoints submit; registered before start() resumes jobs left by an earlier run
+job_scheduler.register('file', process_file_deployment)
+job_scheduler.register('command', process_shell_command)
+job_scheduler.register('rollback', process_rollback)
+job_scheduler.register('systemd', process_systemd_operation)
+job_scheduler.register('template', process_template_deployment)
+job_scheduler.register('sql', run_sql_deployment_job)
+# With the local backend every queued job belongs to this process; with the shared backend
+# only jobs whose lease expired (their process stopped renewing it) are taken over
+job_scheduler.start(recover_all=DEPLOYMENT_STATE_BACKEND == 'local')
 
 if __name__ == '__main__':
     from waitress import serve
@@ -4900,4 +4296,6 @@ if __name__ == '__main__':
     logger.info("Checking SSH key setup...")
     check_ssh_setup()
     
-    serve(app, host="0.0.0.0", port=5000)
+    # poll() rather than select(): with the async log server's connections in the same
+    # process, waitress sockets can get descriptors above select()'s limit of 1024
+    serve(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), asyncore_use_poll=True)
@@ -0,0 +1,378 @@
+import atexit
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.jobs')
+
+# 'subprocess': a new ansible-playbook process per run
+# 'worker': forks of a long-lived worker process that has Ansible loaded (see ansible_worker.py)
+ANSIBLE_EXECUTION_BACKEND = os.environ.get('ANSIBLE_EXECUTION_BACKEND', 'subprocess')
+# Interpreter Ansible is installed for; default: the one in ansible-playbook's shebang
+ANSIBLE_WORKER_PYTHON = os.environ.get('ANSIBLE_WORKER_PYTHON', '')
+# Seconds to wait for the worker to load Ansible, and before trying again after it failed to start
+ANSIBLE_WORKER_START_TIMEOUT = float(os.environ.get('ANSIBLE_WORKER_START_TIMEOUT', 60))
+ANSIBLE_WORKER_RETRY_INTERVAL = 300
+# Seconds a timed-out run gets to stop its task workers after SIGTERM before it is killed
+ANSIBLE_TIMEOUT_KILL_GRACE = 10
+
+# Start of the output lines the orchestrator_events callback plugin writes; the rest of the line is JSON
+EVENT_PREFIX = '\x1e'
+CALLBACK_PLUGIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'callback_plugins')
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ansible_worker.py')
+
+# Host result events and the counter each one adds to
+HOST_EVENTS = ('ok', 'failed', 'unreachable', 'skipped')
+
+
+def event_environment(env):
+    """``env`` with the orchestrator_events callback plugin enabled (next to any callbacks it already enables)"""
+    env = dict(env)
+    env['ANSIBLE_CALLBACK_PLUGINS'] = os.pathsep.join(
+        path for path in (CALLBACK_PLUGIN_DIR, env.get('ANSIBLE_CALLBACK_PLUGINS')) if path)
+    enabled = [name.strip() for name in env.get('ANSIBLE_CALLBACKS_ENABLED', '').split(',') if name.strip()]
+    if 'orchestrator_events' not in enabled:
+        enabled.append('orchestrator_events')
+    env['ANSIBLE_CALLBACKS_ENABLED'] = ','.join(enabled)
+    return env
+
+
+def ansible_settings(env):
+    """The ANSIBLE_* variables of an environment; Ansible reads them once, when it is imported"""
+    return {key: value for key, value in env.items() if key.startswith('ANSIBLE_')}
+
+
+def split_output_line(line):
+    """(text, event) of an ansible-playbook output line: log text, or a callback event (text None)"""
+    if line.startswith(EVENT_PREFIX):
+        try:
+            return None, json.loads(line[len(EVENT_PREFIX):])
+        except ValueError:
+            return line[len(EVENT_PREFIX):].strip(), None
+    return line.strip(), None
+
+
+def ansible_python():
+    """Interpreter of the installed ansible-playbook script (the orchestrator's own if it cannot be told)"""
+    if ANSIBLE_WORKER_PYTHON:
+        return ANSIBLE_WORKER_PYTHON
+    script = shutil.which('ansible-playbook')
+    if script:
+        try:
+            with open(script, 'rb') as f:
+                first_line = f.readline().decode('utf-8', 'replace').strip()
+        except OSError:
+            first_line = ''
+        if first_line.startswith('#!'):
+            interpreter = first_line[2:].split()
+            # "#!/usr/bin/env python3" names the interpreter in its second word
+            if interpreter and os.path.basename(interpreter[0]) == 'env' and len(interpreter) > 1:
+                interpreter = [shutil.which(interpreter[1]) or interpreter[1]]
+            if interpreter and 'python' in os.path.basename(interpreter[0]):
+                return interpreter[0]
+    return sys.executable
+
+
+class PlaybookProgress:
+    """Per-host and per-task state of the playbook runs of one deployment, folded from callback events.
+
+    ``snapshot()`` is what goes into the deployment record's ``ansible``
+    field: the current play and task, the number of tasks started, and per
+    host its ok/changed/failed/unreachable/skipped counts, last task and
+    status (plus the message of its last failure). Pass the record's
+    current ``ansible`` value as ``initial`` to keep counting across the
+    several playbooks of a deployment.
+    """
+
+    def __init__(self, initial=None):
+        initial = initial or {}
+        self.play = initial.get('play')
+        self.task = initial.get('task')
+        self.tasks_started = initial.get('tasks_started', 0)
+        self.hosts = {host: dict(state) for host, state in (initial.get('hosts') or {}).items()}
+
+    def apply(self, event):
+        """Fold one event in; returns whether the snapshot changed"""
+        kind = event.get('event')
+        if kind == 'play_start':
+            self.play = event.get('play')
+        elif kind == 'task_start':
+            self.task = event.get('task')
+            self.tasks_started += 1
+        elif kind in HOST_EVENTS and event.get('host'):
+            state = self.hosts.setdefault(event['host'], {'ok': 0, 'changed': 0, 'failed': 0,
+                                                          'unreachable': 0, 'skipped': 0})
+            if kind == 'failed' and event.get('ignore_errors'):
+                # Counted like ansible's recap does: an ignored failure is still ok
+                kind = 'ok'
+            state[kind] += 1
+            if kind == 'ok' and event.get('changed'):
+                state['changed'] += 1
+            state['task'] = event.get('task')
+            state['status'] = 'changed' if kind == 'ok' and event.get('changed') else kind
+            if kind in ('failed', 'unreachable'):
+                state['msg'] = (event.get('msg') or '')[:500]
+        else:
+            return False
+        return True
+
+    def snapshot(self):
+        return {
+            'play': self.play,
+            'task': self.task,
+            'tasks_started': self.tasks_started,
+            'hosts': {host: dict(state) for host, state in self.hosts.items()},
+        }
+
+
+def _dispatch(line, on_line, on_event):
+    text, event = split_output_line(line)
+    if event is None:
+        on_line(text)
+    elif on_event is not None:
+        on_event(event)
+
+
+class _Timer(threading.Timer):
+    """Timer that records whether it went off"""
+
+    fired = False
+
+    def run(self):
+        self.finished.wait(self.interval)
+        if not self.finished.is_set():
+            self.fired = True
+            try:
+                self.function()
+            except OSError:
+                pass
+        self.finished.set()
+
+
+def _terminate_group(pgid):
+    """Stop a timed-out run: SIGTERM, on which ansible-playbook stops its task workers (each in its own
+    session), then SIGKILL for whatever is left after ANSIBLE_TIMEOUT_KILL_GRACE"""
+    os.killpg(pgid, signal.SIGTERM)
+    deadline = time.time() + ANSIBLE_TIMEOUT_KILL_GRACE
+    while time.time() < deadline:
+        time.sleep(0.1)
+        try:
+            os.killpg(pgid, 0)
+        except ProcessLookupError:
+            return
+    os.killpg(pgid, signal.SIGKILL)
+
+
+def _start_timer(timeout, on_timeout):
+    if timeout is None:
+        return None
+    timer = _Timer(timeout, on_timeout)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class SubprocessExecutor:
+    """Runs every ansible-playbook command line as its own process, as the endpoints always did"""
+
+    name = 'subprocess'
+
+    def __init__(self):
+        self.runs = 0
+
+    def run(self, args, env, on_line, on_event=None, timeout=None):
+        """Run ``args``; calls ``on_line(text)`` per output line and ``on_event(event)`` per callback event.
+
+        Returns the exit code. After ``timeout`` seconds the run is killed
+        and ``subprocess.TimeoutExpired`` raised.
+        """
+        self.runs += 1
+        # Own process group, so a timed-out run can be killed with the processes of its tasks
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   env=event_environment(env), start_new_session=timeout is not None)
+        timer = _start_timer(timeout, lambda: _terminate_group(process.pid))
+        try:
+            for line in process.stdout:
+                _dispatch(line, on_line, on_event)
+            process.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if timer is not None and timer.fired:
+            raise subprocess.TimeoutExpired(args, timeout)
+        return process.returncode
+
+    def stats(self):
+        return {'backend': self.name, 'runs': self.runs}
+
+
+class WorkerExecutor:
+    """Runs ansible-playbook command lines in forks of one long-lived worker process.
+
+    Each ``ansible-playbook`` start pays 1-3 s for the interpreter, the
+    Ansible imports and plugin loading. The worker (``ansible_worker.py``,
+    started on first use under the interpreter Ansible is installed for)
+    pays that once. Each run is then a ``fork()`` of the warm process,
+    connected over a Unix socket that carries the output and callback
+    events back.
+
+    Ansible reads its ANSIBLE_* settings when it is imported, so the worker
+    is started with ``env`` and only runs command lines whose environment
+    has the same ANSIBLE_* settings. Other runs, and all runs while the
+    worker cannot be started, go to ``fallback`` (a new process per run).
+    """
+
+    name = 'worker'
+
+    def __init__(self, env, python=None, fallback=None):
+        self.env = dict(env)
+        self.python = python or ansible_python()
+        self.fallback = fallback or SubprocessExecutor()
+        self.socket_path = None
+        self.runs = 0
+        self.fallback_runs = 0
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._process = None
+        self._directory = None
+        self._failed_at = None
+        atexit.register(self.stop)
+
+    def _start(self):
+        if self._process is not None:
+            self.restarts += 1
+            self._cleanup()
+        self._directory = tempfile.mkdtemp(prefix='ansible-worker-')
+        os.chmod(self._directory, 0o700)
+        self.socket_path = os.path.join(self._directory, 'worker.sock')
+        process = subprocess.Popen([self.python, WORKER_SCRIPT, self.socket_path], stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+                                   env=event_environment(self.env))
+        ready = threading.Event()
+
+        def drain():
+            # Startup errors and warnings go to the application log; the pipe is read until the worker exits
+            for line in process.stdout:
+                if line.strip() == 'ready' and not ready.is_set():
+                    ready.set()
+                elif line.strip():
+                    logger.warning("ansible worker: %s", line.rstrip())
+
+        threading.Thread(target=drain, name='ansible-worker-output', daemon=True).start()
+        deadline = time.time() + ANSIBLE_WORKER_START_TIMEOUT
+        while not ready.wait(0.1):
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                self._process = process
+                self._cleanup()
+                raise RuntimeError(f"ansible worker ({self.python}) did not start; exit code {process.poll()}")
+        self._process = process
+        logger.info("Started ansible worker %s (%s)", process.pid, self.python)
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return True
+            if self._failed_at is not None and time.time() - self._failed_at < ANSIBLE_WORKER_RETRY_INTERVAL:
+                return False
+            try:
+                self._start()
+            except Exception as e:
+                self._failed_at = time.time()
+                logger.error("Failed to start the ansible worker, running playbooks as subprocesses: %s", e)
+                return False
+            self._failed_at = None
+            return True
+
+    def run(self, args, env, on_line, on_event=None, timeout=None):
+        """Same contract as ``SubprocessExecutor.run()``"""
+        if (args[:1] != ['ansible-playbook'] or ansible_settings(env) != ansible_settings(self.env)
+                or not self._ensure_worker()):
+            self.fallback_runs += 1
+            return self.fallback.run(args, env, on_line, on_event, timeout)
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+        except OSError as e:
+            conn.close()
+            logger.warning("ansible worker not reachable, running the playbook as a subprocess: %s", e)
+            self.fallback_runs += 1
+            return self.fallback.run(args, env, on_line, on_event, timeout)
+        self.runs += 1
+        rc = None
+        child = {}
+
+        def kill():
+            # The forked child runs on after the connection closes, so it is stopped directly
+            if 'pid' in child:
+                _terminate_group(child['pid'])
+            else:
+                conn.shutdown(socket.SHUT_RDWR)
+
+        timer = _start_timer(timeout, kill)
+        try:
+            with conn, conn.makefile('r', encoding='utf-8', errors='replace') as output:
+                conn.sendall((json.dumps({'args': list(args)}) + '\n').encode('utf-8'))
+                for line in output:
+                    text, event = split_output_line(line)
+                    if event is not None and event.get('event') == 'start':
+                        child['pid'] = event.get('pid')
+                    elif event is not None and event.get('event') == 'exit':
+                        rc = event.get('rc')
+                    elif event is None:
+                        on_line(text)
+                    elif on_event is not None:
+                        on_event(event)
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if timer is not None and timer.fired:
+            raise subprocess.TimeoutExpired(args, timeout)
+        if rc is None:
+            on_line("ERROR: ansible worker ended the playbook run without an exit code")
+            return -1
+        return rc
+
+    def _cleanup(self):
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+                try:
+                    self._process.wait(5)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+            self._cleanup()
+
+    def stats(self):
+        running = self._process is not None and self._process.poll() is None
+        return {
+            'backend': self.name,
+            'python': self.python,
+            'worker_pid': self._process.pid if running else None,
+            'runs': self.runs,
+            'fallback_runs': self.fallback_runs,
+            'restarts': self.restarts,
+        }
+
+
+def create_executor(backend=ANSIBLE_EXECUTION_BACKEND, env=None):
+    """The executor for ANSIBLE_EXECUTION_BACKEND; ``env`` is the environment the worker runs playbooks with"""
+    if backend == 'subprocess':
+        return SubprocessExecutor()
+    if backend == 'worker':
+        return WorkerExecutor(env if env is not None else os.environ)
+    raise ValueError(f"ANSIBLE_EXECUTION_BACKEND must be 'subprocess' or 'worker', not {backend!r}")
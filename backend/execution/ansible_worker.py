@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Long-lived ansible-playbook worker: imports Ansible once and forks a child per playbook run.
+
+Started by ``execution.ansible_executor.WorkerExecutor`` under the Python
+interpreter Ansible is installed for (which need not be the orchestrator's),
+so it only uses the standard library and Ansible. It listens on a Unix
+socket. Each connection sends one JSON request line,
+``{"args": ["ansible-playbook", "-i", ...]}``, and gets the run's output
+back on the same connection: the child's stdout and stderr are the socket,
+so output lines (and the callback plugin's event lines) arrive as they are
+written. They are preceded by ``<EVENT_PREFIX>{"event": "start", "pid": N}``
+(the process group to kill if the run times out) and followed by
+``<EVENT_PREFIX>{"event": "exit", "rc": N}``.
+
+A fork of the warm parent skips the interpreter start, the Ansible and
+Jinja imports and the plugin loader setup that ``ansible-playbook`` pays
+for every run. Each run still gets its own process, so Ansible's global
+state (CLI arguments, display, plugin caches) never leaks from one
+playbook into the next.
+
+    python ansible_worker.py <socket path>
+"""
+import json
+import os
+import socket
+import sys
+import traceback
+
+EVENT_PREFIX = '\x1e'
+# Seconds between reaping finished children while no request arrives
+_REAP_INTERVAL = 1.0
+
+
+def _warm_up():
+    """Import what every playbook run needs, so forked children start with it loaded"""
+    from ansible.cli.playbook import PlaybookCLI
+    from ansible.executor.playbook_executor import PlaybookExecutor  # noqa: F401
+    from ansible.inventory.manager import InventoryManager  # noqa: F401
+    from ansible.parsing.dataloader import DataLoader  # noqa: F401
+    from ansible.vars.manager import VariableManager  # noqa: F401
+    from ansible.plugins import loader
+    # The connection, action and callback plugins of a typical file deployment
+    for plugin_loader, name in ((loader.connection_loader, 'ssh'), (loader.connection_loader, 'local'),
+                                (loader.action_loader, 'copy'), (loader.action_loader, 'command'),
+                                (loader.callback_loader, 'default')):
+        try:
+            plugin_loader.get(name, class_only=True)
+        except Exception:
+            pass
+    return PlaybookCLI
+
+
+def _run_child(conn, playbook_cli):
+    """Body of the forked child: run one playbook with the connection as stdout/stderr; never returns"""
+    rc = 250
+    try:
+        # Own process group, so a timed-out run can be killed with the processes of its tasks
+        os.setsid()
+        request = json.loads(conn.makefile('r', encoding='utf-8').readline() or '{}')
+        args = request.get('args') or []
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(conn.fileno(), 1)
+        os.dup2(conn.fileno(), 2)
+        os.write(1, (EVENT_PREFIX + json.dumps({'event': 'start', 'pid': os.getpid()}) + '\n').encode('utf-8'))
+        try:
+            playbook_cli.cli_executor(args)
+            rc = 0
+        except SystemExit as e:
+            rc = e.code if isinstance(e.code, int) else 1
+    except Exception:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.write(1, (EVENT_PREFIX + json.dumps({'event': 'exit', 'rc': rc}) + '\n').encode('utf-8'))
+        finally:
+            os._exit(0)
+
+
+def _reap():
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def serve(socket_path):
+    playbook_cli = _warm_up()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    server.listen(64)
+    server.settimeout(_REAP_INTERVAL)
+    # Tells the executor the worker is ready; nothing else is written to the original stdout
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    while True:
+        _reap()
+        try:
+            conn, _ = server.accept()
+        except socket.timeout:
+            continue
+        conn.settimeout(None)
+        if os.fork() == 0:
+            server.close()
+            _run_child(conn, playbook_cli)
+        conn.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit(__doc__.strip().splitlines()[-1].strip())
+    serve(sys.argv[1])
@@ -0,0 +1,76 @@
+# Loaded by ansible-playbook (not by the orchestrator): ANSIBLE_CALLBACK_PLUGINS points at this directory and
+# ANSIBLE_CALLBACKS_ENABLED names it, for playbooks run by either execution backend.
+import json
+import sys
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = '''
+    name: orchestrator_events
+    type: aggregate
+    short_description: Structured per-host and per-task events for the deployment orchestrator
+    description:
+      - Writes one line per play, task, host result and recap to stdout, prefixed with an ASCII record separator
+        and holding a JSON object, next to the regular output of the stdout callback.
+    requirements:
+      - enabled in ANSIBLE_CALLBACKS_ENABLED
+'''
+
+# Must match execution.ansible_executor.EVENT_PREFIX
+EVENT_PREFIX = '\x1e'
+
+
+def _result_parts(result):
+    # ansible-core 2.19 passes CallbackTaskResult (host/task/result); older versions TaskResult (_host/_task/_result)
+    host = getattr(result, 'host', None) or result._host
+    task = getattr(result, 'task', None) or result._task
+    data = getattr(result, 'result', None)
+    if not isinstance(data, dict):
+        data = result._result
+    return host.get_name(), task.get_name(), data
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'orchestrator_events'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def _emit(self, event, **fields):
+        fields['event'] = event
+        sys.stdout.write(EVENT_PREFIX + json.dumps(fields, default=str) + '\n')
+        sys.stdout.flush()
+
+    def _host_result(self, event, result, **fields):
+        host, task, data = _result_parts(result)
+        message = data.get('msg') or data.get('stderr') or ''
+        self._emit(event, host=host, task=task, changed=bool(data.get('changed')),
+                   msg=message if isinstance(message, str) else json.dumps(message, default=str), **fields)
+
+    def v2_playbook_on_play_start(self, play):
+        self._emit('play_start', play=play.get_name())
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._emit('task_start', task=task.get_name())
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self._emit('task_start', task=task.get_name(), handler=True)
+
+    def v2_runner_on_ok(self, result):
+        self._host_result('ok', result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._host_result('failed', result, ignore_errors=ignore_errors)
+
+    def v2_runner_on_unreachable(self, result):
+        self._host_result('unreachable', result)
+
+    def v2_runner_on_skipped(self, result):
+        self._host_result('skipped', result)
+
+    def v2_playbook_on_stats(self, stats):
+        hosts = {}
+        for host in sorted(stats.processed.keys()):
+            summary = stats.summarize(host)
+            hosts[host] = {key: summary.get(key, 0) for key in ('ok', 'changed', 'failures', 'unreachable', 'skipped')}
+        self._emit('stats', hosts=hosts)
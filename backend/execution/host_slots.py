@@ -0,0 +1,51 @@
+import os
+import threading
+
+# Jobs allowed at once on a VM whose type has no entry in inventory.json's host_job_slots
+HOST_JOB_SLOTS = int(os.environ.get('HOST_JOB_SLOTS', 1))
+
+
+class HostSlots:
+    """Counting semaphores per host, taken all at once for the hosts a job targets.
+
+    ``try_acquire()`` takes one slot on every host of a job or none at all,
+    so two jobs waiting for overlapping hosts can never hold half of each
+    other's slots. It never blocks: the job scheduler only calls it when
+    picking the next job, and leaves jobs whose hosts are busy in the queue.
+    ``limit_for(host)`` gives the number of slots of a host (looked up on
+    every acquire, so inventory changes apply to the next job); without it
+    every host gets ``default``.
+    """
+
+    def __init__(self, limit_for=None, default=HOST_JOB_SLOTS):
+        self.limit_for = limit_for
+        self.default = default
+        self._lock = threading.Lock()
+        self._in_use = {}
+
+    def limit(self, host):
+        limit = self.limit_for(host) if self.limit_for is not None else None
+        return max(int(limit if limit is not None else self.default), 1)
+
+    def try_acquire(self, hosts):
+        """Take a slot on each of ``hosts`` if all have one free; returns whether they were taken"""
+        with self._lock:
+            if any(self._in_use.get(host, 0) >= self.limit(host) for host in hosts):
+                return False
+            for host in hosts:
+                self._in_use[host] = self._in_use.get(host, 0) + 1
+            return True
+
+    def release(self, hosts):
+        with self._lock:
+            for host in hosts:
+                remaining = self._in_use.get(host, 0) - 1
+                if remaining > 0:
+                    self._in_use[host] = remaining
+                else:
+                    self._in_use.pop(host, None)
+
+    def stats(self):
+        """Slots in use and the limit of every host that has a job running"""
+        with self._lock:
+            return {host: {'in_use': count, 'limit': self.limit(host)} for host, count in self._in_use.items()}
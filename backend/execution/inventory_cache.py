@@ -0,0 +1,208 @@
+import atexit
+import collections
+import hashlib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.inventory')
+
+# Directory of the rendered ansible inventories; each process renders into its own subdirectory
+INVENTORY_CACHE_DIR = os.environ.get('INVENTORY_CACHE_DIR', '/tmp/ansible-inventory-cache')
+# Rendered inventories kept; the least recently used ones no run holds are deleted beyond this
+INVENTORY_CACHE_MAX_FILES = int(os.environ.get('INVENTORY_CACHE_MAX_FILES', 256))
+# Seconds between checks of inventory.json's modification time
+INVENTORY_CHECK_INTERVAL = 1.0
+
+EMPTY_INVENTORY = {"vms": [], "users": [], "systemd_services": []}
+
+
+def inventory_key(hosts, mtime_ns):
+    """Cache key of the inventory for a set of hosts, rendered from inventory.json as of ``mtime_ns``"""
+    material = '\n'.join(sorted(set(hosts))) + f'\n{mtime_ns}'
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()[:20]
+
+
+class InventoryCache:
+    """inventory.json, its VMs indexed by name, and rendered ansible inventories per set of target hosts.
+
+    The file is loaded again when its modification time changes (checked at
+    most every INVENTORY_CHECK_INTERVAL seconds). ``vm(name)`` is a dict
+    lookup instead of a scan of the VM list. ``inventory_file(hosts)``
+    returns the path of an INI inventory holding those hosts, named by a hash
+    of the sorted host names and the modification time of inventory.json. The
+    first request for a host set renders the file (written to a temporary
+    name and renamed, so concurrent readers never see half of it). Later
+    requests for the same hosts, from any deployment, reuse it, until
+    inventory.json changes and the key with it. Ansible therefore sees the
+    same inventory path and content on every run against the same hosts.
+    ``connection_vars`` are written once, under ``[all:vars]``, rather than
+    repeated on every host line.
+
+    Beyond ``max_files`` files the least recently used are deleted, except
+    those an ``ansible-playbook`` may still be reading: a caller passes a
+    ``holder`` (its deployment ID) and the file is kept until
+    ``release(holder)``. The files live in a subdirectory of ``cache_dir``
+    named after this process, so processes sharing the directory never
+    delete each other's files. The subdirectory is removed at exit, and
+    those of processes on this host that are gone are removed at startup.
+    """
+
+    def __init__(self, inventory_file, connection_vars=None, cache_dir=INVENTORY_CACHE_DIR,
+                 max_files=INVENTORY_CACHE_MAX_FILES):
+        self.inventory_file_path = inventory_file
+        self.connection_vars = dict(connection_vars or {})
+        self.base_dir = cache_dir
+        self.cache_dir = os.path.join(cache_dir, f'{socket.gethostname()}-{os.getpid()}')
+        self.max_files = max(int(max_files), 1)
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._data = dict(EMPTY_INVENTORY)
+        self._vms = {}
+        self._mtime_ns = None
+        self._checked_at = 0.0
+        self._files = collections.OrderedDict()
+        # Paths held by each holder, and how many holders hold each path
+        self._held = {}
+        self._in_use = collections.Counter()
+        self._refresh(force=True)
+        self._remove_stale_dirs()
+        atexit.register(shutil.rmtree, self.cache_dir, True)
+
+    def _remove_stale_dirs(self):
+        """Remove the subdirectories of processes on this host that no longer run"""
+        prefix = f'{socket.gethostname()}-'
+        try:
+            names = os.listdir(self.base_dir)
+        except OSError:
+            return
+        for name in names:
+            pid = name[len(prefix):]
+            if not name.startswith(prefix) or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                shutil.rmtree(os.path.join(self.base_dir, name), ignore_errors=True)
+                logger.info("Removed the inventory cache of stopped process %s", pid)
+            except OSError:
+                pass
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < INVENTORY_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime_ns = os.stat(self.inventory_file_path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self._mtime_ns and not force:
+            return
+        try:
+            with open(self.inventory_file_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            if self._mtime_ns is None:
+                logger.error("Error loading inventory: %s - Please create/fix inventory.json manually", e)
+            else:
+                logger.error("Error reloading inventory, keeping the previous one: %s", e)
+            self._mtime_ns = mtime_ns
+            return
+        self._data = data
+        self._vms = {vm.get('name'): vm for vm in data.get('vms', [])}
+        if self._mtime_ns is not None:
+            self.reloads += 1
+        self._mtime_ns = mtime_ns
+        logger.info("Loaded inventory with %s VMs", len(self._vms))
+
+    def data(self):
+        """The current contents of inventory.json"""
+        with self._lock:
+            self._refresh()
+            return self._data
+
+    def vm(self, name):
+        """The inventory entry of VM ``name``, or None"""
+        with self._lock:
+            self._refresh()
+            return self._vms.get(name)
+
+    def _render(self, hosts):
+        lines = [f"# Rendered from {self.inventory_file_path} for: {', '.join(hosts)}", "[targets]"]
+        lines += [f"{name} ansible_host={self._vms[name]['ip']}" for name in hosts]
+        if self.connection_vars:
+            lines += ["", "[all:vars]"]
+            lines += [f"{key}={value}" for key, value in self.connection_vars.items()]
+        return '\n'.join(lines) + '\n'
+
+    def inventory_file(self, hosts, holder=None):
+        """(path, missing): the inventory for the VMs named in ``hosts`` that inventory.json knows, and the others.
+
+        With ``holder`` the file is not deleted before ``release(holder)``.
+        """
+        with self._lock:
+            self._refresh()
+            known = sorted({name for name in hosts if name in self._vms})
+            missing = [name for name in hosts if name not in self._vms]
+            key = inventory_key(known, self._mtime_ns)
+            path = self._files.get(key)
+            if path is not None and os.path.exists(path):
+                self._files.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                os.makedirs(self.cache_dir, exist_ok=True)
+                path = os.path.join(self.cache_dir, f'inventory_{key}.ini')
+                tmp_file = f'{path}.tmp'
+                with open(tmp_file, 'w') as f:
+                    f.write(self._render(known))
+                os.replace(tmp_file, path)
+                self._files[key] = path
+            if holder is not None and path not in self._held.setdefault(holder, set()):
+                self._held[holder].add(path)
+                self._in_use[path] += 1
+            self._evict()
+            return path, missing
+
+    def release(self, holder):
+        """Let the files ``holder`` got from ``inventory_file()`` be deleted again"""
+        with self._lock:
+            for path in self._held.pop(holder, ()):
+                self._in_use[path] -= 1
+                if self._in_use[path] <= 0:
+                    del self._in_use[path]
+            self._evict()
+
+    def _evict(self):
+        """Delete the least recently used files beyond ``max_files`` that no holder holds"""
+        excess = len(self._files) - self.max_files
+        for key, path in list(self._files.items()):
+            if excess <= 0:
+                break
+            if path in self._in_use:
+                continue
+            del self._files[key]
+            excess -= 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'vms': len(self._vms),
+                'files': len(self._files),
+                'files_in_use': len(self._in_use),
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+            }
@@ -0,0 +1,333 @@
+import collections
+import os
+import socket
+import threading
+import time
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.jobs')
+
+# Worker threads running deployments, commands, rollbacks, systemd operations and templates
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+# Jobs allowed to wait for a worker; 0 for no limit
+JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', 200))
+# Name under which this process holds its jobs (shown in jobs.db; recovery goes by lease, not by owner)
+JOB_QUEUE_OWNER = os.environ.get('JOB_QUEUE_OWNER') or f'{socket.gethostname()}:{os.getpid()}'
+# Seconds a process holds its jobs without renewing them; after that any process may take them over
+JOB_LEASE_SECONDS = max(float(os.environ.get('JOB_LEASE_SECONDS', 60)), 1.0)
+# Seconds between looks at host slots held by other processes, while jobs wait for them
+SHARED_SLOT_POLL_SECONDS = float(os.environ.get('SHARED_SLOT_POLL_SECONDS', 1))
+# Queue waits kept for the wait-time percentiles
+JOB_WAIT_SAMPLES = 1000
+
+# Job states shown in the deployment record's job_state
+JOB_STATES = ('queued', 'running', 'finished')
+
+
+class JobQueueFullError(Exception):
+    """Raised by ``JobScheduler.submit()`` when JOB_QUEUE_LIMIT jobs are already waiting"""
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class JobScheduler:
+    """Fixed pool of worker threads taking jobs from one FIFO queue.
+
+    Endpoints used to start a thread per request, so a burst of deployments
+    ran all at once with no limit. Now they ``submit()`` a job and return;
+    ``workers`` threads run the jobs in submission order and the rest wait
+    in the queue (up to ``limit``). Every job is also written to
+    ``queue`` (a ``JobQueue``) under a lease of ``lease_seconds``, which a
+    heartbeat thread renews while the job is queued or running here. A
+    job whose lease has expired belongs to a process that is gone:
+    ``start()`` and then the heartbeat take such jobs over (with
+    ``recover_all``, ``start()`` takes every job, as no other process
+    shares the queue). Queued ones run, ones that were cut short while
+    running are reported as finished with an error, since half-applied
+    deployments must not be replayed.
+
+    A job is a deployment ID plus JSON-serializable arguments for the
+    handler registered for its kind, called as
+    ``handler(deployment_id, *args)``, and the hosts it targets. With
+    ``host_slots`` (a ``HostSlots``) a job runs only once it holds a slot
+    on each of its hosts: workers take the first queued job whose hosts are
+    free, so jobs on disjoint hosts run side by side while a job on a busy
+    host waits in the queue without holding a worker. Once a job has been
+    passed over, later jobs on its hosts wait behind it, which keeps each
+    host's jobs in submission order.
+
+    With ``shared_slots`` the slots are counted across every process
+    sharing ``queue``: a job only starts once ``JobQueue.start_if_free()``
+    finds its hosts below their limit in jobs.db, and while jobs wait for
+    slots held elsewhere the workers look again every
+    SHARED_SLOT_POLL_SECONDS. ``on_state(deployment_id, state, **fields)``
+    is called when a job is queued, starts running and finishes (with
+    ``error`` set if the handler raised), so the deployment record can
+    show where the job is.
+    """
+
+    def __init__(self, queue, workers=JOB_WORKERS, limit=JOB_QUEUE_LIMIT, owner=JOB_QUEUE_OWNER, on_state=None,
+                 host_slots=None, lease_seconds=JOB_LEASE_SECONDS, shared_slots=False):
+        self.queue = queue
+        self.host_slots = host_slots
+        self.shared_slots = shared_slots and host_slots is not None
+        self.workers = max(workers, 1)
+        self.limit = limit
+        self.owner = owner
+        self.on_state = on_state
+        self.lease_seconds = lease_seconds
+        self.handlers = {}
+        self._cond = threading.Condition()
+        self._ready = collections.deque()
+        self._running = {}
+        self._reserved = 0
+        self._waits = collections.deque(maxlen=JOB_WAIT_SAMPLES)
+        self._threads = []
+        self.recovered = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.blocked_on_hosts = 0
+        self.blocked_elsewhere = False
+
+    def register(self, kind, handler):
+        """Run jobs of ``kind`` with ``handler(deployment_id, *args)``"""
+        self.handlers[kind] = handler
+
+    def _notify(self, deployment_id, state, **fields):
+        if self.on_state is None:
+            return
+        try:
+            self.on_state(deployment_id, state, **fields)
+        except Exception as e:
+            logger.error("Failed to record job state %s of %s: %s", state, deployment_id, e)
+
+    def start(self, recover=True, recover_all=False):
+        """Start the workers and the lease heartbeat, after taking over expired jobs (all with ``recover_all``)"""
+        if self._threads:
+            return
+        if recover:
+            self._recover(expired_before=None if recover_all else time.time())
+        queued = len(self._ready)
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{n + 1}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, args=(recover,), name='job-lease-heartbeat', daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logger.info("Job scheduler started with %s workers (%s jobs queued)", self.workers, queued)
+
+    def _recover(self, expired_before):
+        """Take over the jobs whose lease ended before ``expired_before`` (all if None) and queue or fail them"""
+        requeued = interrupted = 0
+        with self._cond:
+            held = {job['deployment_id'] for job in self._ready}.union(self._running)
+        for job in self.queue.claim(self.owner, time.time() + self.lease_seconds, expired_before):
+            deployment_id = job['deployment_id']
+            if deployment_id in held:
+                # Our own job, whose renewal came late
+                continue
+            if job['state'] == 'running' or job['kind'] not in self.handlers:
+                reason = ('Interrupted by an orchestrator restart' if job['state'] == 'running'
+                          else f"No handler for job kind {job['kind']!r}")
+                self.queue.remove(deployment_id)
+                with self._cond:
+                    self.failed += 1
+                interrupted += 1
+                self._notify(deployment_id, 'finished', finished_at=time.time(), error=reason)
+                continue
+            with self._cond:
+                self._ready.append(job)
+                self._cond.notify()
+            requeued += 1
+        if requeued or interrupted:
+            self.recovered += requeued + interrupted
+            logger.info("Recovered job queue: %s queued jobs resumed, %s interrupted jobs failed",
+                        requeued, interrupted)
+
+    def _heartbeat(self, recover):
+        """Renew the leases of the jobs held here and take over the jobs of processes that stopped renewing"""
+        interval = self.lease_seconds / 4
+        while True:
+            time.sleep(interval)
+            try:
+                with self._cond:
+                    held = [job['deployment_id'] for job in self._ready]
+                    held.extend(self._running)
+                if held:
+                    self.queue.renew(held, time.time() + self.lease_seconds)
+                if recover:
+                    self._recover(expired_before=time.time())
+            except Exception as e:
+                logger.error("Failed to renew job leases: %s", e)
+
+    def submit(self, kind, deployment_id, *args, hosts=()):
+        """Queue a job targeting ``hosts``; returns its position in the queue (1 = next to run)"""
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind {kind!r}")
+        # The place is reserved under the lock, the jobs.db write and the state callback run outside it
+        with self._cond:
+            waiting = len(self._ready) + self._reserved
+            if self.limit and waiting >= self.limit:
+                self.rejected += 1
+                raise JobQueueFullError(f"Job queue is full ({waiting} jobs waiting); try again later")
+            self._reserved += 1
+        enqueued_at = time.time()
+        hosts = sorted(set(hosts))
+        try:
+            self.queue.push(deployment_id, kind, args, owner=self.owner, enqueued_at=enqueued_at, hosts=hosts,
+                            lease_until=enqueued_at + self.lease_seconds)
+        except Exception:
+            with self._cond:
+                self._reserved -= 1
+            raise
+        # Recorded before a worker can see the job, so 'running' never gets overwritten by 'queued'
+        self._notify(deployment_id, 'queued', queued_at=enqueued_at)
+        with self._cond:
+            self._reserved -= 1
+            self._ready.append({'deployment_id': deployment_id, 'kind': kind, 'args': list(args),
+                                'hosts': hosts, 'enqueued_at': enqueued_at})
+            self.submitted += 1
+            position = len(self._ready)
+            self._cond.notify()
+        logger.debug("Queued %s job %s at position %d", kind, deployment_id, position)
+        return position
+
+    def _take_next(self):
+        """Remove and return the first queued job whose host slots could be taken, or None
+
+        Called with ``_cond`` held. In shared mode the lock is released while jobs.db is checked; the job stays
+        in place marked ``checking`` meanwhile, so other workers keep the per-host order and skip it.
+        """
+        blocked = set()
+        self.blocked_elsewhere = False
+        index = 0
+        while index < len(self._ready):
+            job = self._ready[index]
+            hosts = job.get('hosts') or ()
+            if job.get('checking'):
+                # Another worker is asking jobs.db for these hosts; look again once it is done
+                blocked.update(hosts)
+                self.blocked_elsewhere = True
+                index += 1
+                continue
+            if blocked.intersection(hosts) or (self.host_slots is not None and not self.host_slots.try_acquire(hosts)):
+                blocked.update(hosts)
+                index += 1
+                continue
+            if self.shared_slots and hosts:
+                job['checking'] = True
+                self._cond.release()
+                try:
+                    started = self._start_shared(job)
+                finally:
+                    self._cond.acquire()
+                    del job['checking']
+                # Jobs ahead may have been taken while the lock was released
+                index = next(n for n, queued in enumerate(self._ready) if queued is job)
+                if not started:
+                    self.host_slots.release(hosts)
+                    blocked.update(hosts)
+                    self.blocked_elsewhere = True
+                    index += 1
+                    continue
+            del self._ready[index]
+            self.blocked_on_hosts = index
+            return job
+        self.blocked_on_hosts = len(self._ready)
+        return None
+
+    def _start_shared(self, job):
+        """Mark a job running in the queue if no other process holds its hosts' slots"""
+        started_at = time.time()
+        try:
+            started = self.queue.start_if_free(job['deployment_id'], job['hosts'], self.host_slots.limit,
+                                               started_at, started_at + self.lease_seconds)
+        except Exception as e:
+            logger.error("Failed to check the host slots of job %s: %s", job['deployment_id'], e)
+            return False
+        if started:
+            job['started_at'] = started_at
+        return started
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._take_next()
+                while job is None:
+                    # Slots held by other processes are released without notifying this one
+                    self._cond.wait(SHARED_SLOT_POLL_SECONDS if self.blocked_elsewhere else None)
+                    job = self._take_next()
+                if not job.get('started_at'):
+                    job['started_at'] = time.time()
+                self._running[job['deployment_id']] = job
+                self._waits.append(job['started_at'] - job['enqueued_at'])
+            self._run(job)
+
+    def _run(self, job):
+        deployment_id = job['deployment_id']
+        wait = job['started_at'] - job['enqueued_at']
+        error = None
+        try:
+            if not (self.shared_slots and job.get('hosts')):
+                self.queue.mark_running(deployment_id, job['started_at'])
+            self._notify(deployment_id, 'running', started_at=job['started_at'], queue_wait=round(wait, 3))
+            self.handlers[job['kind']](deployment_id, *job['args'])
+        except Exception as e:
+            error = str(e)
+            logger.error("%s job %s failed: %s", job['kind'], deployment_id, error)
+        finally:
+            try:
+                self.queue.remove(deployment_id)
+            except Exception as e:
+                logger.error("Failed to remove finished job %s from the queue: %s", deployment_id, e)
+            with self._cond:
+                self._running.pop(deployment_id, None)
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                if self.host_slots is not None:
+                    self.host_slots.release(job.get('hosts') or ())
+                # Queued jobs on these hosts may be able to run now
+                self._cond.notify_all()
+            self._notify(deployment_id, 'finished', finished_at=time.time(), error=error)
+
+    def stats(self):
+        """Queue depth, running jobs and queue wait times, for monitoring"""
+        now = time.time()
+        with self._cond:
+            waits = sorted(self._waits)
+            queued = [{'deployment_id': job['deployment_id'], 'kind': job['kind'], 'hosts': job.get('hosts') or [],
+                       'waiting_seconds': round(now - job['enqueued_at'], 3)} for job in self._ready]
+            running = [{'deployment_id': job['deployment_id'], 'kind': job['kind'], 'hosts': job.get('hosts') or [],
+                        'running_seconds': round(now - job['started_at'], 3)} for job in self._running.values()]
+            counters = {'submitted': self.submitted, 'completed': self.completed,
+                        'failed': self.failed, 'rejected': self.rejected, 'recovered': self.recovered}
+            blocked_on_hosts = min(self.blocked_on_hosts, len(queued))
+        return {
+            'workers': self.workers,
+            'queue_limit': self.limit,
+            'owner': self.owner,
+            'queue_depth': len(queued),
+            'running_count': len(running),
+            'blocked_on_hosts': blocked_on_hosts,
+            'oldest_wait_seconds': queued[0]['waiting_seconds'] if queued else 0,
+            'wait_seconds': {
+                'samples': len(waits),
+                'avg': round(sum(waits) / len(waits), 3) if waits else 0,
+                'p50': round(_percentile(waits, 0.5), 3) if waits else 0,
+                'p95': round(_percentile(waits, 0.95), 3) if waits else 0,
+                'max': round(waits[-1], 3) if waits else 0,
+            },
+            'queued': queued,
+            'running': running,
+            'host_slots': self.host_slots.stats() if self.host_slots is not None else {},
+            'shared_host_slots': self.shared_slots,
+            **counters,
+        }
@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+
+# Static playbooks of the orchestrator's own operations, versioned with the code. They never change per run:
+# every input (files, paths, users, commands) comes from a JSON extra-vars file written for the run.
+PLAYBOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'playbooks')
+
+
+def playbook_path(name):
+    """Path of the library playbook ``name`` (``file_deploy``, ``systemd``, ...)"""
+    path = os.path.join(PLAYBOOK_DIR, f'{name}.yml')
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"No playbook named {name!r} in {PLAYBOOK_DIR}")
+    return path
+
+
+def write_extra_vars(name, run_id, variables):
+    """Write the inputs of one run of playbook ``name`` to a JSON file only the orchestrator can read.
+
+    Returns the path; the caller removes the file when the run is over.
+    """
+    fd, path = tempfile.mkstemp(prefix=f'{name}_{run_id}_', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(variables, f)
+    return path
+
+
+def playbook_command(name, inventory_file, vars_file, *options):
+    """ansible-playbook command line running library playbook ``name`` with the inputs in ``vars_file``"""
+    return ['ansible-playbook', '-i', inventory_file, playbook_path(name), '-e', f'@{vars_file}', *options]
@@ -0,0 +1,91 @@
+import atexit
+import copy
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Loggers of the app's subsystems, below the application logger; each can get its own level through LOG_LEVELS
+SUBSYSTEM_LOGGERS = {
+    'output': 'fix_deployment_orchestrator.output',        # ansible and command output lines of deployments
+    'storage': 'fix_deployment_orchestrator.storage',      # history, repository, log segments and records
+    'streaming': 'fix_deployment_orchestrator.streaming',  # SSE log streams
+    'jobs': 'fix_deployment_orchestrator.jobs',            # job scheduler and its worker pool
+    'inventory': 'fix_deployment_orchestrator.inventory',  # inventory.json and the rendered ansible inventories
+}
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that only merges the message on the logging thread.
+
+    The ``%`` arguments are merged into the message when the record is
+    queued, because they may be mutable (a deployment record, a list of VMs)
+    and must be logged as they were at the call. The traceback of
+    ``exc_info`` is rendered to ``exc_text`` at the same time, so no
+    traceback frames are kept alive on the queue. The handlers' formatting
+    (time stamps, the log line layout), the file writes and the rotation
+    happen on the listener thread. Records below a logger's level are
+    dropped before any of this.
+    """
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogListener(QueueListener):
+    """QueueListener that knows whether it is running, so stopping it twice is harmless"""
+
+    running = False
+
+    def start(self):
+        super().start()
+        self.running = True
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            super().stop()
+
+
+def parse_log_levels(spec):
+    """{logger name: level} from ``"output=INFO,storage=WARNING"``; names may be subsystems or full logger names"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, sep, level = item.partition('=')
+        name, level = name.strip(), level.strip().upper()
+        if not sep or not name:
+            continue
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level {level!r} for {name!r} in LOG_LEVELS")
+        levels[SUBSYSTEM_LOGGERS.get(name, name)] = level
+    return levels
+
+
+def start_log_pipeline(logger, handlers, levels=None):
+    """Route ``logger`` through a queue to ``handlers`` served by a listener thread; returns the listener.
+
+    Callers only build a LogRecord and put it on the queue; the handlers run
+    on the listener thread, which is stopped (draining the queue) at exit.
+    ``levels`` ({logger name: level}) is applied to the subsystem loggers.
+    """
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(DeferredQueueHandler(log_queue))
+    listener = LogListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_log_pipeline, listener)
+    for name, level in (levels or {}).items():
+        logging.getLogger(name).setLevel(level)
+    return listener
+
+
+def stop_log_pipeline(listener):
+    """Handle every queued record and stop the listener thread (a no-op if it is already stopped)"""
+    listener.stop()
@@ -4,7 +4,6 @@ import os
 import subprocess
 import time
 import uuid
-import threading
 import logging
 
 # Get logger
@@ -15,6 +14,9 @@ db_routes = Blueprint('db_routes', __name__)
 # Deploy directory for logs
 DEPLOYMENT_LOGS_DIR = os.environ.get('DEPLOYMENT_LOGS_DIR', '/app/logs')
 
+# Passwords of queued SQL deployments; kept in memory only, never in the persisted job queue
+_sql_passwords = {}
+
 @db_routes.route('/api/db/connections', methods=['GET'])
 def get_db_connections():
     try:
@@ -41,7 +43,7 @@ def get_db_connections():
             }
         ])
     except Exception as e:
-        logger.error(f"Error fetching DB connections: {str(e)}")
+        logger.error("Error fetching DB connections: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @db_routes.route('/api/db/users', methods=['GET'])
@@ -57,13 +59,13 @@ def get_db_users():
         # Fallback to default values if inventory file not found
         return jsonify(["xpidbo1refc", "xpidbo1cfg", "xpidbo1app"])
     except Exception as e:
-        logger.error(f"Error fetching DB users: {str(e)}")
+        logger.error("Error fetching DB users: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @db_routes.route('/api/deploy/sql', methods=['POST'])
 def deploy_sql():
     # Import here to avoid circular imports and ensure we get the shared instance
-    from app import deployments, save_deployment_history
+    from app import deployment_registry, save_deployment_history, submit_job
     
     data = request.json
     ft = data.get('ft')
@@ -74,7 +76,7 @@ def deploy_sql():
     user = data.get('user')
     password = data.get('password', '')
     
-    logger.info(f"SQL deployment request received: {file_name} from FT {ft} on {hostname}:{port}")
+    logger.info("SQL deployment request received: %s from FT %s on %s:%s", file_name, ft, hostname, port)
     
     if not all([ft, file_name, hostname, port, db_name, user]):
         logger.error("Missing required parameters for SQL deployment")
@@ -84,7 +86,7 @@ def deploy_sql():
     deployment_id = str(uuid.uuid4())
     
     # Store deployment information in the shared deployments dictionary
-    deployments[deployment_id] = {
+    deployment_registry.create(deployment_id, {
         "id": deployment_id,
         "type": "sql",
         "ft": ft,
@@ -96,25 +98,42 @@ def deploy_sql():
         "status": "running",
         "timestamp": time.time(),
         "logs": []
-    }
+    })
     
     # Save deployment history
-    save_deployment_history()
+    save_deployment_history(deployment_id)
     
-    # Start deployment in a separate thread
-    threading.Thread(target=process_sql_deployment, args=(deployment_id, password)).start()
+    # Queue the deployment on the job scheduler
+    _sql_passwords[deployment_id] = password
+    rejected = submit_job('sql', deployment_id)
+    if rejected:
+        _sql_passwords.pop(deployment_id, None)
+        return rejected
     
-    logger.info(f"SQL deployment initiated with ID: {deployment_id}")
+    logger.info("SQL deployment initiated with ID: %s", deployment_id)
     return jsonify({"deploymentId": deployment_id})
 
+def run_sql_deployment_job(deployment_id):
+    """Job handler of SQL deployments: runs the deployment with the password its request gave"""
+    from app import log_message, deployment_registry, save_deployment_history
+
+    password = _sql_passwords.pop(deployment_id, None)
+    if password is None:
+        # Taken over from a restarted or stopped process, which took the password with it
+        log_message(deployment_id, "ERROR: Database passwords are not kept across restarts; submit the deployment again")
+        deployment_registry.update_status(deployment_id, "failed")
+        save_deployment_history(deployment_id)
+        return
+    process_sql_deployment(deployment_id, password)
+
 def process_sql_deployment(deployment_id, password):
     # Import here to ensure we get the shared instances
-    from app import log_message, deployments, save_deployment_history
+    from app import log_message, deployments, deployment_registry, save_deployment_history
     
     try:
         # Check if deployment exists
         if deployment_id not in deployments:
-            logger.error(f"Deployment ID {deployment_id} not found in deployments dictionary")
+            logger.error("Deployment ID %s not found in deployments dictionary", deployment_id)
             return
         
         deployment = deployments[deployment_id]
@@ -127,7 +146,7 @@ def process_sql_deployment(deployment_id, password):
         user = deployment["user"]
         
         source_file = os.path.join('/app/fixfiles', 'AllFts', ft, file_name)
-        logger.info(f"Processing SQL deployment from {source_file}")
+        logger.info("Processing SQL deployment from %s", source_file)
         
         if not os.path.exists(source_file):
             error_msg = f"Source file not found: {source_file}"
@@ -136,8 +155,8 @@ def process_sql_deployment(deployment_id, password):
             
             # Update deployment status to failed
             if deployment_id in deployments:
-                deployments[deployment_id]["status"] = "failed"
-                save_deployment_history()
+                deployment_registry.update_status(deployment_id, "failed")
+                save_deployment_history(deployment_id)
             return
         
         log_message(deployment_id, f"Starting SQL deployment for {file_name} on {hostname}:{port}/{db_name}")
@@ -152,8 +171,8 @@ def process_sql_deployment(deployment_id, password):
             
             # Update deployment status to failed
             if deployment_id in deployments:
-                deployments[deployment_id]["status"] = "failed"
-                save_deployment_history()
+                deployment_registry.update_status(deployment_id, "failed")
+                save_deployment_history(deployment_id)
             return
         
         # Create command using psql
@@ -194,48 +213,49 @@ def process_sql_deployment(deployment_id, password):
                         if "ERROR:" in line_stripped.upper():
                             has_errors = True
                             log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
+                            logger.debug("[%s] %s", deployment_id, line_stripped)
                         elif "WARNING:" in line_stripped.upper():
                             has_warnings = True
                             log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
+                            logger.debug("[%s] %s", deployment_id, line_stripped)
                         else:
                             log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
+                            logger.debug("[%s] %s", deployment_id, line_stripped)
             
             # Determine final status based on errors found in output, not just return code
             if has_errors or result.returncode != 0:
                 log_message(deployment_id, "FAILED: SQL execution completed with errors")
                 if deployment_id in deployments:
-                    deployments[deployment_id]["status"] = "failed"
-                logger.error(f"SQL deployment {deployment_id} failed - errors detected in output or non-zero return code")
+                    deployment_registry.update_status(deployment_id, "failed")
+                logger.error("SQL deployment %s failed - errors detected in output or non-zero return code",
+                             deployment_id)
             elif has_warnings:
                 log_message(deployment_id, "WARNING: SQL execution completed with warnings")
                 if deployment_id in deployments:
-                    deployments[deployment_id]["status"] = "success"  # Still success but with warnings
-                logger.warning(f"SQL deployment {deployment_id} completed with warnings")
+                    deployment_registry.update_status(deployment_id, "success")  # Still success but with warnings
+                logger.warning("SQL deployment %s completed with warnings", deployment_id)
             else:
                 log_message(deployment_id, "SUCCESS: SQL execution completed successfully")
                 if deployment_id in deployments:
-                    deployments[deployment_id]["status"] = "success"
-                logger.info(f"SQL deployment {deployment_id} completed successfully")
+                    deployment_registry.update_status(deployment_id, "success")
+                logger.info("SQL deployment %s completed successfully", deployment_id)
             
         except subprocess.TimeoutExpired:
             error_msg = "SQL execution timed out after 5 minutes"
             log_message(deployment_id, f"ERROR: {error_msg}")
             if deployment_id in deployments:
-                deployments[deployment_id]["status"] = "failed"
-            logger.error(f"SQL deployment {deployment_id} timed out")
+                deployment_registry.update_status(deployment_id, "failed")
+            logger.error("SQL deployment %s timed out", deployment_id)
             
         except subprocess.SubprocessError as e:
             error_msg = f"Subprocess error during SQL execution: {str(e)}"
             log_message(deployment_id, f"ERROR: {error_msg}")
             if deployment_id in deployments:
-                deployments[deployment_id]["status"] = "failed"
+                deployment_registry.update_status(deployment_id, "failed")
             logger.error(error_msg)
         
         # Always save deployment history after processing
-        save_deployment_history()
+        save_deployment_history(deployment_id)
         
     except FileNotFoundError as e:
         # Handle case where psql command is not found
@@ -243,31 +263,32 @@ def process_sql_deployment(deployment_id, password):
         log_message(deployment_id, f"ERROR: {error_msg}")
         log_message(deployment_id, "SOLUTION: Install PostgreSQL client tools in the container")
         log_message(deployment_id, "Command: apt-get update && apt-get install -y postgresql-client")
-        logger.error(f"FileNotFoundError in SQL deployment {deployment_id}: {str(e)}")
+        logger.error("FileNotFoundError in SQL deployment %s: %s", deployment_id, e)
         
         if deployment_id in deployments:
-            deployments[deployment_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(deployment_id, "failed")
+            save_deployment_history(deployment_id)
         
     except KeyError as e:
         error_msg = f"KeyError in SQL deployment thread: missing key {str(e)}"
         log_message(deployment_id, f"ERROR: {error_msg}")
-        logger.error(f"KeyError in SQL deployment thread for {deployment_id}: {str(e)}")
-        logger.error(f"Available deployment keys: {list(deployment.keys()) if 'deployment' in locals() else 'deployment not available'}")
+        logger.error("KeyError in SQL deployment thread for %s: %s", deployment_id, e)
+        logger.error("Available deployment keys: %s",
+                     (list(deployment.keys()) if 'deployment' in locals() else 'deployment not available'))
         
         if deployment_id in deployments:
-            deployments[deployment_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(deployment_id, "failed")
+            save_deployment_history(deployment_id)
         
     except Exception as e:
         # Catch-all for any other exceptions
         error_msg = f"Unexpected error during SQL deployment: {str(e)}"
         log_message(deployment_id, f"ERROR: {error_msg}")
-        logger.exception(f"Exception in SQL deployment {deployment_id}: {str(e)}")
+        logger.exception("Exception in SQL deployment %s: %s", deployment_id, e)
         
         if deployment_id in deployments:
-            deployments[deployment_id]["status"] = "failed"
-            save_deployment_history()
+            deployment_registry.update_status(deployment_id, "failed")
+            save_deployment_history(deployment_id)
 
 # from flask import current_app, Blueprint, jsonify, request
 # import json
@@ -0,0 +1,268 @@
+import os
+import threading
+from collections import OrderedDict
+from itertools import islice
+
+# Statuses after which a deployment gets no more log lines; systemd operations end as 'completed'
+FINISHED_STATUSES = ('success', 'failed', 'completed')
+# Finished deployments whose record, snapshot and lock stay in memory; the least recently changed are evicted
+FINISHED_DEPLOYMENTS_IN_MEMORY = int(os.environ.get('FINISHED_DEPLOYMENTS_IN_MEMORY', 256))
+
+
+class DeploymentRegistry:
+    """Thread-safe access to the deployments dict.
+
+    Creating a deployment, changing its fields and appending log lines each
+    hold only that deployment's lock, so workers never wait for each other.
+    Every change publishes a fresh copy of the record (without its logs).
+    ``snapshot()`` returns the current copy without taking any lock. The
+    history flusher serializes these copies, so the records workers are
+    mutating are never iterated.
+
+    Log lines are not kept in the records: they go to ``log_buffers``
+    (bounded in-memory tails over the log segments) and the record only
+    carries ``log_count``.
+
+    Each lock is a condition variable that is notified on every change, so
+    log streams can ``wait_for_change()`` instead of polling.
+
+    ``records`` is the dict the rest of the app reads from (usually a
+    ``LazyDeploymentDict``). ``persister`` receives ``mark_dirty``, ``log``,
+    ``delete`` and ``clear`` calls (the ``HistoryFlusher``).
+
+    Once a deployment reaches a final status, or a finished one is loaded
+    into ``records`` (``loaded()``), it joins a list of at most
+    ``keep_finished`` finished deployments. Beyond that, the least recently
+    used one is evicted: its record leaves ``records`` and its snapshot,
+    version and lock are dropped, once the persister has written it out. A
+    later lookup loads it from the repository again.
+    """
+
+    def __init__(self, records, log_buffers, persister=None, keep_finished=FINISHED_DEPLOYMENTS_IN_MEMORY):
+        self.records = records
+        self.persister = persister
+        self.log_buffers = log_buffers
+        self.keep_finished = max(int(keep_finished), 1)
+        self._snapshots = {}
+        self._versions = {}
+        self._listeners = []
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        # Finished deployments, least recently changed first
+        self._finished = OrderedDict()
+        self._finished_lock = threading.Lock()
+
+    def lock(self, deployment_id):
+        """The lock guarding one deployment record (a Condition over an RLock)"""
+        lock = self._locks.get(deployment_id)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._locks.setdefault(deployment_id, threading.Condition(threading.RLock()))
+        return lock
+
+    def _changed(self, deployment_id, lock):
+        self._versions[deployment_id] = self._versions.get(deployment_id, 0) + 1
+        lock.notify_all()
+        for listener in self._listeners:
+            listener(deployment_id)
+
+    def add_listener(self, listener):
+        """Call ``listener(deployment_id)`` after every change, for waiters that cannot block on the lock.
+
+        Listeners run under the deployment's lock, so they must only hand the ID off.
+        """
+        self._listeners.append(listener)
+
+    def _publish(self, deployment_id, record):
+        # dict.copy() does not run Python code, so no other thread can change the record halfway through
+        snapshot = record.copy()
+        snapshot.pop('logs', None)
+        self._snapshots[deployment_id] = snapshot
+        self._changed(deployment_id, self.lock(deployment_id))
+        if self.persister is not None:
+            self.persister.mark_dirty(deployment_id)
+        if deployment_id in self._finished:
+            with self._finished_lock:
+                if deployment_id in self._finished:
+                    self._finished.move_to_end(deployment_id)
+
+    def _finish(self, deployment_id):
+        """Count a deployment among the finished ones, and evict the oldest beyond ``keep_finished``"""
+        with self._finished_lock:
+            self._finished[deployment_id] = True
+            self._finished.move_to_end(deployment_id)
+            excess = len(self._finished) - self.keep_finished
+            candidates = list(islice(self._finished, max(excess, 0)))
+        for evicted in candidates:
+            self._evict(evicted)
+
+    def loaded(self, deployment_id, record):
+        """Called by ``records`` when it loaded a record from the repository and keeps it"""
+        if record.get('status') in FINISHED_STATUSES:
+            self._finish(deployment_id)
+
+    def _evict(self, deployment_id):
+        lock = self.lock(deployment_id)
+        # Never waits: the caller may hold another deployment's lock. A busy deployment is evicted later.
+        if not lock.acquire(blocking=False):
+            return
+        try:
+            # Its latest snapshot must reach the repository first, or a reload would return an older version
+            if self.persister is not None and self.persister.is_pending(deployment_id):
+                return
+            with self._finished_lock:
+                self._finished.pop(deployment_id, None)
+            # dict.pop: LazyDeploymentDict.pop would load the record first
+            dict.pop(self.records, deployment_id, None)
+            self._snapshots.pop(deployment_id, None)
+            # Wakes any remaining waiter before its lock is dropped
+            self._changed(deployment_id, lock)
+            self._versions.pop(deployment_id, None)
+        finally:
+            lock.release()
+        with self._locks_lock:
+            self._locks.pop(deployment_id, None)
+
+    def is_local(self, deployment_id):
+        """Whether the record is held (and so changed) by this process"""
+        return dict.__contains__(self.records, deployment_id)
+
+    def adopt(self, deployment_id):
+        """Hold a record in this process from now on (its job was taken over from another one); returns it"""
+        with self.lock(deployment_id):
+            if self.is_local(deployment_id):
+                return dict.__getitem__(self.records, deployment_id)
+            record = self.records.get(deployment_id)
+            if record is not None:
+                dict.__setitem__(self.records, deployment_id, record)
+                self._snapshots.pop(deployment_id, None)
+            return record
+
+    def version(self, deployment_id):
+        """Counter bumped on every change of a deployment"""
+        return self._versions.get(deployment_id, 0)
+
+    def wait_for_change(self, deployment_id, seen_version, timeout):
+        """Block until the deployment changed after ``seen_version`` or ``timeout`` passed; returns the current version"""
+        changed = self.lock(deployment_id)
+        with changed:
+            changed.wait_for(lambda: self._versions.get(deployment_id, 0) != seen_version, timeout)
+            return self._versions.get(deployment_id, 0)
+
+    def create(self, deployment_id, record):
+        """Register a new deployment record"""
+        with self.lock(deployment_id):
+            logs = record.pop('logs', None) or []
+            first_line = record.get('log_count', 0)
+            record['log_count'] = first_line + len(logs)
+            self.records[deployment_id] = record
+            for offset, message in enumerate(logs):
+                self.log_buffers.append(deployment_id, message, first_line + offset)
+            self._publish(deployment_id, record)
+            if self.persister is not None:
+                for offset, message in enumerate(logs):
+                    self.persister.log(deployment_id, message, first_line + offset)
+        return record
+
+    def update(self, deployment_id, **fields):
+        """Set fields of a deployment; returns the record, or None if it does not exist"""
+        with self.lock(deployment_id):
+            record = self.records.get(deployment_id)
+            if record is None:
+                return None
+            record.update(fields)
+            self._publish(deployment_id, record)
+            finished = fields.get('status') in FINISHED_STATUSES
+            if finished:
+                self.log_buffers.finish(deployment_id)
+        if finished:
+            self._finish(deployment_id)
+        return record
+
+    def update_status(self, deployment_id, status, **fields):
+        return self.update(deployment_id, status=status, **fields)
+
+    def increment(self, deployment_id, field, amount=1):
+        """Add ``amount`` to a numeric field of a deployment"""
+        with self.lock(deployment_id):
+            record = self.records.get(deployment_id)
+            if record is None:
+                return None
+            record[field] = record.get(field, 0) + amount
+            self._publish(deployment_id, record)
+            return record[field]
+
+    def append_log(self, deployment_id, message):
+        """Append a log line; returns False if the deployment does not exist"""
+        with self.lock(deployment_id):
+            record = self.records.get(deployment_id)
+            if record is None:
+                return False
+            line_number = record.get('log_count', 0)
+            self.log_buffers.append(deployment_id, message, line_number)
+            record['log_count'] = line_number + 1
+            self._publish(deployment_id, record)
+            if self.persister is not None:
+                # Queued under the lock so segment lines keep the order they were appended in
+                self.persister.log(deployment_id, message, line_number)
+        return True
+
+    def read_logs(self, deployment_id, start=0, end=None, total=None):
+        """Log lines ``start``..``end`` of a deployment; ``total`` is its ``log_count`` if known"""
+        return self.log_buffers.read(deployment_id, start, end, total, lock=self.lock(deployment_id))
+
+    def save(self, deployment_id):
+        """Publish a record that was changed in place by code not using the registry"""
+        with self.lock(deployment_id):
+            record = self.records.get(deployment_id)
+            if record is not None:
+                self._publish(deployment_id, record)
+
+    def snapshot(self, deployment_id):
+        """Copy of a deployment's metadata as of its last change, or None"""
+        snapshot = self._snapshots.get(deployment_id)
+        if snapshot is not None:
+            return snapshot
+        with self.lock(deployment_id):
+            record = self.records.get(deployment_id)
+            if record is None:
+                return None
+            snapshot = record.copy()
+            snapshot.pop('logs', None)
+            if not self.is_local(deployment_id):
+                # Not kept (shared backend): another process may change it
+                return snapshot
+            return self._snapshots.setdefault(deployment_id, snapshot)
+
+    def delete(self, deployment_id, keep_log_records=False):
+        """Forget a deployment; ``keep_log_records`` leaves it searchable (it was archived)"""
+        lock = self.lock(deployment_id)
+        with lock:
+            # dict.pop: LazyDeploymentDict.pop would load a record that is not in memory first
+            dict.pop(self.records, deployment_id, None)
+            self._snapshots.pop(deployment_id, None)
+            # Wakes viewers so they notice the record is gone
+            self._changed(deployment_id, lock)
+            self._versions.pop(deployment_id, None)
+            self.log_buffers.discard(deployment_id)
+            if self.persister is not None:
+                self.persister.delete(deployment_id, keep_log_records=keep_log_records)
+        with self._finished_lock:
+            self._finished.pop(deployment_id, None)
+        with self._locks_lock:
+            self._locks.pop(deployment_id, None)
+
+    def clear(self):
+        with self._locks_lock:
+            self.records.clear()
+            self._snapshots.clear()
+            for deployment_id, lock in self._locks.items():
+                with lock:
+                    self._changed(deployment_id, lock)
+            self._versions.clear()
+            self._locks.clear()
+            with self._finished_lock:
+                self._finished.clear()
+            self.log_buffers.clear()
+            if self.persister is not None:
+                self.persister.clear()
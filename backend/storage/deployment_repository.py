@@ -0,0 +1,268 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deployments (
+    id TEXT PRIMARY KEY,
+    type TEXT,
+    status TEXT,
+    timestamp REAL NOT NULL DEFAULT 0,
+    ft TEXT,
+    logged_in_user TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_deployments_timestamp ON deployments (timestamp);
+CREATE INDEX IF NOT EXISTS idx_deployments_type_status_timestamp ON deployments (type, status, timestamp);
+CREATE INDEX IF NOT EXISTS idx_deployments_status ON deployments (status);
+CREATE INDEX IF NOT EXISTS idx_deployments_ft ON deployments (ft);
+CREATE INDEX IF NOT EXISTS idx_deployments_logged_in_user ON deployments (logged_in_user);
+CREATE TABLE IF NOT EXISTS archived (
+    id TEXT PRIMARY KEY,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_archived_day ON archived (day);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Filters accepted by DeploymentRepository.query(), mapped to their indexed columns
+FILTER_COLUMNS = {
+    'type': 'type',
+    'status': 'status',
+    'ft': 'ft',
+    'user': 'logged_in_user',
+}
+
+
+def normalize_timestamp(value, fallback=None):
+    """Convert a stored deployment timestamp (unix float or ISO string) to a unix float"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            pass
+        try:
+            return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S').timestamp()
+        except ValueError:
+            pass
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return time.time() if fallback is None else fallback
+
+
+def deployment_timestamp(deployment):
+    """Sortable unix timestamp of a deployment record"""
+    # Template deployments only carry start_time
+    value = deployment.get('timestamp') or deployment.get('start_time')
+    return normalize_timestamp(value)
+
+
+def filter_values(deployment):
+    """Values of a deployment record for each of the FILTER_COLUMNS keys"""
+    return {
+        'type': deployment.get('type'),
+        'status': deployment.get('status'),
+        'ft': deployment.get('ft') or deployment.get('ft_number'),
+        'user': deployment.get('logged_in_user'),
+    }
+
+
+def values_match(values, filters):
+    """Whether ``filter_values()`` of a deployment pass the same filters as DeploymentRepository.query()"""
+    return all(value is None or values[key] == value for key, value in (filters or {}).items())
+
+
+def matches_filters(deployment, filters):
+    """Whether a deployment record passes the same filters as DeploymentRepository.query()"""
+    return values_match(filter_values(deployment), filters)
+
+
+class DeploymentRepository:
+    """SQLite (WAL) store of deployment metadata, indexed for the history endpoints.
+
+    Rows hold the deployment record without its logs plus the columns the API
+    filters and sorts on, so history queries never touch the in-memory dict.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _row_values(deployment_id, deployment):
+        data = {k: v for k, v in deployment.items() if k != 'logs'}
+        values = filter_values(deployment)
+        return (
+            deployment_id,
+            values['type'],
+            values['status'],
+            deployment_timestamp(deployment),
+            values['ft'],
+            values['user'],
+            json.dumps(data, default=str, separators=(',', ':')),
+        )
+
+    def upsert(self, deployment_id, deployment):
+        """Insert or replace the metadata row of a deployment"""
+        self.upsert_many([(deployment_id, deployment)])
+
+    def upsert_many(self, items):
+        """Insert or replace several deployments in a single transaction"""
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO deployments (id, type, status, timestamp, ft, logged_in_user, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [self._row_values(deployment_id, deployment) for deployment_id, deployment in items]
+            )
+
+    def replace_all(self, deployments):
+        """Rebuild the table from a full deployments dict"""
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM deployments')
+            conn.executemany(
+                'INSERT INTO deployments (id, type, status, timestamp, ft, logged_in_user, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [self._row_values(deployment_id, deployment)
+                 for deployment_id, deployment in list(deployments.items())]
+            )
+
+    def apply_journal(self, records):
+        """Apply history journal records in one transaction; returns how many were applied"""
+        applied = 0
+        conn = self._connection()
+        with conn:
+            for record in records:
+                op = record.get('op')
+                if op == 'put':
+                    conn.execute(
+                        'INSERT OR REPLACE INTO deployments (id, type, status, timestamp, ft, logged_in_user, data) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        self._row_values(record['id'], record.get('data', {}))
+                    )
+                elif op == 'del':
+                    conn.execute('DELETE FROM deployments WHERE id = ?', (record['id'],))
+                elif op == 'clear':
+                    conn.execute('DELETE FROM deployments')
+                else:
+                    # Log lines are kept in log segments, not in the repository
+                    continue
+                applied += 1
+        return applied
+
+    def iter_json(self):
+        """Yield (id, metadata as JSON text) for every deployment without decoding it"""
+        for row in self._connection().execute('SELECT id, data FROM deployments'):
+            yield row['id'], row['data']
+
+    def get_meta(self, key):
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM deployments').fetchone()[0]
+
+    def get(self, deployment_id):
+        """Metadata of a single deployment, or None"""
+        row = self._connection().execute(
+            'SELECT data FROM deployments WHERE id = ?', (deployment_id,)
+        ).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def query(self, filters=None, since=None, until=None, limit=None, offset=0):
+        """Yield (id, sort timestamp, metadata) newest first, using the column indexes"""
+        clauses = []
+        params = []
+        for key, value in (filters or {}).items():
+            if value is not None:
+                clauses.append(f"{FILTER_COLUMNS[key]} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('timestamp < ?')
+            params.append(until)
+        sql = 'SELECT id, timestamp, data FROM deployments'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY timestamp DESC'
+        if limit is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([limit, offset])
+        for row in self._connection().execute(sql, params):
+            yield row['id'], row['timestamp'], json.loads(row['data'])
+
+    def ids_older_than(self, cutoff):
+        """IDs of deployments whose timestamp is before ``cutoff``"""
+        rows = self._connection().execute(
+            'SELECT id FROM deployments WHERE timestamp < ?', (cutoff,)
+        ).fetchall()
+        return [row['id'] for row in rows]
+
+    def delete_many(self, deployment_ids):
+        conn = self._connection()
+        with conn:
+            conn.executemany('DELETE FROM deployments WHERE id = ?', [(d,) for d in deployment_ids])
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM deployments')
+
+    def mark_archived(self, day, deployment_ids):
+        """Move deployments out of the live table, remembering the archive partition they went to"""
+        conn = self._connection()
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO archived (id, day) VALUES (?, ?)',
+                             [(d, day) for d in deployment_ids])
+            conn.executemany('DELETE FROM deployments WHERE id = ?', [(d,) for d in deployment_ids])
+
+    def archived_day(self, deployment_id):
+        """Archive partition (day) holding a deployment, or None"""
+        row = self._connection().execute('SELECT day FROM archived WHERE id = ?', (deployment_id,)).fetchone()
+        return row['day'] if row else None
+
+    def forget_archived(self, before_day=None):
+        """Drop the archive index entries of partitions before ``before_day`` (all if None); returns how many"""
+        conn = self._connection()
+        with conn:
+            if before_day is None:
+                cursor = conn.execute('DELETE FROM archived')
+            else:
+                cursor = conn.execute('DELETE FROM archived WHERE day < ?', (before_day,))
+        return cursor.rowcount
@@ -0,0 +1,326 @@
+import gzip
+import heapq
+import json
+import os
+import re
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+from storage.deployment_repository import deployment_timestamp, filter_values, values_match
+from storage.file_lock import FileLock
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+# Finished deployments older than this many days move from the live store to the archive
+HISTORY_ARCHIVE_AFTER_DAYS = int(os.environ.get('HISTORY_ARCHIVE_AFTER_DAYS', 7))
+# Compress archive partitions with gzip
+HISTORY_ARCHIVE_GZIP = os.environ.get('HISTORY_ARCHIVE_GZIP', 'false').lower() in ('1', 'true', 'yes')
+# Archive partitions older than this many days are deleted; 0 keeps them forever
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 0))
+# Seconds between archiving/retention runs
+HISTORY_ARCHIVE_INTERVAL = int(os.environ.get('HISTORY_ARCHIVE_INTERVAL', 3600))
+
+_PARTITION_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2})\.jsonl(\.gz)?$')
+
+
+def partition_day(timestamp):
+    """Name of the day partition (UTC date) a unix timestamp falls in"""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+
+def day_start(day):
+    """Unix timestamp of the start of a day partition"""
+    return datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+
+
+class HistoryArchive:
+    """Day-partitioned archive of finished deployments.
+
+    Each day has three files in ``archive_dir``:
+
+    - ``<YYYY-MM-DD>.jsonl`` (``.jsonl.gz`` when compressed): one metadata
+      line per deployment, newest first;
+    - ``<YYYY-MM-DD>.logs.jsonl`` (``.gz``): the logs of each deployment,
+      one line each, in the same order;
+    - ``<YYYY-MM-DD>.index.json``: per deployment its ID, timestamp, filter
+      values and the offsets of its two lines.
+
+    History queries filter and order on the (cached) indexes and read only
+    the metadata lines they return. A lookup by ID seeks to its line, and
+    logs are only read when asked for. Partitions are written once, when
+    their day is old enough to be archived, so retention deletes whole days
+    and range reads open only the days that overlap the range. Partitions
+    written with the logs inline are converted when first read.
+    """
+
+    def __init__(self, archive_dir, compress=HISTORY_ARCHIVE_GZIP):
+        self.archive_dir = archive_dir
+        self.compress = compress
+        os.makedirs(archive_dir, exist_ok=True)
+        # Held while archiving so processes sharing the directory do not write the same partition
+        self.lock = FileLock(os.path.join(archive_dir, '.lock'))
+        # {day: (index file mtime, index)}
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+
+    def partitions(self):
+        """{day: path} of all partitions"""
+        partitions = {}
+        for name in os.listdir(self.archive_dir):
+            match = _PARTITION_NAME.match(name)
+            if match:
+                partitions[match.group(1)] = os.path.join(self.archive_dir, name)
+        return partitions
+
+    def _logs_path(self, path):
+        return path.replace('.jsonl', '.logs.jsonl', 1)
+
+    def _index_path(self, day):
+        return os.path.join(self.archive_dir, f'{day}.index.json')
+
+    @staticmethod
+    def _open(path, mode, compress=None):
+        if compress if compress is not None else path.endswith('.gz'):
+            return gzip.open(path, mode + 'b')
+        return open(path, mode + 'b')
+
+    def _read_lines(self, path):
+        with self._open(path, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning("Skipping unreadable line in history archive %s", path)
+
+    def _read_entries(self, path):
+        """Entries ({'id', 'data', 'logs'}) of a partition, whichever way its logs are stored"""
+        logs = {}
+        logs_path = self._logs_path(path)
+        if os.path.exists(logs_path):
+            logs = {entry['id']: entry.get('logs', []) for entry in self._read_lines(logs_path)}
+        for entry in self._read_lines(path):
+            yield {'id': entry['id'], 'data': entry['data'],
+                   'logs': entry['logs'] if 'logs' in entry else logs.get(entry['id'], [])}
+
+    @staticmethod
+    def _write_lines(f, lines):
+        """Write JSON lines; returns the offset of each one"""
+        offsets = []
+        offset = 0
+        for line in lines:
+            encoded = (json.dumps(line, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+            f.write(encoded)
+            offsets.append(offset)
+            offset += len(encoded)
+        return offsets
+
+    @staticmethod
+    def _replace(tmp_file, path):
+        with open(tmp_file, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    def _write(self, day, entries, existing=None):
+        path = os.path.join(self.archive_dir, f'{day}.jsonl' + ('.gz' if self.compress else ''))
+        logs_path = self._logs_path(path)
+        ordered = sorted(entries, key=lambda e: deployment_timestamp(e['data']), reverse=True)
+        with self._open(logs_path + '.tmp', 'w', self.compress) as f:
+            logs_offsets = self._write_lines(f, ({'id': e['id'], 'logs': e.get('logs') or []} for e in ordered))
+        with self._open(path + '.tmp', 'w', self.compress) as f:
+            data_offsets = self._write_lines(f, ({'id': e['id'], 'data': e['data']} for e in ordered))
+        self._replace(logs_path + '.tmp', logs_path)
+        self._replace(path + '.tmp', path)
+        index = {
+            'partition': os.path.basename(path),
+            'size': os.path.getsize(path),
+            'count': len(ordered),
+            'rows': [{'id': e['id'], 'ts': deployment_timestamp(e['data']), 'filters': filter_values(e['data']),
+                      'data': data_offset, 'logs': logs_offset}
+                     for e, data_offset, logs_offset in zip(ordered, data_offsets, logs_offsets)],
+        }
+        index_path = self._index_path(day)
+        with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        self._replace(index_path + '.tmp', index_path)
+        if existing and existing != path:
+            # Compression was switched since the partition was first written
+            for old in (existing, self._logs_path(existing)):
+                if os.path.exists(old):
+                    os.remove(old)
+
+    def write_partition(self, day, entries):
+        """Add ``entries`` ({'id', 'data', 'logs'}) to a day partition.
+
+        Deployments already in the partition are replaced, so re-archiving after
+        an interrupted run is harmless.
+        """
+        with self.lock:
+            existing = self.partitions().get(day)
+            merged = {}
+            if existing:
+                for entry in self._read_entries(existing):
+                    merged[entry['id']] = entry
+            for entry in entries:
+                merged[entry['id']] = entry
+            self._write(day, merged.values(), existing)
+        logger.info("Archived %d deployments into history partition %s", len(entries), day)
+
+    def _load_index(self, day, path):
+        """The index of a partition if it describes ``path`` as it is on disk, else None"""
+        size = os.path.getsize(path)
+        try:
+            mtime = os.stat(self._index_path(day)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._indexes_lock:
+            cached = self._indexes.get(day)
+        if cached is not None and cached[0] == mtime:
+            index = cached[1]
+        else:
+            try:
+                with open(self._index_path(day), 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                index['positions'] = {row['id']: n for n, row in enumerate(index['rows'])}
+            except (OSError, ValueError, KeyError):
+                return None
+            with self._indexes_lock:
+                self._indexes[day] = (mtime, index)
+        if index.get('partition') != os.path.basename(path) or index.get('size') != size:
+            return None
+        return index
+
+    def _index(self, day, path):
+        """(path, index) of a day partition; the index is written (converting the partition) when missing or outdated"""
+        index = self._load_index(day, path)
+        if index is None:
+            with self.lock:
+                # Another process may have written it meanwhile
+                path = self.partitions().get(day)
+                if path is None:
+                    raise FileNotFoundError(self._index_path(day))
+                index = self._load_index(day, path)
+                if index is None:
+                    self._write(day, list(self._read_entries(path)), path)
+                    logger.info("Indexed history partition %s", day)
+                    path = self.partitions()[day]
+                    index = self._load_index(day, path)
+            if index is None:
+                raise ValueError(f"History archive index of {day} does not match its partition")
+        return path, index
+
+    def _read_at(self, path, offset):
+        with self._open(path, 'r') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def _row(self, deployment_id, day):
+        path = self.partitions().get(day)
+        if path is None:
+            return None, None
+        path, index = self._index(day, path)
+        position = index['positions'].get(deployment_id)
+        if position is None:
+            return None, None
+        return path, index['rows'][position]
+
+    def get(self, deployment_id, day):
+        """Metadata of an archived deployment (with ``archived_day`` set), or None"""
+        try:
+            path, row = self._row(deployment_id, day)
+            if row is None:
+                return None
+            return dict(self._read_at(path, row['data'])['data'], archived_day=day)
+        except FileNotFoundError:
+            # Dropped by retention meanwhile
+            return None
+
+    def read_logs(self, deployment_id, day):
+        """Log lines of an archived deployment"""
+        try:
+            path, row = self._row(deployment_id, day)
+            if row is None:
+                return []
+            return self._read_at(self._logs_path(path), row['logs']).get('logs', [])
+        except FileNotFoundError:
+            return []
+
+    def entries(self):
+        """Yield every archived entry ({'id', 'data', 'logs'}), newest partition first"""
+        for day, path in sorted(self.partitions().items(), reverse=True):
+            try:
+                yield from self._read_entries(path)
+            except FileNotFoundError:
+                # Dropped by retention meanwhile
+                continue
+
+    def query(self, filters=None, since=None, until=None, with_data=True):
+        """Yield (id, sort timestamp, metadata) newest first from the partitions overlapping [since, until).
+
+        Filters and ordering use the partition indexes. A partition is only
+        opened once the caller iterates into it, and with ``with_data=False``
+        metadata is None and no partition is read at all (``get()`` the rows
+        that are needed).
+        """
+        for day, path in sorted(self.partitions().items(), reverse=True):
+            start = day_start(day)
+            if since is not None and start + 86400 <= since:
+                break
+            if until is not None and start >= until:
+                continue
+            try:
+                path, index = self._index(day, path)
+                rows = [row for row in index['rows']
+                        if not (since is not None and row['ts'] < since)
+                        and not (until is not None and row['ts'] >= until)
+                        and values_match(row['filters'], filters)]
+                if not with_data:
+                    for row in rows:
+                        yield row['id'], row['ts'], None
+                    continue
+                with self._open(path, 'r') as f:
+                    for row in rows:
+                        # Rows are in file order, so this only ever seeks forward
+                        f.seek(row['data'])
+                        yield row['id'], row['ts'], dict(json.loads(f.readline())['data'], archived_day=day)
+            except FileNotFoundError:
+                # Dropped by retention meanwhile
+                continue
+
+    def drop_before(self, cutoff):
+        """Delete every partition whose whole day lies before ``cutoff``; returns the dropped days"""
+        dropped = []
+        for day, path in sorted(self.partitions().items()):
+            if day_start(day) + 86400 > cutoff:
+                break
+            try:
+                os.remove(path)
+                dropped.append(day)
+            except OSError as e:
+                logger.error("Error removing history partition %s: %s", path, e)
+                continue
+            for sidecar in (self._logs_path(path), self._index_path(day)):
+                try:
+                    os.remove(sidecar)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.error("Error removing history partition file %s: %s", sidecar, e)
+            with self._indexes_lock:
+                self._indexes.pop(day, None)
+        if dropped:
+            logger.info("Dropped %d history archive partitions (%s to %s)", len(dropped), dropped[0], dropped[-1])
+        return dropped
+
+
+def archive_cutoff(now=None, after_days=HISTORY_ARCHIVE_AFTER_DAYS):
+    """Start of the oldest day that stays in the live store"""
+    today = datetime.fromtimestamp(now or time.time(), timezone.utc)
+    return day_start((today - timedelta(days=after_days)).strftime('%Y-%m-%d'))
+
+
+def merge_newest_first(*sources):
+    """Merge several newest-first (id, timestamp, data) streams into one"""
+    return heapq.merge(*sources, key=lambda row: row[1], reverse=True)
@@ -0,0 +1,188 @@
+"""Incremental backups of the deployment history.
+
+Every journal compaction produces two immutable files: the journal that was
+folded in (a *delta* holding exactly the changes since the previous snapshot)
+and the new snapshot. Both are hardlinked into the backup directory, so taking
+a backup costs no I/O beyond a directory entry. The delta is kept every time;
+the snapshot only every ``full_every`` compactions, so disk use grows with the
+size of the changes rather than with the size of the history.
+
+Restoring replays the newest full snapshot taken at or before the requested
+time, then every later delta, stopping at the requested time.
+
+Usage (from the backend directory):
+
+    python -m storage.history_backups list
+    python -m storage.history_backups restore --output /app/logs/deployment_history.json [--at 2024-05-01T12:00:00]
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import logging
+from datetime import datetime, timezone
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+# Keep a full snapshot every N compactions; the compactions in between only keep their delta
+HISTORY_BACKUP_FULL_EVERY = int(os.environ.get('HISTORY_BACKUP_FULL_EVERY', 10))
+# Number of full snapshots (and the deltas that depend on them) to retain
+HISTORY_BACKUP_FULL_COUNT = int(os.environ.get('HISTORY_BACKUP_FULL_COUNT', 3))
+
+_BACKUP_NAME = re.compile(r'^(full|delta)-(\d+)-(\d{20})\.(json|journal)$')
+
+
+def _link_or_copy(src, dst):
+    """Hardlink ``src`` to ``dst``; copy when the filesystem does not support links"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def read_snapshot(path):
+    """Load a snapshot file in any supported format"""
+    # Imported here so the module can run as a standalone restore command
+    from storage.serialization import read_snapshot as read
+    return read(path)
+
+
+def apply_record(deployments, record):
+    """Apply one journal record to a deployments dict"""
+    # Imported here so the module can run as a standalone restore command
+    from storage.history_journal import HistoryJournal
+    HistoryJournal._apply(deployments, record)
+
+
+class HistoryBackups:
+    """Full snapshots plus deltas of the deployment history, kept as hardlinks"""
+
+    def __init__(self, backup_dir, full_every=HISTORY_BACKUP_FULL_EVERY, full_count=HISTORY_BACKUP_FULL_COUNT):
+        self.backup_dir = backup_dir
+        self.full_every = max(1, full_every)
+        self.full_count = max(1, full_count)
+        os.makedirs(backup_dir, exist_ok=True)
+
+    def entries(self):
+        """Backup files as (kind, sequence, taken_at, path), oldest first"""
+        entries = []
+        for name in os.listdir(self.backup_dir):
+            match = _BACKUP_NAME.match(name)
+            if not match:
+                continue
+            taken_at = datetime.strptime(match.group(3), '%Y%m%d%H%M%S%f').replace(tzinfo=timezone.utc)
+            entries.append((match.group(1), int(match.group(2)), taken_at, os.path.join(self.backup_dir, name)))
+        # A delta and the full snapshot of the same compaction share a sequence number; the delta comes first
+        entries.sort(key=lambda e: (e[1], e[0] == 'full'))
+        return entries
+
+    def add(self, delta_file, snapshot_file):
+        """Record one compaction: ``delta_file`` was folded into the new ``snapshot_file``"""
+        entries = self.entries()
+        sequence = entries[-1][1] + 1 if entries else 1
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+
+        if delta_file and os.path.exists(delta_file):
+            _link_or_copy(delta_file, os.path.join(self.backup_dir, f'delta-{sequence:08d}-{stamp}.journal'))
+
+        fulls = [e for e in entries if e[0] == 'full']
+        if not fulls or sequence - fulls[-1][1] >= self.full_every:
+            _link_or_copy(snapshot_file, os.path.join(self.backup_dir, f'full-{sequence:08d}-{stamp}.json'))
+            logger.debug("Added full history backup #%s", sequence)
+        self._prune()
+
+    def _prune(self):
+        entries = self.entries()
+        fulls = [e for e in entries if e[0] == 'full']
+        if len(fulls) <= self.full_count:
+            return
+        oldest_kept = fulls[-self.full_count][1]
+        for kind, sequence, _, path in entries:
+            # Deltas up to the oldest kept full are already contained in it
+            if sequence < oldest_kept or (kind == 'delta' and sequence == oldest_kept):
+                try:
+                    os.remove(path)
+                    logger.debug("Removed old history backup: %s", path)
+                except OSError as e:
+                    logger.error("Error removing old history backup %s: %s", path, e)
+
+    def restore(self, at=None, journal_files=()):
+        """Rebuild the deployments dict as of ``at`` (a unix timestamp, or latest if None)"""
+        entries = self.entries()
+        fulls = [e for e in entries if e[0] == 'full' and (at is None or e[2].timestamp() <= at)]
+        deployments = None
+        # Fall back to an older full snapshot if the newest one is unreadable
+        for _, base_sequence, _, base_path in reversed(fulls):
+            try:
+                deployments = read_snapshot(base_path)
+                break
+            except (OSError, ValueError) as e:
+                logger.error("Error loading history backup %s: %s", base_path, e)
+        if deployments is None:
+            raise FileNotFoundError(f"No usable full history backup found in {self.backup_dir}")
+
+        deltas = [e[3] for e in entries if e[0] == 'delta' and e[1] > base_sequence]
+        for path in list(deltas) + [p for p in journal_files if os.path.exists(p)]:
+            if self._replay(deployments, path, at):
+                break
+        return deployments
+
+    @staticmethod
+    def _replay(deployments, path, at):
+        """Apply a journal file; returns True once a record newer than ``at`` is reached"""
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if at is not None and record.get('ts', 0) > at:
+                    return True
+                apply_record(deployments, record)
+        return False
+
+
+def main(argv=None):
+    logs_dir = os.environ.get('DEPLOYMENT_LOGS_DIR', '/app/logs')
+    parser = argparse.ArgumentParser(description='List or restore deployment history backups')
+    parser.add_argument('command', choices=['list', 'restore'])
+    parser.add_argument('--backup-dir', default=os.path.join(logs_dir, 'history_backups'))
+    parser.add_argument('--journal', default=os.path.join(logs_dir, 'deployment_history.journal'),
+                        help='live journal to replay after the backups')
+    parser.add_argument('--at', help='ISO timestamp (UTC unless an offset is given) to restore to')
+    parser.add_argument('--output', help='file to write the restored history to (default: stdout)')
+    args = parser.parse_args(argv)
+
+    backups = HistoryBackups(args.backup_dir)
+    if args.command == 'list':
+        for kind, sequence, taken_at, path in backups.entries():
+            print(f"{sequence:8d}  {kind:5s}  {taken_at.isoformat()}  {os.path.getsize(path):>12d}  {path}")
+        return 0
+
+    at = None
+    if args.at:
+        at_dt = datetime.fromisoformat(args.at.replace('Z', '+00:00'))
+        if at_dt.tzinfo is None:
+            at_dt = at_dt.replace(tzinfo=timezone.utc)
+        at = at_dt.timestamp()
+    deployments = backups.restore(at=at, journal_files=[args.journal + '.compacting', args.journal])
+
+    if args.output:
+        tmp_file = args.output + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(deployments, f, default=str, indent=2)
+        os.replace(tmp_file, args.output)
+        print(f"Restored {len(deployments)} deployments to {args.output}", file=sys.stderr)
+    else:
+        json.dump(deployments, sys.stdout, default=str, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+import logging
+
+from storage.deployment_repository import deployment_timestamp
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+# Seconds to keep collecting changes before they are written out together
+HISTORY_FLUSH_WINDOW = float(os.environ.get('HISTORY_FLUSH_WINDOW', 0.5))
+
+
+class HistoryFlusher:
+    """Single background writer for deployment history.
+
+    Worker and request threads only queue what changed (dirty deployment IDs,
+    new log lines, deletions) and return immediately. The flusher thread waits
+    ``window`` seconds after the first change so that bursts coalesce, then
+    appends new log lines to their segments (and their parsed records to
+    ``log_records``, when given), writes one fsynced journal batch and one
+    repository transaction, and folds the journal into the snapshot when it
+    has grown large. At most one snapshot write happens per window.
+    """
+
+    def __init__(self, journal, repository, segments, get_snapshot, window=HISTORY_FLUSH_WINDOW, log_records=None):
+        self.journal = journal
+        self.repository = repository
+        self.segments = segments
+        self.log_records = log_records
+        self.get_snapshot = get_snapshot
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_puts = set()
+        # Deployments of the batch being written
+        self._writing = set()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.flush_count = 0
+
+    def mark_dirty(self, deployment_id):
+        """Queue the current metadata of a deployment for writing"""
+        with self._lock:
+            if deployment_id not in self._pending_puts:
+                self._pending_puts.add(deployment_id)
+                self._pending.append(('put', deployment_id))
+        self._wakeup.set()
+
+    def log(self, deployment_id, message, line_number=None):
+        """Queue a log line for the deployment's log segment, stamped with the time it was logged"""
+        with self._lock:
+            self._pending.append(('log', deployment_id, message, line_number, time.time()))
+            # The metadata carries the log line count
+            if deployment_id not in self._pending_puts:
+                self._pending_puts.add(deployment_id)
+                self._pending.append(('put', deployment_id))
+        self._wakeup.set()
+
+    def delete(self, deployment_id, keep_log_records=False):
+        """Queue the removal of a deployment's segment and journal entry (and its log records unless kept)"""
+        with self._lock:
+            self._pending.append(('del', deployment_id, keep_log_records))
+        self._wakeup.set()
+
+    def clear(self):
+        with self._lock:
+            self._pending.append(('clear',))
+        self._wakeup.set()
+
+    def is_pending(self, deployment_id):
+        """Whether changes of a deployment are queued or being written"""
+        with self._lock:
+            return deployment_id in self._pending_puts or deployment_id in self._writing
+
+    def request_compaction(self):
+        self.journal.request_compaction()
+        self._wakeup.set()
+
+    def flush(self):
+        """Write everything queued so far; safe to call from any thread"""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._writing = self._pending_puts
+                self._pending = []
+                self._pending_puts = set()
+            try:
+                if pending:
+                    self._write(pending)
+            finally:
+                with self._lock:
+                    self._writing = set()
+            try:
+                self.journal.compact_if_needed(self.repository.iter_json)
+            except Exception as e:
+                logger.error("Failed to compact deployment history journal: %s", e)
+
+    def _append_logs(self, log_lines):
+        for deployment_id, entries in log_lines.items():
+            try:
+                self.segments.append(deployment_id, [message for _, _, message in entries])
+            except Exception as e:
+                logger.error("Failed to write log segment for %s: %s", deployment_id, e)
+            if self.log_records is None:
+                continue
+            try:
+                # Type and time of the deployment, for the search filters
+                deployment = self.get_snapshot(deployment_id) or {}
+                self.log_records.append(deployment_id, [entry for entry in entries if entry[0] is not None],
+                                        kind=deployment.get('type'),
+                                        timestamp=deployment_timestamp(deployment) if deployment else None)
+            except Exception as e:
+                logger.error("Failed to index log records of %s: %s", deployment_id, e)
+        log_lines.clear()
+
+    def _delete_log_records(self, deployment_id):
+        """Drop the log records of one deployment, or of all of them when ``deployment_id`` is None"""
+        if self.log_records is None:
+            return
+        try:
+            if deployment_id is None:
+                self.log_records.clear()
+            else:
+                self.log_records.delete(deployment_id)
+        except Exception as e:
+            logger.error("Failed to delete log records: %s", e)
+
+    def _write(self, pending):
+        records = []
+        upserts = {}
+        deletes = []
+        log_lines = {}
+        for op in pending:
+            kind = op[0]
+            if kind == 'put':
+                # A consistent copy published by the registry, never the record being mutated
+                deployment = self.get_snapshot(op[1])
+                # Deleted before the flush ran; the delete record follows
+                if deployment is None:
+                    continue
+                records.append(self.journal.put_record(op[1], deployment))
+                upserts[op[1]] = deployment
+            elif kind == 'log':
+                log_lines.setdefault(op[1], []).append((op[3], op[4], op[2]))
+            elif kind == 'del':
+                self._append_logs(log_lines)
+                self.segments.delete(op[1])
+                if not op[2]:
+                    self._delete_log_records(op[1])
+                records.append(self.journal.delete_record(op[1]))
+                upserts.pop(op[1], None)
+                deletes.append(op[1])
+            elif kind == 'clear':
+                self._append_logs(log_lines)
+                self.segments.clear()
+                self._delete_log_records(None)
+                records.append(self.journal.clear_record())
+                upserts.clear()
+        self._append_logs(log_lines)
+
+        # Held across both writes so a compaction (possibly in another process) never sees
+        # journal records whose repository update is still missing
+        with self.journal.lock:
+            try:
+                self.journal.write(records, sync=True)
+            except Exception as e:
+                logger.error("Failed to write deployment history journal: %s", e)
+            try:
+                if deletes:
+                    self.repository.delete_many(deletes)
+                if upserts:
+                    self.repository.upsert_many(list(upserts.items()))
+            except Exception as e:
+                logger.error("Failed to update deployment repository: %s", e)
+        self.flush_count += 1
+        logger.debug("Flushed %s history records (%s deployments)", len(records), len(upserts))
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while True:
+                self._wakeup.wait()
+                # Let further changes from the same burst accumulate
+                time.sleep(self.window)
+                self._wakeup.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error("Deployment history flush failed: %s", e)
+
+        self._thread = threading.Thread(target=run, name='history-flusher', daemon=True)
+        self._thread.start()
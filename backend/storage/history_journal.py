@@ -0,0 +1,232 @@
+import json
+import os
+import time
+import logging
+
+from storage.file_lock import FileLock
+from storage.serialization import HISTORY_SNAPSHOT_FORMAT, parse_format, write_snapshot
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+# Journal size (bytes) after which it is folded into the snapshot
+JOURNAL_COMPACT_BYTES = int(os.environ.get('HISTORY_JOURNAL_COMPACT_BYTES', 8 * 1024 * 1024))
+
+
+class HistoryJournal:
+    """Append-only journal of deployment history changes on top of a JSON snapshot.
+
+    Every status/metadata change is written as a small ``put`` record, so the
+    cost of a save is proportional to what changed. Log lines are not part of
+    the history; they live in per-deployment log segments. Once the journal
+    grows large it is compacted: folded into the snapshot file
+    (``deployment_history.json``) and started afresh. Each record carries its
+    write time (``ts``) for point-in-time restores.
+
+    When ``backups`` is given, every compaction hands it the folded journal
+    and the new snapshot (see ``storage.history_backups``).
+
+    Several processes may share the files: appends and the journal rotation
+    are serialized by ``lock`` (a ``FileLock``), and a process notices that
+    another one rotated the journal and reopens it.
+    """
+
+    def __init__(self, snapshot_file, journal_file=None, backups=None, snapshot_format=HISTORY_SNAPSHOT_FORMAT):
+        # Fail at startup rather than at the first compaction if the format cannot be written
+        parse_format(snapshot_format)
+        self.snapshot_file = snapshot_file
+        self.snapshot_format = snapshot_format
+        self.journal_file = journal_file or os.path.splitext(snapshot_file)[0] + '.journal'
+        # Journal being folded into the snapshot; replayed on startup if compaction was interrupted
+        self.compacting_file = self.journal_file + '.compacting'
+        self.backups = backups
+        self.lock = FileLock(self.journal_file + '.lock')
+        self._compact_lock = FileLock(self.journal_file + '.compact.lock')
+        self._journal = None
+        self._journal_size = 0
+        self._compact_requested = False
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+
+    def _open_journal(self):
+        os.makedirs(os.path.dirname(self.journal_file) or '.', exist_ok=True)
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._journal_size = self._journal.tell()
+
+    def write(self, records, sync=False):
+        """Append a batch of records with a single write (and optionally fsync)"""
+        if not records:
+            return
+        data = ''.join(json.dumps(record, default=str, separators=(',', ':')) + '\n' for record in records)
+        with self.lock:
+            if self._journal is None or self._rotated_elsewhere():
+                if self._journal is not None:
+                    self._journal.close()
+                self._open_journal()
+            self._journal.write(data)
+            self._journal.flush()
+            if sync:
+                os.fsync(self._journal.fileno())
+            # Position at the end of the file, including what other processes appended
+            self._journal_size = self._journal.tell()
+
+    def _rotated_elsewhere(self):
+        """Whether another process has moved the open journal away for compaction"""
+        try:
+            return os.stat(self.journal_file).st_ino != os.fstat(self._journal.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    @staticmethod
+    def put_record(deployment_id, deployment):
+        """Record of the current metadata of a deployment (without its logs)"""
+        data = {k: v for k, v in deployment.items() if k != 'logs'}
+        return {'op': 'put', 'id': deployment_id, 'data': data, 'ts': time.time()}
+
+    @staticmethod
+    def delete_record(deployment_id):
+        """Record of the removal of a deployment from history"""
+        return {'op': 'del', 'id': deployment_id, 'ts': time.time()}
+
+    @staticmethod
+    def clear_record():
+        """Record of the removal of all deployments from history"""
+        return {'op': 'clear', 'ts': time.time()}
+
+    def put(self, deployment_id, deployment):
+        self.write([self.put_record(deployment_id, deployment)])
+
+    def delete(self, deployment_id):
+        self.write([self.delete_record(deployment_id)])
+
+    def clear(self):
+        self.write([self.clear_record()])
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _apply(deployments, record):
+        op = record.get('op')
+        deployment_id = record.get('id')
+        if op == 'put':
+            data = dict(record.get('data', {}))
+            existing = deployments.get(deployment_id, {})
+            if 'logs' in existing:
+                data['logs'] = existing['logs']
+            deployments[deployment_id] = data
+        elif op == 'log':
+            # Written by older versions that kept logs inside the history
+            deployment = deployments.setdefault(deployment_id, {'id': deployment_id})
+            logs = deployment.setdefault('logs', [])
+            # Log records carry their position so replaying over a newer snapshot is idempotent
+            index = record.get('n', len(logs))
+            if index >= len(logs):
+                logs.append(record.get('msg'))
+        elif op == 'del':
+            deployments.pop(deployment_id, None)
+        elif op == 'clear':
+            deployments.clear()
+
+    def records(self):
+        """Yield the journaled records not yet folded into the snapshot, oldest first"""
+        for path in (self.compacting_file, self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line_number, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final write from a crash; everything before it is still valid
+                        logger.warning("Skipping unreadable journal record %s:%s", path, line_number)
+
+    def replay(self, deployments):
+        """Apply any journaled changes not yet folded into the snapshot to ``deployments``"""
+        applied = 0
+        for record in self.records():
+            self._apply(deployments, record)
+            applied += 1
+        if applied:
+            logger.info("Replayed %s journal records from %s", applied, self.journal_file)
+        return applied
+
+    # ------------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------------
+
+    def compact(self, rows):
+        """Fold the journal into a fresh snapshot and start a new journal.
+
+        ``rows`` is called once the journal has been rotated and must return
+        (deployment_id, metadata JSON text) pairs reflecting at least every
+        record written before that point (``DeploymentRepository.iter_json``).
+        It is written in ``snapshot_format`` (see ``storage.serialization``).
+        """
+        with self._compact_lock:
+            started = time.time()
+            with self.lock:
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                if os.path.exists(self.journal_file):
+                    if os.path.exists(self.compacting_file):
+                        # Left over from an interrupted compaction: keep its records ahead of ours
+                        with open(self.journal_file, 'r', encoding='utf-8') as src, \
+                                open(self.compacting_file, 'a', encoding='utf-8') as dst:
+                            dst.write(src.read())
+                        os.remove(self.journal_file)
+                    else:
+                        os.replace(self.journal_file, self.compacting_file)
+                self._open_journal()
+
+            tmp_file = f'{self.snapshot_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'wb') as f:
+                count = write_snapshot(f, rows(), self.snapshot_format)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+            self._sync_directory()
+            if self.backups is not None:
+                try:
+                    # Both files are immutable from here on, so the backup is just a pair of hardlinks
+                    self.backups.add(self.compacting_file, self.snapshot_file)
+                except Exception as e:
+                    logger.error("Error backing up deployment history: %s", e)
+            if os.path.exists(self.compacting_file):
+                os.remove(self.compacting_file)
+            logger.info("Compacted deployment history journal into snapshot with %s deployments (%s) in %.2fs",
+                        count, self.snapshot_format, time.time() - started)
+
+    def _sync_directory(self):
+        """Make the rename of the snapshot durable"""
+        try:
+            dir_fd = os.open(os.path.dirname(self.snapshot_file) or '.', os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
+
+    def request_compaction(self):
+        """Ask for the journal to be compacted at the next opportunity"""
+        self._compact_requested = True
+
+    def needs_compaction(self):
+        return self._compact_requested or self._journal_size >= JOURNAL_COMPACT_BYTES
+
+    def compact_if_needed(self, rows):
+        if not self.needs_compaction():
+            return False
+        self._compact_requested = False
+        self.compact(rows)
+        return True
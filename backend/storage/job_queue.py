@@ -0,0 +1,166 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    deployment_id TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    args TEXT NOT NULL,
+    hosts TEXT NOT NULL DEFAULT '[]',
+    owner TEXT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner_state ON jobs (owner, state, seq);
+"""
+
+
+class JobQueue:
+    """SQLite (WAL) table of the jobs that have not finished yet, in submission order.
+
+    A job is a deployment ID, the kind of work (``file``, ``command``, ...)
+    and its JSON arguments. Rows are inserted when a job is submitted, marked
+    running when a worker picks it up and deleted once it finished, so after
+    a restart the table holds exactly the work that was queued or cut short.
+    ``owner`` names the process holding a job and ``lease_until`` how long
+    it holds it: the process renews the leases of its jobs while it runs,
+    and any process sharing the volume may ``claim()`` the jobs whose lease
+    has expired. ``hosts`` are the VMs the job targets, whose host slots it
+    needs before it can run.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        columns = {row['name'] for row in conn.execute('PRAGMA table_info(jobs)')}
+        if 'hosts' not in columns:
+            # Queues written before jobs carried their hosts
+            conn.execute("ALTER TABLE jobs ADD COLUMN hosts TEXT NOT NULL DEFAULT '[]'")
+        if 'lease_until' not in columns:
+            # Queues written before leases; their jobs count as expired
+            conn.execute('ALTER TABLE jobs ADD COLUMN lease_until REAL')
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def push(self, deployment_id, kind, args, owner=None, enqueued_at=None, hosts=(), lease_until=None):
+        """Append a job; returns its sequence number"""
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                'INSERT INTO jobs (deployment_id, kind, args, hosts, owner, enqueued_at, lease_until) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (deployment_id, kind, json.dumps(list(args), default=str), json.dumps(list(hosts)), owner,
+                 time.time() if enqueued_at is None else enqueued_at, lease_until))
+        return cursor.lastrowid
+
+    def renew(self, deployment_ids, lease_until):
+        """Extend the leases of jobs this process holds"""
+        deployment_ids = list(deployment_ids)
+        conn = self._connection()
+        with conn:
+            for start in range(0, len(deployment_ids), 500):
+                chunk = deployment_ids[start:start + 500]
+                conn.execute(f"UPDATE jobs SET lease_until = ? WHERE deployment_id IN ({','.join('?' * len(chunk))})",
+                             (lease_until, *chunk))
+
+    def claim(self, owner, lease_until, expired_before=None):
+        """Take over the jobs whose lease ended before ``expired_before`` (all jobs if None), in submission order.
+
+        Returns them like ``pending()``. The select and the update are one
+        write transaction, so two processes never claim the same job.
+        """
+        sql = 'SELECT seq, deployment_id, kind, args, hosts, owner, state, enqueued_at, started_at FROM jobs'
+        params = ()
+        if expired_before is not None:
+            sql += ' WHERE lease_until IS NULL OR lease_until < ?'
+            params = (expired_before,)
+        conn = self._connection()
+        jobs = []
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for row in conn.execute(sql + ' ORDER BY seq', params).fetchall():
+                job = dict(row)
+                job['args'] = json.loads(job['args'])
+                job['hosts'] = json.loads(job['hosts'])
+                jobs.append(job)
+            for job in jobs:
+                conn.execute('UPDATE jobs SET owner = ?, lease_until = ? WHERE seq = ?',
+                             (owner, lease_until, job['seq']))
+        return jobs
+
+    def mark_running(self, deployment_id, started_at=None):
+        conn = self._connection()
+        with conn:
+            conn.execute("UPDATE jobs SET state = 'running', started_at = ? WHERE deployment_id = ?",
+                         (time.time() if started_at is None else started_at, deployment_id))
+
+    def start_if_free(self, deployment_id, hosts, limit, started_at=None, lease_until=None):
+        """Mark a job running if each of its hosts has fewer than ``limit(host)`` live running jobs; returns whether it was.
+
+        Running jobs of every process sharing the file count, except those
+        whose lease has expired (their process is gone). The count and the
+        update are one write transaction, so two processes cannot both
+        take a host's last slot.
+        """
+        started_at = time.time() if started_at is None else started_at
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for host in hosts:
+                running = conn.execute(
+                    "SELECT COUNT(*) FROM jobs, json_each(jobs.hosts) WHERE jobs.state = 'running' "
+                    'AND json_each.value = ? AND jobs.deployment_id != ? '
+                    'AND jobs.lease_until >= ?',
+                    (host, deployment_id, started_at)).fetchone()[0]
+                if running >= limit(host):
+                    return False
+            conn.execute("UPDATE jobs SET state = 'running', started_at = ?, lease_until = COALESCE(?, lease_until) "
+                         'WHERE deployment_id = ?', (started_at, lease_until, deployment_id))
+        return True
+
+    def remove(self, deployment_id):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM jobs WHERE deployment_id = ?', (deployment_id,))
+
+    def pending(self, owner=None):
+        """Unfinished jobs (of ``owner``, or all) in submission order, as dicts with their arguments decoded"""
+        sql = 'SELECT seq, deployment_id, kind, args, hosts, owner, state, enqueued_at, started_at FROM jobs'
+        params = ()
+        if owner is not None:
+            sql += ' WHERE owner = ?'
+            params = (owner,)
+        jobs = []
+        for row in self._connection().execute(sql + ' ORDER BY seq', params):
+            job = dict(row)
+            job['args'] = json.loads(job['args'])
+            job['hosts'] = json.loads(job['hosts'])
+            jobs.append(job)
+        return jobs
+
+    def count(self, state=None):
+        if state is None:
+            return self._connection().execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
+        return self._connection().execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (state,)).fetchone()[0]
@@ -0,0 +1,61 @@
+class LazyDeploymentDict(dict):
+    """Deployments dict that loads records from the repository on first access.
+
+    Startup no longer reads the whole history into memory: only deployments
+    that are looked up (or created) since startup are held in the dict. A
+    lookup of any other ID goes to ``loader`` (``DeploymentRepository.get``)
+    and the record is kept from then on, so it can be mutated in place like
+    before. Iterating, ``len()`` and ``items()`` only cover the records that
+    are in memory; use the repository to walk the whole history.
+
+    With ``cache=False`` (shared state backend) loaded records are not kept:
+    other processes may be changing them, so every lookup reads the current
+    version. Only records created by this process stay in memory.
+
+    ``on_load(deployment_id, record)`` is called for every loaded record that
+    is kept (the registry uses it to evict finished ones again).
+    """
+
+    def __init__(self, loader, cache=True, on_load=None):
+        super().__init__()
+        self._loader = loader
+        self._cache = cache
+        self.on_load = on_load
+
+    def __missing__(self, deployment_id):
+        deployment = self._loader(deployment_id)
+        if deployment is None:
+            raise KeyError(deployment_id)
+        if not self._cache:
+            return deployment
+        # Another thread may have loaded (and started mutating) the same record meanwhile
+        kept = self.setdefault(deployment_id, deployment)
+        if kept is deployment and self.on_load is not None:
+            self.on_load(deployment_id, deployment)
+        return kept
+
+    def __contains__(self, deployment_id):
+        if dict.__contains__(self, deployment_id):
+            return True
+        try:
+            self[deployment_id]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, deployment_id, default=None):
+        try:
+            return self[deployment_id]
+        except KeyError:
+            return default
+
+    def pop(self, deployment_id, *default):
+        try:
+            deployment = self[deployment_id]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        dict.pop(self, deployment_id, None)
+        return deployment
+
@@ -0,0 +1,171 @@
+import os
+import threading
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from itertools import islice
+
+# Log lines of a deployment kept in memory; older lines are read back from its log segment
+LOG_TAIL_LINES = int(os.environ.get('LOG_TAIL_LINES', 5000))
+LOG_TAIL_BYTES = int(os.environ.get('LOG_TAIL_BYTES', 4 * 1024 * 1024))
+# Memory for the tails of finished deployments; least recently read ones are dropped beyond it
+LOG_MEMORY_BUDGET_BYTES = int(os.environ.get('LOG_MEMORY_BUDGET_BYTES', 64 * 1024 * 1024))
+
+
+def _line_size(message):
+    # Close enough for budgeting; exact sizes would need encoding every line
+    return len(message) if isinstance(message, str) else len(str(message))
+
+
+def _slice(lines, lo, hi):
+    """``list(lines)[lo:hi]`` for a deque, walking from whichever end is closer"""
+    count = len(lines)
+    hi = count if hi is None else min(hi, count)
+    if lo >= hi:
+        return []
+    if lo > count - hi:
+        part = list(islice(reversed(lines), count - hi, count - lo))
+        part.reverse()
+        return part
+    return list(islice(lines, lo, hi))
+
+
+class LogTail:
+    """The last lines of one deployment's log; ``start`` is the line number of the first one"""
+
+    __slots__ = ('start', 'lines', 'size')
+
+    def __init__(self, start):
+        self.start = start
+        self.lines = deque()
+        self.size = 0
+
+    @property
+    def end(self):
+        return self.start + len(self.lines)
+
+
+class LogBuffers:
+    """Bounded in-memory tails of deployment logs on top of their log segments.
+
+    Every line is written to the deployment's segment by the history flusher.
+    Memory only holds the last ``max_lines`` lines (at most ``max_bytes``) of
+    each deployment, which serve live streams and tail reads. Older lines are
+    read back from the segment. Once a deployment has finished, its tail
+    counts against ``budget`` bytes shared by all finished deployments, and
+    the least recently read tails are dropped when the budget is exceeded.
+
+    ``flush`` writes queued log lines to the segments. It is called when a
+    read needs lines that left memory before the flusher got to them.
+    Appends for one deployment are serialized by the caller (the
+    registry's per-deployment lock).
+    """
+
+    def __init__(self, segments, flush=None, max_lines=LOG_TAIL_LINES, max_bytes=LOG_TAIL_BYTES,
+                 budget=LOG_MEMORY_BUDGET_BYTES):
+        self.segments = segments
+        self.flush = flush
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self._tails = {}
+        # Finished deployments, least recently read first: {deployment_id: tail size}
+        self._finished = OrderedDict()
+        self._finished_size = 0
+        self._lock = threading.Lock()
+
+    def append(self, deployment_id, message, line_number):
+        """Add line ``line_number`` (0-based) of a deployment"""
+        tail = self._tails.get(deployment_id)
+        if tail is None or tail.end != line_number:
+            # First line since startup (earlier lines are in the segment), or the tail was dropped
+            tail = self._tails[deployment_id] = LogTail(line_number)
+        size_before = tail.size
+        tail.lines.append(message)
+        tail.size += _line_size(message)
+        while len(tail.lines) > self.max_lines or (tail.size > self.max_bytes and len(tail.lines) > 1):
+            tail.size -= _line_size(tail.lines.popleft())
+            tail.start += 1
+        if deployment_id in self._finished:
+            with self._lock:
+                if deployment_id in self._finished:
+                    self._finished[deployment_id] = tail.size
+                    self._finished_size += tail.size - size_before
+                    self._evict()
+
+    def finish(self, deployment_id):
+        """Count a finished deployment's tail against the memory budget"""
+        tail = self._tails.get(deployment_id)
+        if tail is None:
+            return
+        with self._lock:
+            if deployment_id not in self._finished:
+                self._finished[deployment_id] = tail.size
+                self._finished_size += tail.size
+            self._evict()
+
+    def _evict(self):
+        while self._finished_size > self.budget and self._finished:
+            deployment_id, size = self._finished.popitem(last=False)
+            self._finished_size -= size
+            self._tails.pop(deployment_id, None)
+
+    def read(self, deployment_id, start=0, end=None, total=None, lock=None):
+        """Lines ``start``..``end`` of a deployment's log.
+
+        ``total`` is the number of lines the deployment has; when the segment
+        holds fewer of the lines that are no longer in memory, queued lines
+        are flushed first. ``lock`` is the lock appends hold, taken while
+        lines are copied out of the tail.
+        """
+        with lock or nullcontext():
+            tail = self._tails.get(deployment_id)
+            if tail is not None:
+                tail_start = tail.start
+                stop = None if end is None else max(end - tail_start, 0)
+                from_tail = _slice(tail.lines, max(start - tail_start, 0), stop)
+        if tail is not None and deployment_id in self._finished:
+            with self._lock:
+                if deployment_id in self._finished:
+                    self._finished.move_to_end(deployment_id)
+        if tail is not None and start >= tail_start:
+            return from_tail
+
+        # The part before the tail (or everything, if there is no tail) comes from the segment
+        disk_end = tail_start if tail is not None else total
+        if end is not None:
+            disk_end = end if disk_end is None else min(disk_end, end)
+        if tail is None and total is not None and disk_end == total and start > total // 2:
+            # The end of a log that left memory: read the segment backwards instead of skipping most of it
+            lines = self.segments.read_last(deployment_id, total - start)
+            if len(lines) == total - start:
+                return lines
+        lines = self.segments.read(deployment_id, start, disk_end)
+        if disk_end is not None and start + len(lines) < disk_end and self.flush is not None:
+            self.flush()
+            lines = self.segments.read(deployment_id, start, disk_end)
+        if tail is not None:
+            lines.extend(from_tail)
+        return lines
+
+    def discard(self, deployment_id):
+        self._tails.pop(deployment_id, None)
+        with self._lock:
+            size = self._finished.pop(deployment_id, None)
+            if size is not None:
+                self._finished_size -= size
+
+    def clear(self):
+        with self._lock:
+            self._tails.clear()
+            self._finished.clear()
+            self._finished_size = 0
+
+    def stats(self):
+        """Lines and approximate bytes held in memory"""
+        tails = list(self._tails.values())
+        return {
+            'deployments': len(tails),
+            'lines': sum(len(tail.lines) for tail in tails),
+            'bytes': sum(tail.size for tail in tails),
+            'finished_bytes': self._finished_size,
+        }
@@ -0,0 +1,392 @@
+import os
+import re
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_records (
+    id INTEGER PRIMARY KEY,
+    deployment_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    host TEXT,
+    task TEXT,
+    level TEXT NOT NULL,
+    stream TEXT NOT NULL,
+    text TEXT NOT NULL,
+    UNIQUE (deployment_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_log_records_host ON log_records (deployment_id, host, seq);
+CREATE INDEX IF NOT EXISTS idx_log_records_level ON log_records (deployment_id, level, seq);
+CREATE INDEX IF NOT EXISTS idx_log_records_task ON log_records (deployment_id, task, seq);
+CREATE TABLE IF NOT EXISTS log_deployments (
+    deployment_id TEXT PRIMARY KEY,
+    type TEXT,
+    timestamp REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_log_deployments_timestamp ON log_deployments (timestamp);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Full-text index over the record texts; external content, so the text itself is only stored once.
+# append() adds each batch with one INSERT ... SELECT (several times faster than a per-row trigger);
+# the trigger keeps it in step with deletes.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS log_search USING fts5(text, content='log_records', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS log_records_search_delete AFTER DELETE ON log_records BEGIN
+    INSERT INTO log_search (log_search, rowid, text) VALUES ('delete', old.id, old.text);
+END;
+"""
+
+# Most hits one search returns
+LOG_SEARCH_MAX_LIMIT = 500
+
+LEVELS = ('debug', 'info', 'warning', 'error')
+
+# Deployments whose parser state (current task, stream) is kept between flushes
+PARSER_STATE_MAX_DEPLOYMENTS = 256
+
+# Fields a log record can be filtered on; each has an index
+RECORD_FILTERS = ('host', 'level', 'task')
+
+_TASK_HEADER = re.compile(r'^(?:TASK|RUNNING HANDLER) \[(.*)\]\s*\**$')
+_PLAY_HEADER = re.compile(r'^PLAY(?: RECAP)?(?: \[.*\])?\s*\**$')
+# ok: [batch1], fatal: [batch1 -> localhost]: FAILED! => ..., failed: [batch1] (item=...) => ...
+_HOST_RESULT = re.compile(r'^(ok|changed|skipping|included|rescued|ignored|fatal|failed|unreachable): '
+                          r'\[([^\]\s]+)(?: -> [^\]]+)?\]')
+_HOST_RETRY = re.compile(r'^FAILED - RETRYING: \[([^\]\s]+)\]')
+_HOST_RECAP = re.compile(r'^(\S+)\s+: ok=\d+\s+changed=\d+\s+unreachable=(\d+)\s+failed=(\d+)')
+# -vvv connection output: <batch1> ESTABLISH SSH CONNECTION FOR USER: infadm
+_HOST_VERBOSE = re.compile(r'^<([^>\s]+)> ')
+_DEBUG_PREFIXES = ('task path:', 'Using module file', 'Pipelining is enabled', 'META:', 'redirecting (type:',
+                   'Loading callback plugin', 'Using /', 'PLAYBOOK:', 'Positional arguments:', 'ansible-playbook [',
+                   'config file =', 'configured module search path', 'ansible python module location',
+                   'executable location', 'python version', 'jinja version', 'libyaml', 'Skipping callback',
+                   'Read vars_file', 'Parsed /', 'Attempting to use', 'Set default localhost', 'Trying secret')
+_RESULT_LEVELS = {'fatal': 'error', 'failed': 'error', 'unreachable': 'error', 'ignored': 'warning'}
+# Lines of a multi-line task result (JSON or YAML callback) following its "fatal: [host]: ... => {" line
+# ([WARNING] and ERROR: lines are not part of it)
+_CONTINUATION = re.compile(r'^(?:["{}\]]|\[(?![A-Z])|[a-z_]+: |\.\.\.)')
+
+
+class AnsibleLogParser:
+    """Turns the lines of ansible-playbook output into record fields as they arrive.
+
+    Keeps a little state per deployment (the current task, the host of the
+    last task result, whether the lines are stderr) so that a line is
+    parsed exactly once, in order. ``parse()`` returns ``(host, task,
+    level, stream)``; lines that are not ansible output (the orchestrator's
+    own messages) get their level from an ``ERROR:``/``WARNING:`` prefix.
+    """
+
+    def __init__(self, max_deployments=PARSER_STATE_MAX_DEPLOYMENTS):
+        self.max_deployments = max_deployments
+        self._state = OrderedDict()
+
+    def parse(self, deployment_id, text):
+        state = self._state.get(deployment_id)
+        if state is None:
+            state = self._state[deployment_id] = {'task': None, 'result_host': None, 'result_level': None,
+                                                  'stream': 'stdout'}
+            # Finished deployments are never told apart here; the least recently logging ones go first
+            while len(self._state) > self.max_deployments:
+                self._state.popitem(last=False)
+        else:
+            self._state.move_to_end(deployment_id)
+        stripped = text.strip()
+        host = None
+        level = 'info'
+
+        if stripped == '=== ANSIBLE STDERR ===':
+            state['stream'] = 'stderr'
+        elif stripped == '=== ANSIBLE OUTPUT ===':
+            state['stream'] = 'stdout'
+        stream = 'stderr' if stripped.startswith('STDERR:') else state['stream']
+
+        match = _TASK_HEADER.match(stripped)
+        if match:
+            state['task'] = match.group(1)
+            state['result_host'] = None
+            return None, state['task'], level, stream
+        if _PLAY_HEADER.match(stripped):
+            state['task'] = None
+            state['result_host'] = None
+            return None, None, level, stream
+
+        match = _HOST_RESULT.match(stripped)
+        if match:
+            host = match.group(2)
+            level = _RESULT_LEVELS.get(match.group(1), 'info')
+            state['result_host'], state['result_level'] = host, level
+            return host, state['task'], level, stream
+        match = _HOST_RETRY.match(stripped)
+        if match:
+            state['result_host'] = None
+            return match.group(1), state['task'], 'warning', stream
+        match = _HOST_RECAP.match(stripped)
+        if match:
+            failed = int(match.group(2)) or int(match.group(3))
+            return match.group(1), None, 'error' if failed else 'info', stream
+        match = _HOST_VERBOSE.match(stripped)
+        if match:
+            return match.group(1), state['task'], 'debug', stream
+
+        if state['result_host'] is not None and _CONTINUATION.match(stripped):
+            return state['result_host'], state['task'], state['result_level'], stream
+        state['result_host'] = None
+
+        if stripped.startswith(('ERROR', 'FATAL')):
+            level = 'error'
+        elif stripped.startswith(('[WARNING]', '[DEPRECATION WARNING]', 'WARNING')):
+            level = 'warning'
+        elif stripped.startswith(_DEBUG_PREFIXES):
+            level = 'debug'
+        return None, state['task'], level, stream
+
+    def forget(self, deployment_id):
+        self._state.pop(deployment_id, None)
+
+    def clear(self):
+        self._state.clear()
+
+
+class LogSearchError(ValueError):
+    """A search query FTS5 cannot parse"""
+
+
+# What FTS5 reports for a query it cannot parse; any other OperationalError (a locked database, a disk
+# error) is not the query's fault
+FTS_QUERY_ERRORS = ('fts5: syntax error', 'no such column', 'unterminated string', 'unknown special query')
+
+
+def is_query_error(error):
+    """Whether an OperationalError from a MATCH comes from the search query rather than the database"""
+    message = str(error)
+    return any(marker in message for marker in FTS_QUERY_ERRORS)
+
+
+def quote_search_terms(query):
+    """The query with every whitespace-separated term quoted, so punctuation is matched literally"""
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+class LogRecordStore:
+    """SQLite (WAL) store of structured log records, indexed for filtering and full-text search.
+
+    Every log line becomes a row ``(seq, ts, host, task, level, stream,
+    text)``, where ``seq`` is its line number. Lines are parsed once, when
+    the history flusher writes them to their segment. Indexes on
+    ``(deployment_id, host|level|task, seq)`` answer ``host=``/``level=``/
+    ``task=`` filters with index range reads instead of scanning the log.
+    An FTS5 table over the texts, maintained by triggers, answers
+    ``search()`` across all deployments; ``log_deployments`` holds the
+    type and time of each deployment for its filters. The log segments
+    stay the canonical copy of the text.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.parser = AnsibleLogParser()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        had_search = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'log_search'").fetchone()
+        conn.executescript(SEARCH_SCHEMA)
+        if not had_search:
+            # Records stored before the search index existed
+            conn.execute("INSERT INTO log_search (log_search) VALUES ('rebuild')")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def append(self, deployment_id, entries, kind=None, timestamp=None):
+        """Parse and store ``(seq, ts, text)`` log lines of a deployment, in the order they were logged.
+
+        ``kind`` and ``timestamp`` (the deployment's type and sort timestamp)
+        are recorded with its first lines, for the search filters.
+        """
+        rows = []
+        for seq, ts, text in entries:
+            text = text if isinstance(text, str) else str(text)
+            host, task, level, stream = self.parser.parse(deployment_id, text)
+            rows.append((deployment_id, seq, ts, host, task, level, stream, text))
+        if not rows:
+            return
+        conn = self._connection()
+        with conn:
+            # Taken at once so no other process adds records between reading the last id and indexing after it
+            conn.execute('BEGIN IMMEDIATE')
+            last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM log_records').fetchone()[0]
+            # Lines indexed before (a backfill racing the flusher) keep their first record
+            conn.executemany('INSERT OR IGNORE INTO log_records (deployment_id, seq, ts, host, task, level, stream, text) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.execute('INSERT OR IGNORE INTO log_deployments (deployment_id, type, timestamp) VALUES (?, ?, ?)',
+                         (deployment_id, kind, rows[0][2] if timestamp is None else timestamp))
+            conn.execute('INSERT INTO log_search (rowid, text) SELECT id, text FROM log_records WHERE id > ?',
+                         (last_id,))
+
+    def indexed_count(self, deployment_id):
+        """Number of the deployment's lines stored so far (one past the highest seq)"""
+        row = self._connection().execute('SELECT MAX(seq) FROM log_records WHERE deployment_id = ?',
+                                         (deployment_id,)).fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def query(self, deployment_id, filters=None, after=None, limit=None, tail=None):
+        """Records of a deployment matching ``filters`` in line order, as dicts.
+
+        ``filters`` maps RECORD_FILTERS keys to a value or a list of values.
+        ``after`` skips lines up to that seq; ``tail`` returns the last N
+        matches instead of the first ``limit``.
+        """
+        clauses = ['deployment_id = ?']
+        params = [deployment_id]
+        for key, value in (filters or {}).items():
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            clauses.append(f"{key} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        if after is not None:
+            clauses.append('seq > ?')
+            params.append(after)
+        sql = 'SELECT seq, ts, host, task, level, stream, text FROM log_records WHERE ' + ' AND '.join(clauses)
+        if tail is not None:
+            sql += ' ORDER BY seq DESC LIMIT ?'
+            params.append(max(tail, 0))
+        else:
+            sql += ' ORDER BY seq'
+            if limit is not None:
+                sql += ' LIMIT ?'
+                params.append(max(limit, 0))
+        records = [dict(row) for row in self._connection().execute(sql, params)]
+        if tail is not None:
+            records.reverse()
+        return records
+
+    def search(self, query, since=None, until=None, kinds=None, filters=None, sort='rank', limit=50, offset=0):
+        """Log lines of all deployments matching an FTS5 query, best matches first.
+
+        ``query`` uses FTS5 syntax (``"permission denied"`` is a phrase,
+        ``AND``/``OR``/``NOT`` and ``prefix*`` work); a query FTS5 cannot
+        parse is retried with each term quoted. ``since``/``until`` bound
+        the line timestamps, ``kinds`` lists deployment types and
+        ``filters`` takes RECORD_FILTERS like ``query()``. ``sort='recent'``
+        orders newest first instead of by relevance. Raises LogSearchError
+        for a query that still does not parse; other database errors are
+        raised as they are.
+        """
+        clauses = ['log_search MATCH ?']
+        params = [query]
+        if since is not None:
+            clauses.append('r.ts >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('r.ts < ?')
+            params.append(until)
+        if kinds:
+            clauses.append(f"d.type IN ({', '.join('?' * len(kinds))})")
+            params.extend(kinds)
+        for key, value in (filters or {}).items():
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple)) else [value]
+            clauses.append(f"r.{key} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        sql = ('SELECT r.deployment_id, d.type, r.seq, r.ts, r.host, r.task, r.level, r.stream, r.text, '
+               "snippet(log_search, 0, '«', '»', '...', 16) AS snippet, bm25(log_search) AS score "
+               'FROM log_search JOIN log_records r ON r.id = log_search.rowid '
+               'LEFT JOIN log_deployments d ON d.deployment_id = r.deployment_id '
+               'WHERE ' + ' AND '.join(clauses))
+        # Records are numbered as they are indexed, so the newest come first without sorting every match
+        sql += ' ORDER BY log_search.rowid DESC' if sort == 'recent' else ' ORDER BY rank'
+        sql += ' LIMIT ? OFFSET ?'
+        params.extend([min(max(limit, 0), LOG_SEARCH_MAX_LIMIT), max(offset, 0)])
+        conn = self._connection()
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        except sqlite3.OperationalError as e:
+            if not is_query_error(e):
+                raise
+            quoted = quote_search_terms(query)
+            if not quoted or quoted == query:
+                raise LogSearchError(str(e))
+        params[0] = quoted
+        try:
+            return [dict(row) for row in conn.execute(sql, params)]
+        except sqlite3.OperationalError as e:
+            if not is_query_error(e):
+                raise
+            raise LogSearchError(str(e))
+
+    def delete(self, deployment_id):
+        self.parser.forget(deployment_id)
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM log_records WHERE deployment_id = ?', (deployment_id,))
+            conn.execute('DELETE FROM log_deployments WHERE deployment_id = ?', (deployment_id,))
+
+    def delete_before(self, cutoff):
+        """Drop the records of deployments whose timestamp is before ``cutoff``; returns how many deployments"""
+        conn = self._connection()
+        with conn:
+            ids = [row[0] for row in conn.execute('SELECT deployment_id FROM log_deployments WHERE timestamp < ?',
+                                                  (cutoff,))]
+            conn.executemany('DELETE FROM log_records WHERE deployment_id = ?', [(d,) for d in ids])
+            conn.execute('DELETE FROM log_deployments WHERE timestamp < ?', (cutoff,))
+        return len(ids)
+
+    def get_meta(self, key):
+        row = self._connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def set_meta(self, key, value):
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def clear(self):
+        self.parser.clear()
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM log_records')
+            conn.execute('DELETE FROM log_deployments')
+
+
+def parse_log_records(lines, first_seq=0, ts=0):
+    """Structured records of log lines that are not in a LogRecordStore (archived deployments)"""
+    parser = AnsibleLogParser()
+    records = []
+    for offset, text in enumerate(lines):
+        text = text if isinstance(text, str) else str(text)
+        host, task, level, stream = parser.parse(None, text)
+        records.append({'seq': first_seq + offset, 'ts': ts, 'host': host, 'task': task, 'level': level,
+                        'stream': stream, 'text': text})
+    return records
+
+
+def matches_record_filters(record, filters):
+    """Whether a record dict passes the same filters as LogRecordStore.query()"""
+    for key, value in (filters or {}).items():
+        if value is None:
+            continue
+        values = value if isinstance(value, (list, tuple)) else [value]
+        if record.get(key) not in values:
+            return False
+    return True
@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import shutil
+from itertools import islice
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.storage')
+
+# Deployment IDs are UUIDs; anything else must not escape the segment directory
+_SAFE_ID = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+class LogSegmentStore:
+    """Append-only per-deployment log files kept apart from the history metadata.
+
+    Each deployment gets ``<base_dir>/<deployment_id>.log`` holding one
+    JSON-encoded line per log message, so multi-line messages stay intact and
+    a segment can be read without loading any other deployment.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    def path(self, deployment_id):
+        if not _SAFE_ID.match(deployment_id or ''):
+            raise ValueError(f"Invalid deployment ID for log segment: {deployment_id!r}")
+        return os.path.join(self.base_dir, f'{deployment_id}.log')
+
+    def exists(self, deployment_id):
+        return os.path.exists(self.path(deployment_id))
+
+    def append(self, deployment_id, messages):
+        """Append log messages to the deployment's segment"""
+        if not messages:
+            return
+        data = ''.join(json.dumps(message, default=str) + '\n' for message in messages)
+        with open(self.path(deployment_id), 'a', encoding='utf-8') as f:
+            f.write(data)
+
+    def read(self, deployment_id, start=0, end=None):
+        """Log messages ``start``..``end`` of a deployment (all by default; empty if it has no segment)"""
+        try:
+            f = open(self.path(deployment_id), 'r', encoding='utf-8')
+        except (FileNotFoundError, ValueError):
+            return []
+        messages = []
+        with f:
+            for line in islice(f, start, end):
+                try:
+                    messages.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn last line after a crash
+                    logger.warning("Skipping unreadable log line in segment for %s", deployment_id)
+        return messages
+
+    def read_last(self, deployment_id, count, chunk_size=64 * 1024):
+        """The last ``count`` log messages of a deployment, reading the segment backwards from its end"""
+        try:
+            f = open(self.path(deployment_id), 'rb')
+        except (FileNotFoundError, ValueError):
+            return []
+        if count <= 0:
+            f.close()
+            return []
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            data = b''
+            # One newline more than needed, so the first kept line is complete
+            while position > 0 and data.count(b'\n') <= count:
+                step = min(chunk_size, position)
+                position -= step
+                f.seek(position)
+                data = f.read(step) + data
+        lines = data.split(b'\n')
+        if position > 0:
+            lines = lines[1:]
+        messages = []
+        for line in lines[-count - 1:]:
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("Skipping unreadable log line in segment for %s", deployment_id)
+        return messages[-count:]
+
+    def delete(self, deployment_id):
+        try:
+            os.remove(self.path(deployment_id))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def clear(self):
+        shutil.rmtree(self.base_dir, ignore_errors=True)
+        os.makedirs(self.base_dir, exist_ok=True)
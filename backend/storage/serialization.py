@@ -0,0 +1,151 @@
+"""Encodings for the deployment history snapshot.
+
+A format is an encoding (``json`` or ``msgpack``) optionally followed by a
+compression (``gzip`` or ``zstd``), e.g. ``json``, ``json+gzip`` or
+``msgpack+zstd``. Snapshots are written in ``HISTORY_SNAPSHOT_FORMAT`` and
+read in whatever format they were written in (detected from the content),
+so changing the setting migrates the history at the next compaction.
+
+``orjson``, ``msgpack`` and ``zstandard`` are optional: JSON falls back to
+the standard library encoder, and formats needing a missing package are
+rejected by ``parse_format``.
+"""
+import gzip
+import io
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Format of newly written history snapshots
+HISTORY_SNAPSHOT_FORMAT = os.environ.get('HISTORY_SNAPSHOT_FORMAT', 'json')
+
+ENCODINGS = ('json', 'msgpack')
+COMPRESSIONS = ('gzip', 'zstd')
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class SnapshotFormatError(ValueError):
+    """A snapshot could not be decoded"""
+
+
+def json_dumps(obj):
+    """Compact JSON as bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_format(name):
+    """Split a format name into (encoding, compression); raises ValueError if it cannot be used"""
+    encoding, _, compression = (name or 'json').lower().partition('+')
+    compression = compression or None
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown history encoding {encoding!r} (expected one of {', '.join(ENCODINGS)})")
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown history compression {compression!r} (expected one of {', '.join(COMPRESSIONS)})")
+    if encoding == 'msgpack' and msgpack is None:
+        raise ValueError("History format msgpack needs the msgpack package")
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("History compression zstd needs the zstandard package")
+    return encoding, compression
+
+
+def available_formats():
+    """Every format usable with the installed packages"""
+    formats = []
+    for encoding in ENCODINGS:
+        for compression in (None,) + COMPRESSIONS:
+            name = encoding + ('+' + compression if compression else '')
+            try:
+                parse_format(name)
+            except ValueError:
+                continue
+            formats.append(name)
+    return formats
+
+
+def write_snapshot(f, rows, fmt=HISTORY_SNAPSHOT_FORMAT):
+    """Write (deployment_id, metadata JSON text) rows to the binary file ``f``; returns the row count.
+
+    JSON is streamed row by row without decoding the metadata; msgpack has to
+    decode every row first.
+    """
+    encoding, compression = parse_format(fmt)
+    if compression == 'gzip':
+        out = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6)
+    elif compression == 'zstd':
+        out = zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+    else:
+        out = f
+
+    count = 0
+    if encoding == 'json':
+        out.write(b'{')
+        for deployment_id, data in rows:
+            out.write(b',\n' if count else b'\n')
+            out.write(json_dumps(deployment_id) + b': ' + data.encode('utf-8'))
+            count += 1
+        out.write(b'\n}\n')
+    else:
+        snapshot = {deployment_id: json_loads(data) for deployment_id, data in rows}
+        out.write(msgpack.packb(snapshot, default=str, use_bin_type=True))
+        count = len(snapshot)
+
+    if out is not f:
+        # Finishes the compressed stream; ``f`` itself stays open
+        out.close()
+    return count
+
+
+def decode_snapshot(data):
+    """Decode snapshot bytes written in any supported format"""
+    try:
+        if data.startswith(_GZIP_MAGIC):
+            data = gzip.decompress(data)
+        elif data.startswith(_ZSTD_MAGIC):
+            if zstandard is None:
+                raise SnapshotFormatError("History snapshot is zstd-compressed but zstandard is not installed")
+            data = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)).read()
+
+        stripped = data.lstrip()
+        if not stripped or stripped[:1] == b'{':
+            snapshot = json_loads(stripped or b'{}')
+        elif msgpack is None:
+            raise SnapshotFormatError("History snapshot is msgpack-encoded but msgpack is not installed")
+        else:
+            snapshot = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    except SnapshotFormatError:
+        raise
+    except Exception as e:
+        raise SnapshotFormatError(f"Unreadable history snapshot: {str(e)}") from e
+    if not isinstance(snapshot, dict):
+        raise SnapshotFormatError("History snapshot does not hold a deployments mapping")
+    return snapshot
+
+
+def read_snapshot(path):
+    """Load a snapshot file, detecting its format"""
+    with open(path, 'rb') as f:
+        return decode_snapshot(f.read())
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import re
+import threading
+import logging
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from streaming.log_stream_hub import (FOREIGN_LOG_POLL_INTERVAL, LOCAL_LOG_WAIT_INTERVAL, SSE_BATCH_WINDOW,
+                                      StreamLimitError, sse_event)
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.streaming')
+
+# Port of the asyncio log stream server; 0 keeps serving log streams from the waitress worker threads
+LOG_STREAM_ASYNC_PORT = int(os.environ.get('LOG_STREAM_ASYNC_PORT', 0))
+# URL browsers reach that server at, e.g. https://orchestrator.example.com:5001 (default: request host, async port)
+LOG_STREAM_PUBLIC_URL = os.environ.get('LOG_STREAM_PUBLIC_URL', '')
+
+_LOG_PATH = re.compile(r'^/api/(deploy|command)/([^/]+)/logs$')
+# Bytes allowed for a request line plus headers
+_MAX_REQUEST_HEAD = 16 * 1024
+_REQUEST_HEAD_TIMEOUT = 10
+
+_CORS_HEADERS = ('Access-Control-Allow-Origin: *\r\n'
+                 'Access-Control-Allow-Headers: Accept, Cache-Control, Last-Event-ID\r\n'
+                 'Access-Control-Allow-Methods: GET, OPTIONS\r\n')
+
+
+def _response_head(status, content_type=None, extra=''):
+    head = f'HTTP/1.1 {status}\r\n{_CORS_HEADERS}Connection: close\r\n'
+    if content_type:
+        head += f'Content-Type: {content_type}\r\n'
+    return (head + extra + '\r\n').encode('latin-1')
+
+
+def _parse_request_head(data):
+    """(method, target, {lower-case header: value}) of an HTTP request head"""
+    lines = data.decode('latin-1').split('\r\n')
+    method, target, _ = lines[0].split(' ', 2)
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return method, target, headers
+
+
+class AsyncLogServer:
+    """Serves the SSE log streams from one asyncio event loop in a background thread.
+
+    Every open stream costs a coroutine instead of a waitress worker thread,
+    so viewers no longer compete with API requests. The streams are the same
+    ``LogStream`` objects the WSGI endpoints use: they count against the same
+    hub limits and stats and read the same registry and log buffers. Only the
+    waiting differs. A registry listener wakes the coroutines following a
+    deployment, and streams of deployments run by other processes poll.
+
+    Handles ``GET /api/deploy/<id>/logs`` and ``GET /api/command/<id>/logs``
+    (plus CORS preflights); the Flask endpoints redirect event-stream
+    requests here.
+    """
+
+    def __init__(self, hub, host='0.0.0.0', port=LOG_STREAM_ASYNC_PORT):
+        self.hub = hub
+        self.registry = hub.registry
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._thread = None
+        # {deployment_id: asyncio.Events of the coroutines waiting for it}; only touched on the loop
+        self._waiters = {}
+        self.registry.add_listener(self._on_change)
+
+    def start(self):
+        """Start the server thread; returns once the port is bound"""
+        if self._thread is not None:
+            return
+        started = threading.Event()
+        failure = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                server = loop.run_until_complete(
+                    asyncio.start_server(self._handle, self.host, self.port, limit=_MAX_REQUEST_HEAD))
+            except Exception as e:
+                failure.append(e)
+                started.set()
+                return
+            self.port = server.sockets[0].getsockname()[1]
+            self._loop = loop
+            started.set()
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='async-log-server', daemon=True)
+        self._thread.start()
+        started.wait()
+        if failure:
+            raise failure[0]
+        logger.info("Serving log streams asynchronously on %s:%s", self.host, self.port)
+
+    def _on_change(self, deployment_id):
+        # Called from worker threads; only the event loop may touch the asyncio events
+        if self._loop is not None and deployment_id in self._waiters:
+            self._loop.call_soon_threadsafe(self._wake, deployment_id)
+
+    def _wake(self, deployment_id):
+        for event in self._waiters.get(deployment_id, ()):
+            event.set()
+
+    async def _wait(self, stream):
+        timeout = stream.wait_timeout()
+        deployment_id = stream.deployment_id
+        if not self.registry.is_local(deployment_id):
+            await asyncio.sleep(min(timeout, FOREIGN_LOG_POLL_INTERVAL))
+            return
+        event = asyncio.Event()
+        waiters = self._waiters.setdefault(deployment_id, set())
+        waiters.add(event)
+        try:
+            if self.registry.version(deployment_id) == stream.version:
+                try:
+                    await asyncio.wait_for(event.wait(), min(timeout, LOCAL_LOG_WAIT_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            waiters.discard(event)
+            if not waiters:
+                self._waiters.pop(deployment_id, None)
+
+    async def _pump(self, stream, writer):
+        loop = asyncio.get_running_loop()
+        while not stream.done:
+            # advance() takes the deployment's lock and may read log segments (lines that left the
+            # in-memory tail, records of other processes); never block the loop on it
+            text, more = await loop.run_in_executor(None, self.hub.advance, stream)
+            if text:
+                writer.write(text.encode('utf-8'))
+                # Applies backpressure: a slow client holds the coroutine, not an unbounded buffer
+                await writer.drain()
+            if more or stream.done:
+                continue
+            await self._wait(stream)
+            if stream.batch:
+                await asyncio.sleep(SSE_BATCH_WINDOW)
+
+    @staticmethod
+    async def _until_disconnected(reader):
+        while await reader.read(1024):
+            pass
+
+    async def _handle(self, reader, writer):
+        stream = None
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), _REQUEST_HEAD_TIMEOUT)
+                method, target, headers = _parse_request_head(head)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+                writer.write(_response_head('400 Bad Request'))
+                return
+            if method == 'OPTIONS':
+                writer.write(_response_head('204 No Content'))
+                return
+
+            url = urlsplit(target)
+            match = _LOG_PATH.match(url.path)
+            if method != 'GET' or not match:
+                body = json.dumps({'error': 'Not found'})
+                writer.write(_response_head('404 Not Found', 'application/json') + body.encode('utf-8'))
+                return
+            kind, deployment_id = match.group(1), unquote(match.group(2))
+            query = parse_qs(url.query)
+
+            loop = asyncio.get_running_loop()
+            record = await loop.run_in_executor(None, self.hub.get_record, deployment_id)
+            if record is None:
+                error = 'Deployment not found' if kind == 'deploy' else 'Command not found'
+                writer.write(_response_head('200 OK', 'text/event-stream') + sse_event({'error': error}).encode('utf-8'))
+                return
+
+            # Last-Event-ID from a reconnecting EventSource, or carried over by the Flask redirect
+            last_event_id = headers.get('last-event-id') or query.get('last_event_id', [''])[0]
+            try:
+                start = max(int(last_event_id) + 1, 0)
+            except ValueError:
+                start = 0
+            batch = query.get('batch', [''])[0].lower() in ('1', 'true', 'yes')
+            try:
+                stream = self.hub.open(deployment_id, record, start, batch)
+            except StreamLimitError as e:
+                logger.warning("Rejected log stream for %s: %s", deployment_id, e)
+                body = json.dumps({'error': str(e)})
+                writer.write(_response_head('429 Too Many Requests', 'application/json') + body.encode('utf-8'))
+                return
+
+            writer.write(_response_head('200 OK', 'text/event-stream', 'Cache-Control: no-cache\r\n'))
+            pump = asyncio.ensure_future(self._pump(stream, writer))
+            disconnected = asyncio.ensure_future(self._until_disconnected(reader))
+            done, pending = await asyncio.wait({pump, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            # Both can end with a reset connection; retrieve every exception so none is reported as unhandled
+            if disconnected in done:
+                disconnected.exception()
+            if pump in done:
+                pump.result()
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.error("Error serving async log stream: %s", e)
+        finally:
+            if stream is not None:
+                stream.close()
+            try:
+                writer.close()
+            except Exception:
+                pass
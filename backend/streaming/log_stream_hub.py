@@ -0,0 +1,263 @@
+import json
+import os
+import threading
+import time
+import logging
+
+from storage.deployment_registry import FINISHED_STATUSES
+from storage.serialization import json_dumps
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator.streaming')
+
+# Open log streams allowed in total and per deployment; further viewers get HTTP 429
+LOG_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('LOG_STREAM_MAX_SUBSCRIBERS', 200))
+LOG_STREAM_MAX_PER_DEPLOYMENT = int(os.environ.get('LOG_STREAM_MAX_PER_DEPLOYMENT', 20))
+# Seconds without a new line before a stream is closed; EventSource reconnects and resumes by itself
+LOG_STREAM_IDLE_TIMEOUT = float(os.environ.get('LOG_STREAM_IDLE_TIMEOUT', 600))
+# Seconds between keepalive comments; writing them is also how vanished clients are noticed
+LOG_STREAM_HEARTBEAT = float(os.environ.get('LOG_STREAM_HEARTBEAT', 15))
+# Most lines read and sent to one viewer at a time, however far behind it is
+LOG_STREAM_MAX_SEND_LINES = int(os.environ.get('LOG_STREAM_MAX_SEND_LINES', 1000))
+# Batched streams (?batch=1) collect lines for this many seconds after a wakeup before sending them
+SSE_BATCH_WINDOW = float(os.environ.get('SSE_BATCH_WINDOW', 0.05))
+# Most log lines carried by one batched event
+SSE_BATCH_MAX_LINES = int(os.environ.get('SSE_BATCH_MAX_LINES', 500))
+
+# Deployments run by other processes (shared backend) change without notifying this one, so their streams poll
+FOREIGN_LOG_POLL_INTERVAL = 1
+# Upper bound on a wait for local changes, in case a record was changed without going through the registry
+LOCAL_LOG_WAIT_INTERVAL = 15
+
+HEARTBEAT_EVENT = ': keepalive\n\n'
+
+
+class StreamLimitError(Exception):
+    """Too many log streams are open"""
+
+
+def sse_event(data):
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def sse_log_event(line_number, message):
+    """SSE event for one log line; its id is the line number so a reconnect can resume after it"""
+    return f"id: {line_number}\ndata: {json.dumps({'message': message})}\n\n"
+
+
+def sse_log_events(first_line_number, lines, batch):
+    """SSE text for consecutive log lines.
+
+    Without ``batch`` every line is its own ``{"message": ...}`` event. With it
+    up to SSE_BATCH_MAX_LINES lines share one ``{"seq": <first line number>,
+    "messages": [...]}`` event whose id is the number of its last line.
+    """
+    if not batch:
+        return ''.join(sse_log_event(first_line_number + i, line) for i, line in enumerate(lines))
+    events = []
+    for i in range(0, len(lines), SSE_BATCH_MAX_LINES):
+        chunk = lines[i:i + SSE_BATCH_MAX_LINES]
+        seq = first_line_number + i
+        data = json_dumps({'seq': seq, 'messages': chunk}).decode('utf-8')
+        events.append(f"id: {seq + len(chunk) - 1}\ndata: {data}\n\n")
+    return ''.join(events)
+
+
+class LogStream:
+    """One viewer's SSE stream of a deployment's log.
+
+    Iterating yields the SSE text, blocking between changes (the WSGI path).
+    The async server drives the same stream with ``LogStreamHub.advance()``
+    instead. ``close()`` (called by the WSGI server when the response ends or
+    the client goes away) gives the slot back to the hub, even if the stream
+    was never iterated.
+    """
+
+    def __init__(self, hub, deployment_id, record, start, batch):
+        self.hub = hub
+        self.deployment_id = deployment_id
+        self.record = record
+        # Read before any line: a deployment that is already finished has all its lines in the first reads
+        self.initial_status = record.get('status', 'running')
+        self.position = start
+        self.batch = batch
+        self.opened = time.time()
+        self.started = False
+        self.done = False
+        self.version = 0
+        self.last_activity = self.next_heartbeat = time.monotonic()
+        self._events = hub._events(self)
+        self._closed = False
+
+    def wait_timeout(self):
+        """Seconds until the stream needs a heartbeat or reaches its idle timeout"""
+        deadline = min(self.next_heartbeat, self.last_activity + self.hub.idle_timeout)
+        return max(deadline - time.monotonic(), 0)
+
+    def __iter__(self):
+        return self._events
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._events.close()
+        self.hub._release(self)
+
+
+class LogStreamHub:
+    """Serves every SSE log stream of the app and keeps them in check.
+
+    Streams wait on the registry's change notifications. Each viewer only
+    holds a line number: lines are read from the deployment's bounded
+    in-memory tail (or its log segment) at most ``max_send_lines`` at a
+    time, so a slow viewer falls behind on disk instead of buffering the
+    backlog in memory. ``open()`` enforces the total and per-deployment
+    subscriber caps. Streams without new lines for ``idle_timeout`` seconds
+    are closed, and idle streams get a keepalive comment every
+    ``heartbeat_interval`` seconds, so connections of vanished clients fail
+    and are released.
+
+    ``get_record(id)`` returns a deployment record or None and
+    ``read_lines(id, record, start, end)`` returns its log lines.
+    """
+
+    def __init__(self, registry, get_record, read_lines, max_subscribers=LOG_STREAM_MAX_SUBSCRIBERS,
+                 max_per_deployment=LOG_STREAM_MAX_PER_DEPLOYMENT, idle_timeout=LOG_STREAM_IDLE_TIMEOUT,
+                 heartbeat_interval=LOG_STREAM_HEARTBEAT, max_send_lines=LOG_STREAM_MAX_SEND_LINES):
+        self.registry = registry
+        self.get_record = get_record
+        self.read_lines = read_lines
+        self.max_subscribers = max_subscribers
+        self.max_per_deployment = max_per_deployment
+        self.idle_timeout = idle_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.max_send_lines = max_send_lines
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._count = 0
+        self.opened = 0
+        self.rejected = 0
+        self.idle_closed = 0
+
+    def open(self, deployment_id, record, start=0, batch=False):
+        """Register a viewer of a deployment; raises StreamLimitError when a cap is reached"""
+        with self._lock:
+            viewers = self._streams.setdefault(deployment_id, set())
+            if self._count >= self.max_subscribers or len(viewers) >= self.max_per_deployment:
+                self.rejected += 1
+                if not viewers:
+                    del self._streams[deployment_id]
+                limit = 'total' if self._count >= self.max_subscribers else 'per-deployment'
+                raise StreamLimitError(f"Too many open log streams ({limit} limit reached)")
+            stream = LogStream(self, deployment_id, record, start, batch)
+            viewers.add(stream)
+            self._count += 1
+            self.opened += 1
+        return stream
+
+    def _release(self, stream):
+        with self._lock:
+            viewers = self._streams.get(stream.deployment_id)
+            if viewers is None or stream not in viewers:
+                return
+            viewers.discard(stream)
+            if not viewers:
+                del self._streams[stream.deployment_id]
+            self._count -= 1
+
+    def wait_for_change(self, deployment_id, seen_version, timeout):
+        """Block until the deployment changed after ``seen_version``; returns the new version"""
+        if self.registry.is_local(deployment_id):
+            timeout = min(timeout, LOCAL_LOG_WAIT_INTERVAL)
+        else:
+            timeout = min(timeout, FOREIGN_LOG_POLL_INTERVAL)
+        return self.registry.wait_for_change(deployment_id, seen_version, max(timeout, 0))
+
+    def _send_lines(self, stream, record):
+        """SSE text for the next lines of the stream (at most max_send_lines), and how many there were"""
+        position = stream.position
+        lines = self.read_lines(stream.deployment_id, record, position, position + self.max_send_lines)
+        stream.position += len(lines)
+        return (sse_log_events(position, lines, stream.batch) if lines else ''), len(lines)
+
+    def advance(self, stream):
+        """Everything a stream has to send right now, without blocking.
+
+        Returns ``(text, more)``; ``more`` means further lines are waiting and
+        the caller should advance again before waiting for changes. Sets
+        ``stream.done`` when the stream has ended. Callers wait for a change
+        after ``stream.version`` (or ``stream.wait_timeout()``) in between.
+        """
+        deployment_id = stream.deployment_id
+        # Taken before reading, so a change made during the reads below ends the next wait at once
+        stream.version = self.registry.version(deployment_id)
+        if not stream.started:
+            # Catching up on the lines that existed when the stream was opened
+            text, sent = self._send_lines(stream, stream.record)
+            if sent == self.max_send_lines:
+                return text, True
+            stream.started = True
+            text += sse_event({'status': stream.initial_status})
+            if stream.initial_status in FINISHED_STATUSES:
+                logger.info("Deployment %s is already completed with status: %s", deployment_id, stream.initial_status)
+                stream.done = True
+            stream.last_activity = time.monotonic()
+            stream.next_heartbeat = stream.last_activity + self.heartbeat_interval
+            return text, False
+
+        record = self.get_record(deployment_id)
+        if record is None:
+            # Deleted (or archived) while being watched
+            stream.done = True
+            return '', False
+        status = record.get('status', 'running')
+        text, sent = self._send_lines(stream, record)
+        now = time.monotonic()
+        if text:
+            stream.last_activity = now
+            stream.next_heartbeat = now + self.heartbeat_interval
+            if sent == self.max_send_lines:
+                return text, True
+
+        if status in FINISHED_STATUSES:
+            stream.done = True
+            return text + sse_event({'status': status}), False
+        if now - stream.last_activity >= self.idle_timeout:
+            with self._lock:
+                self.idle_closed += 1
+            logger.warning("SSE stream timeout for deployment %s", deployment_id)
+            stream.done = True
+            return text + sse_event({'error': 'Stream timeout'}), False
+        if now >= stream.next_heartbeat:
+            stream.next_heartbeat = now + self.heartbeat_interval
+            if not text:
+                text = HEARTBEAT_EVENT
+        return text, False
+
+    def _events(self, stream):
+        while not stream.done:
+            text, more = self.advance(stream)
+            if text:
+                yield text
+            if more or stream.done:
+                continue
+            # Woken by log_message/status changes as soon as they happen
+            self.wait_for_change(stream.deployment_id, stream.version, stream.wait_timeout())
+            if stream.batch:
+                # Let the lines of a burst pile up so they go out as one event
+                time.sleep(SSE_BATCH_WINDOW)
+
+    def stats(self):
+        """Subscriber counts for monitoring"""
+        with self._lock:
+            per_deployment = {deployment_id: len(viewers) for deployment_id, viewers in self._streams.items()}
+            return {
+                'subscribers': self._count,
+                'max_subscribers': self.max_subscribers,
+                'max_per_deployment': self.max_per_deployment,
+                'per_deployment': per_deployment,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'idle_closed': self.idle_closed,
+            }
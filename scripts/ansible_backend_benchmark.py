@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Run the same file deployment playbook through each ansible execution backend and compare run times.
+
+The playbook copies ``--files`` files to every host of a 1-host and a
+``--hosts``-host inventory, over ``ansible_connection=local`` so no SSH is
+needed. ``subprocess`` starts ``ansible-playbook`` per run (the default
+backend); ``worker`` runs it in a fork of the long-lived worker;
+``ansible-runner`` is included when the package is installed. Each
+backend runs the playbook ``--repeats`` times per inventory. The report
+shows the first run (which, for the worker, includes starting it), the
+median of the others, and the number of events the backend reported for
+the last run (ansible-runner counts its own event types).
+
+    python scripts/ansible_backend_benchmark.py [--hosts 20] [--files 3] [--repeats 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from execution.ansible_executor import SubprocessExecutor, WorkerExecutor, ansible_python, event_environment
+
+PLAYBOOK = """---
+- name: Deploy files
+  hosts: all
+  gather_facts: false
+  tasks:
+    - name: Create target directory
+      file:
+        path: "{{ target_root }}/{{ inventory_hostname }}"
+        state: directory
+    - name: Copy files
+      copy:
+        src: "{{ item }}"
+        dest: "{{ target_root }}/{{ inventory_hostname }}/"
+      loop: "{{ files }}"
+"""
+
+
+def write_fixtures(directory, hosts, files):
+    python = ansible_python()
+    sources = []
+    for n in range(files):
+        path = os.path.join(directory, f'file{n}.conf')
+        with open(path, 'w') as f:
+            f.write(f'setting_{n} = value\n' * 200)
+        sources.append(path)
+    playbook = os.path.join(directory, 'deploy.yml')
+    with open(playbook, 'w') as f:
+        f.write(PLAYBOOK)
+    inventories = {}
+    for count in sorted({1, hosts}):
+        inventory = os.path.join(directory, f'inventory_{count}')
+        with open(inventory, 'w') as f:
+            f.write('[all]\n')
+            for n in range(count):
+                f.write(f'vm{n:02d} ansible_connection=local ansible_python_interpreter={python}\n')
+        inventories[count] = inventory
+    extra_vars = json.dumps({'target_root': os.path.join(directory, 'target'), 'files': sources})
+    return playbook, inventories, extra_vars
+
+
+def run_executor(executor, args, env):
+    events = []
+    lines = []
+    started = time.perf_counter()
+    rc = executor.run(args, env, lines.append, events.append)
+    elapsed = time.perf_counter() - started
+    if rc != 0:
+        sys.exit(f'{executor.name} run failed with exit code {rc}:\n' + '\n'.join(lines[-20:]))
+    return elapsed, len(events)
+
+
+def run_ansible_runner(playbook, inventory, extra_vars, env, directory):
+    import ansible_runner
+    events = []
+    private_data_dir = os.path.join(directory, 'runner')
+    os.makedirs(private_data_dir, exist_ok=True)
+    started = time.perf_counter()
+    result = ansible_runner.run(private_data_dir=private_data_dir, playbook=playbook, inventory=inventory,
+                                extravars=json.loads(extra_vars), envvars=env, quiet=True,
+                                event_handler=lambda event: events.append(event) or True)
+    elapsed = time.perf_counter() - started
+    if result.rc != 0:
+        sys.exit(f'ansible-runner run failed with exit code {result.rc}')
+    return elapsed, len(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--backends', nargs='+', choices=('subprocess', 'worker', 'ansible-runner'),
+                        default=['subprocess', 'worker', 'ansible-runner'])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='ansible_backend_')
+    playbook, inventories, extra_vars = write_fixtures(directory, args.hosts, args.files)
+    env = dict(os.environ, ANSIBLE_HOST_KEY_CHECKING='False', ANSIBLE_RETRY_FILES_ENABLED='False')
+    backends = list(args.backends)
+    if 'ansible-runner' in backends:
+        try:
+            import ansible_runner  # noqa: F401
+        except ImportError:
+            print('ansible-runner is not installed, skipping it')
+            backends.remove('ansible-runner')
+    executors = {'subprocess': SubprocessExecutor(), 'worker': WorkerExecutor(env)}
+
+    print(f'{args.files} files per host, {args.repeats} runs per backend and inventory on {os.cpu_count()} CPUs')
+    print(f"{'hosts':>5} {'backend':<15} {'first s':>8} {'median s':>9} {'min s':>6} {'events':>7}")
+    for count, inventory in inventories.items():
+        command = ['ansible-playbook', '-i', inventory, playbook, '-e', extra_vars]
+        for backend in backends:
+            timings = []
+            events = 0
+            for _ in range(args.repeats):
+                if backend == 'ansible-runner':
+                    elapsed, events = run_ansible_runner(playbook, inventory, extra_vars,
+                                                         event_environment(env), directory)
+                else:
+                    elapsed, events = run_executor(executors[backend], command, env)
+                timings.append(elapsed)
+            rest = timings[1:] or timings
+            print(f'{count:>5} {backend:<15} {timings[0]:>8.2f} {statistics.median(rest):>9.2f} '
+                  f'{min(rest):>6.2f} {events:>7}')
+    executors['worker'].stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Measure API latency while many log viewers are connected, with threaded and async log streams.
+
+Starts the backend app in-process under waitress (with its default worker
+threads and a throwaway DEPLOYMENT_LOGS_DIR) plus the asyncio log server.
+Viewers connect from a separate process, either to waitress (``threads``,
+every stream holds a worker thread) or to the async server (``async``).
+While a deployment keeps logging, sequential GET /api/logs/streams requests
+measure how responsive the regular API stays. The deployment then ends
+as ``completed`` (as systemd operations do), and ``closed`` counts the
+viewers whose stream the server ended after the final status.
+
+    python scripts/async_stream_benchmark.py [--viewers 1000] [--requests 50] [--modes none threads async]
+"""
+import argparse
+import asyncio
+import http.client
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+
+def run_viewers(port, path, viewers, connected, closed, stop):
+    async def viewer():
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n'.encode())
+            await writer.drain()
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                if b'"status"' in data:
+                    break
+            with connected.get_lock():
+                connected.value += 1
+            while await reader.read(65536):
+                pass
+            with closed.get_lock():
+                closed.value += 1
+        except OSError:
+            pass
+
+    async def main():
+        tasks = [asyncio.ensure_future(viewer()) for _ in range(viewers)]
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        # The deployment has finished; its streams should end on their own
+        await asyncio.wait(tasks, timeout=10)
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(main())
+
+
+def measure_api(port, count, timeout):
+    latencies, failures = [], 0
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+            conn.request('GET', '/api/logs/streams')
+            conn.getresponse().read()
+            conn.close()
+            latencies.append((time.perf_counter() - started) * 1000)
+        except OSError:
+            failures += 1
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=1000)
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=5, help='seconds before an API request counts as failed')
+    parser.add_argument('--modes', nargs='+', choices=('none', 'threads', 'async'), default=['none', 'threads', 'async'])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='async_stream_bench_')
+    os.environ.setdefault('DEPLOYMENT_LOGS_DIR', work_dir)
+    os.environ.setdefault('INVENTORY_FILE', os.path.join(work_dir, 'inventory', 'inventory.json'))
+    os.environ.setdefault('LOG_STREAM_MAX_SUBSCRIBERS', str(args.viewers))
+    os.environ.setdefault('LOG_STREAM_MAX_PER_DEPLOYMENT', str(args.viewers))
+    os.environ.pop('LOG_STREAM_ASYNC_PORT', None)
+    sys.path.insert(0, BACKEND_DIR)
+    import logging
+    logging.disable(logging.WARNING)
+    import app as backend
+    from streaming.async_log_server import AsyncLogServer
+    from waitress import create_server
+
+    # Same worker pool as app.py's serve() call
+    server = create_server(backend.app, host='127.0.0.1', port=0, asyncore_use_poll=True)
+    threading.Thread(target=server.run, daemon=True).start()
+    async_server = AsyncLogServer(backend.log_stream_hub, host='127.0.0.1', port=0)
+    async_server.start()
+
+    print(f"{args.viewers} viewers, {args.requests} API requests, waitress with {server.adj.threads} threads")
+    print(f"{'mode':<8} {'connected':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'failed':>7} {'closed':>7}")
+    for mode in args.modes:
+        deployment_id = str(uuid.uuid4())
+        backend.deployment_registry.create(deployment_id, {'id': deployment_id, 'type': 'file', 'status': 'running',
+                                                           'timestamp': time.time(), 'logs': []})
+        writing = threading.Event()
+        writing.set()
+
+        def writer():
+            n = 0
+            while writing.is_set():
+                backend.log_message(deployment_id, f'TASK [copy files] line {n}')
+                n += 1
+                time.sleep(0.02)
+
+        threading.Thread(target=writer, daemon=True).start()
+        connected = multiprocessing.Value('i', 0)
+        closed = multiprocessing.Value('i', 0)
+        stop = multiprocessing.Event()
+        clients = None
+        if mode != 'none':
+            port = server.effective_port if mode == 'threads' else async_server.port
+            clients = multiprocessing.Process(target=run_viewers, args=(port, f'/api/deploy/{deployment_id}/logs',
+                                                                        args.viewers, connected, closed, stop))
+            clients.start()
+            deadline = time.time() + 10
+            while connected.value < args.viewers and time.time() < deadline:
+                time.sleep(0.1)
+
+        latencies, failures = measure_api(server.effective_port, args.requests, args.timeout)
+        writing.clear()
+        backend.deployment_registry.update_status(deployment_id, 'completed')
+        stop.set()
+        if clients is not None:
+            clients.join(15)
+            if clients.is_alive():
+                clients.terminate()
+        if latencies:
+            latencies.sort()
+            print(f"{mode:<8} {connected.value:>9} {statistics.median(latencies):>8.1f} "
+                  f"{latencies[max(int(len(latencies) * 0.99) - 1, 0)]:>8.1f} {latencies[-1]:>8.1f} {failures:>7} "
+                  f"{closed.value:>7}")
+        else:
+            print(f"{mode:<8} {connected.value:>9} {'-':>8} {'-':>8} {'-':>8} {failures:>7} {closed.value:>7}")
+        # Let the previous mode's connections drain before the next one
+        time.sleep(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Compare history snapshot formats: write/read latency and size on disk.
+
+Formats needing packages that are not installed (msgpack, zstandard) are
+skipped; orjson is used for JSON when available.
+
+    python scripts/history_serialization_benchmark.py [--sizes 1000 10000 100000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage import serialization
+from storage.serialization import available_formats, read_snapshot, write_snapshot
+
+
+def make_history(count):
+    history = {}
+    now = time.time()
+    for i in range(count):
+        deployment_id = str(uuid.uuid4())
+        history[deployment_id] = {
+            'id': deployment_id,
+            'type': ('file', 'sql', 'systemd', 'template')[i % 4],
+            'status': 'success' if i % 7 else 'failed',
+            'timestamp': now - i * 60,
+            'ft': f'ft-{1000 + i % 300}',
+            'files': [f'file_{j}.jar' for j in range(i % 5 + 1)],
+            'vms': ['batch1', 'batch2', 'imdg1'][:i % 3 + 1],
+            'target_path': '/home/infadm/app/lib',
+            'target_user': 'infadm',
+            'logged_in_user': f'user{i % 12}',
+            'log_count': 200 + i % 50,
+        }
+    return history
+
+
+def measure(path, write, read):
+    started = time.perf_counter()
+    write()
+    write_time = time.perf_counter() - started
+    started = time.perf_counter()
+    loaded = read()
+    read_time = time.perf_counter() - started
+    return write_time, read_time, os.path.getsize(path), len(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='history_format_bench_')
+    print(f"JSON encoder: {'orjson' if serialization.orjson else 'json (stdlib)'}")
+    print(f"{'deployments':>11}  {'format':<22} {'write ms':>10} {'read ms':>10} {'size KB':>10}")
+    for count in args.sizes:
+        history = make_history(count)
+        rows = [(deployment_id, json.dumps(data, default=str, separators=(',', ':')))
+                for deployment_id, data in history.items()]
+
+        path = os.path.join(work_dir, f'legacy-{count}.json')
+
+        def write_legacy():
+            with open(path, 'w') as f:
+                json.dump(history, f, default=str, indent=2)
+
+        def read_legacy():
+            with open(path) as f:
+                return json.load(f)
+
+        results = [('json indent=2 (old)',) + measure(path, write_legacy, read_legacy)]
+        for fmt in available_formats():
+            path = os.path.join(work_dir, f'{fmt}-{count}.snapshot')
+
+            def write():
+                with open(path, 'wb') as f:
+                    write_snapshot(f, rows, fmt)
+
+            results.append((fmt,) + measure(path, write, lambda: read_snapshot(path)))
+
+        for fmt, write_time, read_time, size, loaded in results:
+            assert loaded == count, f"{fmt} read back {loaded} of {count} deployments"
+            print(f"{count:>11}  {fmt:<22} {write_time * 1000:>10.1f} {read_time * 1000:>10.1f} {size / 1024:>10.0f}")
+    print(f"files kept in {work_dir}")
+
+
+if __name__ == '__main__':
+    main()
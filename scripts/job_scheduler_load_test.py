@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Send a burst of jobs through the JobScheduler and compare it with starting a thread per job.
+
+Each job stands in for an ansible run: it starts a child process that burns
+``--job-seconds`` of CPU time, so concurrent jobs compete for CPU the way
+playbook runs do. ``threads`` starts all jobs at once, like the endpoints
+did; ``pool`` submits them to a JobScheduler with ``--workers`` workers and
+a throwaway job queue. The report shows the peak number of jobs running at
+once, the time until the last job finished, and how long jobs took from
+submission to completion.
+
+    python scripts/job_scheduler_load_test.py [--jobs 100] [--workers 4] [--job-seconds 0.2]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from execution.job_scheduler import JobScheduler
+from storage.job_queue import JobQueue
+
+BUSY_CHILD = 'import sys, time\nend = time.process_time() + float(sys.argv[1])\nwhile time.process_time() < end: pass'
+
+
+class Probe:
+    def __init__(self, job_seconds):
+        self.job_seconds = job_seconds
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+        self.submitted = {}
+        self.latencies = []
+        self.done = threading.Semaphore(0)
+
+    def job(self, deployment_id):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        subprocess.run([sys.executable, '-c', BUSY_CHILD, str(self.job_seconds)], check=True)
+        with self.lock:
+            self.running -= 1
+            self.latencies.append(time.perf_counter() - self.submitted[deployment_id])
+        self.done.release()
+
+
+def run(mode, jobs, workers, job_seconds):
+    probe = Probe(job_seconds)
+    scheduler = None
+    if mode == 'pool':
+        queue = JobQueue(os.path.join(tempfile.mkdtemp(prefix='job_load_'), 'jobs.db'))
+        scheduler = JobScheduler(queue, workers=workers, limit=0)
+        scheduler.register('load', probe.job)
+        scheduler.start(recover=False)
+    started = time.perf_counter()
+    for n in range(jobs):
+        deployment_id = f'job-{n}'
+        probe.submitted[deployment_id] = time.perf_counter()
+        if scheduler is not None:
+            scheduler.submit('load', deployment_id)
+        else:
+            threading.Thread(target=probe.job, args=(deployment_id,)).start()
+    for _ in range(jobs):
+        probe.done.acquire()
+    makespan = time.perf_counter() - started
+    latencies = sorted(probe.latencies)
+    stats = scheduler.stats() if scheduler is not None else None
+    return probe.peak, makespan, latencies, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--job-seconds', type=float, default=0.2)
+    parser.add_argument('--modes', nargs='+', choices=('threads', 'pool'), default=['threads', 'pool'])
+    args = parser.parse_args()
+
+    print(f'{args.jobs} jobs of {args.job_seconds}s CPU each on {os.cpu_count()} CPUs, {args.workers} workers in the pool')
+    print(f"{'mode':<8} {'peak running':>12} {'total s':>8} {'p50 done s':>10} {'p95 done s':>10} {'first done s':>12}")
+    for mode in args.modes:
+        peak, makespan, latencies, stats = run(mode, args.jobs, args.workers, args.job_seconds)
+        print(f'{mode:<8} {peak:>12} {makespan:>8.1f} {statistics.median(latencies):>10.2f} '
+              f'{latencies[int(len(latencies) * 0.95)]:>10.2f} {latencies[0]:>12.2f}')
+        if stats:
+            print(f"         queue wait p50 {stats['wait_seconds']['p50']}s, p95 {stats['wait_seconds']['p95']}s, "
+                  f"max {stats['wait_seconds']['max']}s")
+
+
+if __name__ == '__main__':
+    main()
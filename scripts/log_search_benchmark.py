@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Measure full-text log search latency over a few million indexed log lines.
+
+Fills a throwaway LogRecordStore with synthetic ansible output of many
+file deployments and commands (20 hosts, a few tasks each) and then times
+typical /api/logs/search queries: a file name, a phrase, a phrase limited
+to a deployment type and time range, and a common term sorted by recency.
+
+    python scripts/log_search_benchmark.py [--deployments 500] [--lines 4000] [--repeat 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage.log_records import LogRecordStore
+
+FILES = ['gimdg_classes.jar', 'fixlib.so', 'settings.properties', 'batch_runner.sh', 'orders.xml']
+
+
+def deployment_lines(n, count, hosts):
+    lines = [f'Executing: ansible-playbook -i /tmp/inventory_{n} /tmp/file_deploy_{n}.yml',
+             'PLAY [Deploy files] ******************************************************']
+    task = 0
+    while len(lines) < count:
+        target = FILES[(n + task) % len(FILES)]
+        lines.append(f'TASK [Copy {target}] ****************************************************')
+        for h in range(hosts):
+            host = f'batch{h + 1}'
+            lines.append(f'<{host}> ESTABLISH SSH CONNECTION FOR USER: infadm')
+            lines.append(f'<{host}> SSH: EXEC ssh -C -o ControlMaster=auto -o ControlPersist=60s {host} /bin/sh')
+            if (n * 31 + task * 7 + h) % 211 == 0:
+                lines.append(f'fatal: [{host}]: FAILED! => {{"msg": "Destination /app/{target} not writable: '
+                             f'Permission denied"}}')
+            else:
+                lines.append(f'changed: [{host}] => (item=/app/fixfiles/{target})')
+        task += 1
+    return lines[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--deployments', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=4000, help='log lines per deployment')
+    parser.add_argument('--hosts', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    store = LogRecordStore(os.path.join(tempfile.mkdtemp(prefix='log_search_bench_'), 'log_records.db'))
+    now = time.time()
+    started = time.perf_counter()
+    for n in range(args.deployments):
+        kind = 'command' if n % 4 == 3 else 'file'
+        timestamp = now - (args.deployments - n) * 600
+        lines = deployment_lines(n, args.lines, args.hosts)
+        store.append(f'deployment-{n}', [(seq, timestamp + seq * 0.01, text) for seq, text in enumerate(lines)],
+                     kind=kind, timestamp=timestamp)
+    total = args.deployments * args.lines
+    elapsed = time.perf_counter() - started
+    size = os.path.getsize(store.db_file) / 1024 / 1024
+    print(f'indexed {total:,} lines of {args.deployments} deployments in {elapsed:.1f}s '
+          f'({total / elapsed:,.0f} lines/s), {size:.0f} MB')
+
+    queries = [
+        ('file name', 'gimdg_classes.jar', {}),
+        ('phrase', '"permission denied"', {}),
+        ('phrase, type + last day', '"permission denied"', {'kinds': ['file'], 'since': now - 86400}),
+        ('file name on one host', 'gimdg_classes.jar', {'filters': {'host': ['batch1']}, 'sort': 'recent'}),
+        ('common term, recent', 'changed', {'sort': 'recent'}),
+    ]
+    print(f"{'query':<26} {'hits':>5} {'p50 ms':>8} {'max ms':>8}")
+    for name, query, options in queries:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            hits = store.search(query, limit=50, **options)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f'{name:<26} {len(hits):>5} {statistics.median(timings):>8.1f} {max(timings):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Compare log stream viewers woken by registry notifications with the old 1-second polling loop.
+
+Each viewer thread runs the loop of the SSE generator in
+``get_deployment_logs``: it sends every line it has not sent yet, then
+either sleeps for a second (``poll``, the old loop) or waits for the
+deployment to change (``notify``). A writer appends lines at a fixed rate
+through ``DeploymentRegistry.append_log``, followed by an idle period. The
+report shows how long lines took to reach viewers and how much CPU the
+process used while streaming and while idle.
+
+    python scripts/log_stream_load_test.py [--viewers 200] [--lines 200] [--rate 20] [--idle 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage.deployment_registry import DeploymentRegistry
+from storage.log_buffers import LogBuffers
+
+
+def run(mode, args):
+    registry = DeploymentRegistry({}, LogBuffers(segments=None))
+    deployment_id = str(uuid.uuid4())
+    registry.create(deployment_id, {'id': deployment_id, 'status': 'running', 'logs': []})
+    record = registry.records[deployment_id]
+    sent_at = {}
+    latencies = []
+    latencies_lock = threading.Lock()
+    ready = threading.Barrier(args.viewers + 1)
+
+    def viewer():
+        seen = 0
+        own = []
+        version = registry.version(deployment_id)
+        ready.wait()
+        while True:
+            new_lines = registry.read_logs(deployment_id, seen)
+            now = time.perf_counter()
+            for i in range(seen, seen + len(new_lines)):
+                own.append(now - sent_at[i])
+            seen += len(new_lines)
+            if record['status'] != 'running':
+                break
+            if mode == 'poll':
+                time.sleep(1)
+            else:
+                version = registry.wait_for_change(deployment_id, version, 15)
+        with latencies_lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=viewer, daemon=True) for _ in range(args.viewers)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+
+    cpu_started, started = time.process_time(), time.perf_counter()
+    for i in range(args.lines):
+        sent_at[i] = time.perf_counter()
+        registry.append_log(deployment_id, f'line {i}')
+        time.sleep(1 / args.rate)
+    streaming_cpu, streaming_wall = time.process_time() - cpu_started, time.perf_counter() - started
+
+    cpu_started = time.process_time()
+    time.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu_started
+
+    registry.update_status(deployment_id, 'success')
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'delivered': len(latencies),
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'max': latencies[-1] * 1000,
+        'streaming_cpu': streaming_cpu / streaming_wall * 100,
+        'idle_cpu': idle_cpu / args.idle * 100,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=200)
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=20, help='log lines per second')
+    parser.add_argument('--idle', type=float, default=5, help='seconds without output after the last line')
+    parser.add_argument('--modes', nargs='+', choices=('poll', 'notify'), default=['poll', 'notify'])
+    args = parser.parse_args()
+
+    print(f'{args.viewers} viewers, {args.lines} lines at {args.rate:g}/s, then {args.idle:g}s idle')
+    print(f"{'mode':<7} {'delivered':>9} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'cpu % streaming':>16} {'cpu % idle':>11}")
+    failed = False
+    for mode in args.modes:
+        result = run(mode, args)
+        failed |= result['delivered'] != args.viewers * args.lines
+        print(f"{mode:<7} {result['delivered']:>9} {result['p50']:>8.1f} {result['p99']:>8.1f} {result['max']:>8.1f} "
+              f"{result['streaming_cpu']:>16.1f} {result['idle_cpu']:>11.1f}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
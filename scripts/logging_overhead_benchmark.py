@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Measure the logging cost per output line in the deployment hot loop, before and after the queue pipeline.
+
+Each mode runs the body of the ``for line in process.stdout`` loops:
+``DeploymentRegistry.append_log`` plus the application logging of the line.
+
+- ``before``: the old setup. A synchronous RotatingFileHandler (DEBUG)
+  and console handler (INFO) on the app logger, records propagating to a
+  root-style DEBUG stream handler, and the line logged twice with eager
+  f-strings (in ``log_message`` and again in the loop).
+- ``queue``: ``start_log_pipeline``. One lazy ``output`` logger call
+  whose record is queued for the listener thread, with the output level
+  at DEBUG, so the lines still reach application.log.
+- ``queue-info``: the same with ``LOG_LEVELS="output=INFO"``, so the
+  lines are dropped at the level check.
+
+Stream handlers write to /dev/null and the file handler to a temporary
+directory. The report shows the time per line on the worker thread and
+the total time until every record was written.
+
+    python scripts/logging_overhead_benchmark.py [--lines 100000] [--modes before queue queue-info]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import uuid
+from logging.handlers import RotatingFileHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from logging_pipeline import start_log_pipeline, stop_log_pipeline
+from storage.deployment_registry import DeploymentRegistry
+from storage.log_buffers import LogBuffers
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def app_handlers(log_dir, devnull):
+    console_handler = logging.StreamHandler(devnull)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter(FORMAT))
+    file_handler = RotatingFileHandler(os.path.join(log_dir, 'application.log'), maxBytes=10485760, backupCount=10)
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    return [console_handler, file_handler]
+
+
+def run(mode, lines, devnull):
+    log_dir = tempfile.mkdtemp(prefix='logging_bench_')
+    # A fresh logger tree per mode: "<root>" stands in for the root logger, "<root>.app" for the app logger
+    root = logging.getLogger(f'bench-{uuid.uuid4().hex[:8]}')
+    root.propagate = False
+    app_logger = logging.getLogger(root.name + '.app')
+    app_logger.setLevel(logging.DEBUG)
+    output_logger = logging.getLogger(app_logger.name + '.output')
+    listener = None
+    if mode == 'before':
+        # What routes.db_routes' basicConfig(level=DEBUG) adds to the root logger
+        root_handler = logging.StreamHandler(devnull)
+        root_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(root_handler)
+        for handler in app_handlers(log_dir, devnull):
+            app_logger.addHandler(handler)
+    else:
+        levels = {output_logger.name: 'INFO'} if mode == 'queue-info' else {}
+        listener = start_log_pipeline(app_logger, app_handlers(log_dir, devnull), levels)
+        app_logger.propagate = False
+
+    registry = DeploymentRegistry({}, LogBuffers(segments=None))
+    deployment_id = str(uuid.uuid4())
+    registry.create(deployment_id, {'id': deployment_id, 'status': 'running', 'logs': []})
+    line = 'changed: [batch1] => (item=/app/fixfiles/gimdg_classes.jar) ' + 'x' * 40
+
+    started = time.perf_counter()
+    if mode == 'before':
+        for n in range(lines):
+            line_stripped = f'{line} {n}'
+            if registry.append_log(deployment_id, line_stripped):
+                app_logger.debug(f"[{deployment_id}] {line_stripped}")
+            app_logger.debug(f"[{deployment_id}] {line_stripped}")
+    else:
+        for n in range(lines):
+            line_stripped = f'{line} {n}'
+            if registry.append_log(deployment_id, line_stripped):
+                output_logger.debug("[%s] %s", deployment_id, line_stripped)
+    worker = time.perf_counter() - started
+    if listener is not None:
+        stop_log_pipeline(listener)
+    total = time.perf_counter() - started
+
+    for handler in app_logger.handlers + root.handlers:
+        handler.close()
+    return worker, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--modes', nargs='+', choices=('before', 'queue', 'queue-info'),
+                        default=['before', 'queue', 'queue-info'])
+    args = parser.parse_args()
+
+    print(f'{args.lines} output lines')
+    print(f"{'mode':<11} {'worker us/line':>15} {'total us/line':>14}")
+    with open(os.devnull, 'w') as devnull:
+        for mode in args.modes:
+            worker, total = run(mode, args.lines, devnull)
+            print(f'{mode:<11} {worker / args.lines * 1e6:>15.2f} {total / args.lines * 1e6:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
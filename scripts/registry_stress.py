@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Stress the deployment registry and history flusher with many concurrent writers.
+
+Each writer thread creates deployments, appends log lines and flips their
+status while reader threads serialize registry snapshots in a tight loop.
+At the end the journal is replayed and compared with the in-memory state.
+
+    python scripts/registry_stress.py [--writers 300] [--deployments 5] [--lines 50]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+from storage.deployment_registry import DeploymentRegistry
+from storage.deployment_repository import DeploymentRepository
+from storage.history_flusher import HistoryFlusher
+from storage.history_journal import HistoryJournal
+from storage.lazy_deployments import LazyDeploymentDict
+from storage.log_buffers import LogBuffers
+from storage.log_segments import LogSegmentStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=300)
+    parser.add_argument('--deployments', type=int, default=5, help='deployments per writer')
+    parser.add_argument('--lines', type=int, default=50, help='log lines per deployment')
+    parser.add_argument('--readers', type=int, default=4)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='registry_stress_')
+    repository = DeploymentRepository(os.path.join(work_dir, 'deployments.db'))
+    journal = HistoryJournal(os.path.join(work_dir, 'deployment_history.json'))
+    segments = LogSegmentStore(os.path.join(work_dir, 'deployment_logs'))
+    deployments = LazyDeploymentDict(repository.get)
+    log_buffers = LogBuffers(segments, max_lines=20)
+    registry = DeploymentRegistry(deployments, log_buffers)
+    deployments.on_load = registry.loaded
+    flusher = HistoryFlusher(journal, repository, segments, registry.snapshot, window=0.05)
+    registry.persister = flusher
+    log_buffers.flush = flusher.flush
+    flusher.start()
+
+    errors = []
+    done = threading.Event()
+    snapshots_taken = [0]
+
+    def writer():
+        try:
+            for index in range(args.deployments):
+                deployment_id = str(uuid.uuid4())
+                registry.create(deployment_id, {'id': deployment_id, 'type': 'file', 'status': 'running',
+                                                'timestamp': time.time(), 'logs': []})
+                for n in range(args.lines):
+                    registry.append_log(deployment_id, f'line {n}')
+                    if n % 10 == 0:
+                        registry.update(deployment_id, progress=n)
+                # Every other one ends the way systemd operations do
+                status = 'completed' if index % 2 else 'success'
+                registry.update_status(deployment_id, status, end_time=time.time())
+        except Exception as e:
+            errors.append(f'writer: {e!r}')
+
+    def reader():
+        try:
+            while not done.is_set():
+                for deployment_id in list(deployments.keys()):
+                    snapshot = registry.snapshot(deployment_id)
+                    if snapshot is not None:
+                        json.dumps(snapshot, default=str)
+                        snapshots_taken[0] += 1
+        except Exception as e:
+            errors.append(f'reader: {e!r}')
+
+    readers = [threading.Thread(target=reader) for _ in range(args.readers)]
+    writers = [threading.Thread(target=writer) for _ in range(args.writers)]
+    started = time.time()
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.time() - started
+    done.set()
+    for thread in readers:
+        thread.join()
+    flusher.flush()
+
+    replayed = {}
+    journal.replay(replayed)
+    total = args.writers * args.deployments
+    in_memory = len(deployments)
+    in_memory_completed = sum(1 for deployment in dict.values(deployments) if deployment.get('status') == 'completed')
+    # Finished deployments beyond the registry's keep_finished were evicted; looking them up reloads them
+    for deployment_id in list(replayed):
+        deployment = deployments[deployment_id]
+        expected = {k: v for k, v in deployment.items() if k != 'logs'}
+        if replayed.get(deployment_id) != json.loads(json.dumps(expected, default=str)):
+            errors.append(f'journal mismatch for {deployment_id}')
+        if len(segments.read(deployment_id)) != args.lines:
+            errors.append(f'log segment of {deployment_id} has {len(segments.read(deployment_id))} lines')
+        if registry.read_logs(deployment_id, total=args.lines) != [f'line {n}' for n in range(args.lines)]:
+            errors.append(f'log lines of {deployment_id} read back out of order')
+
+    print(f'{total} deployments, {total * args.lines} log lines from {args.writers} writers in {elapsed:.2f}s')
+    print(f'{in_memory} finished deployments still in memory ({in_memory_completed} completed, '
+          f'keep_finished {registry.keep_finished})')
+    print(f'{snapshots_taken[0]} snapshots serialized by {args.readers} readers, {flusher.flush_count} flushes')
+    print(f'work dir: {work_dir}')
+    for error in errors[:20]:
+        print(f'ERROR {error}')
+    return 1 if errors or len(replayed) != total else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Measure log stream throughput and server CPU per viewer, with per-line and batched SSE events.
+
+Starts the backend app in-process under waitress (with a throwaway
+DEPLOYMENT_LOGS_DIR), connects viewers to /api/deploy/<id>/logs from a
+separate process and appends lines as fast as ``log_message`` allows. The
+report shows how many lines per second reached the viewers and how much
+server CPU each viewer cost (the writer's own CPU is subtracted).
+
+    python scripts/sse_stream_benchmark.py [--viewers 20] [--lines 20000] [--modes line batch]
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+
+def viewer(port, path, counts, index, connected):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    conn.request('GET', path, headers={'Accept': 'text/event-stream'})
+    response = conn.getresponse()
+    received = 0
+    for raw in response:
+        if not raw.startswith(b'data: '):
+            continue
+        event = json.loads(raw[6:])
+        if 'message' in event:
+            received += 1
+        elif 'messages' in event:
+            received += len(event['messages'])
+        elif event.get('status') == 'running':
+            connected.release()
+        elif 'status' in event or 'error' in event:
+            break
+    counts[index] = received
+    conn.close()
+
+
+def run_viewers(port, path, viewers, counts, connected):
+    threads = [threading.Thread(target=viewer, args=(port, path, counts, i, connected)) for i in range(viewers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, default=20)
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--modes', nargs='+', choices=('line', 'batch'), default=['line', 'batch'])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='sse_bench_')
+    os.environ.setdefault('DEPLOYMENT_LOGS_DIR', work_dir)
+    os.environ.setdefault('INVENTORY_FILE', os.path.join(work_dir, 'inventory', 'inventory.json'))
+    sys.path.insert(0, BACKEND_DIR)
+    import logging
+    logging.disable(logging.WARNING)
+    import app as backend
+    from waitress import create_server
+
+    server = create_server(backend.app, host='127.0.0.1', port=0, threads=args.viewers + 4)
+    port = server.effective_port
+    threading.Thread(target=server.run, daemon=True).start()
+
+    line = 'TASK [copy files] ' + 'x' * 80
+    print(f'{args.viewers} viewers, {args.lines} lines of {len(line)} characters')
+    print(f"{'mode':<6} {'lines/s delivered':>18} {'server cpu ms/viewer':>21} {'wall s':>8}")
+    for mode in args.modes:
+        deployment_id = str(uuid.uuid4())
+        backend.deployment_registry.create(deployment_id, {'id': deployment_id, 'type': 'file', 'status': 'running',
+                                                           'timestamp': time.time(), 'logs': []})
+        path = f'/api/deploy/{deployment_id}/logs' + ('?batch=1' if mode == 'batch' else '')
+        counts = multiprocessing.Array('l', args.viewers)
+        connected = multiprocessing.Semaphore(0)
+        clients = multiprocessing.Process(target=run_viewers, args=(port, path, args.viewers, counts, connected))
+        clients.start()
+        for _ in range(args.viewers):
+            connected.acquire()
+
+        cpu_started, started = time.process_time(), time.perf_counter()
+        writer_cpu = time.thread_time()
+        for n in range(args.lines):
+            backend.log_message(deployment_id, f'{line} {n}')
+        backend.deployment_registry.update_status(deployment_id, 'success')
+        writer_cpu = time.thread_time() - writer_cpu
+        clients.join()
+        wall = time.perf_counter() - started
+        server_cpu = time.process_time() - cpu_started - writer_cpu
+
+        delivered = sum(counts)
+        if delivered != args.viewers * args.lines:
+            print(f'{mode}: only {delivered} of {args.viewers * args.lines} lines delivered')
+        print(f"{mode:<6} {delivered / wall:>18,.0f} {server_cpu / args.viewers * 1000:>21.1f} {wall:>8.2f}")
+    server.close()
+
+
+if __name__ == '__main__':
+    main()